@@ -78,14 +78,10 @@ def create_demo_data():
             {"name": "API测试员", "email": "tester@api.com", "age": 26}
         ]
         
-        for user_data in demo_users:
-            try:
-                user_request = CreateUserRequest(**user_data)
-                service.create_user(user_request)
-                print(f"  ➕ 添加用户: {user_data['name']}")
-            except ValueError:
-                # 用户已存在，跳过
-                pass
+        # 批量写入，只持久化一次；已存在的用户会出现在 errors 中，直接跳过
+        created, _ = service.bulk_create([CreateUserRequest(**u).dict() for u in demo_users])
+        for user in created:
+            print(f"  ➕ 添加用户: {user['name']}")
         
         print(f"✅ 演示数据创建完成，当前用户总数: {len(service.get_all_users())}")
         
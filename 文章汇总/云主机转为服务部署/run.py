@@ -4,6 +4,7 @@
 
 使用方式：
   python run.py                    # 启动开发服务器
+  python run.py --serve --workers 4  # 启动多进程生产服务器
   python run.py --test            # 运行测试
   python run.py --monitor         # 启动监控
   python run.py --deploy aws      # 部署到AWS
@@ -37,6 +38,18 @@ def run_dev_server(host="127.0.0.1", port=8000):
     except KeyboardInterrupt:
         print("\n⏹️ 服务器已停止")
 
+def run_production_server(host="0.0.0.0", port=8000, workers=None, max_requests=None,
+                          graceful_timeout=30):
+    """启动多进程生产服务器（预加载应用，SIGHUP 滚动重启）"""
+    try:
+        from src.server import serve
+    except ImportError as e:
+        print(f"❌ 导入失败: {e}")
+        print("请先安装依赖: pip install -r deployment/requirements.txt")
+        sys.exit(1)
+    serve(host=host, port=port, workers=workers, max_requests=max_requests,
+          graceful_timeout=graceful_timeout)
+
 def run_tests():
     """运行测试"""
     print("🧪 运行测试套件...")
@@ -203,6 +216,8 @@ def main():
         epilog="""
 示例用法:
   python run.py                     # 启动开发服务器
+  python run.py --serve --host 0.0.0.0 --workers 4 --max-requests 10000
+                                   # 多进程生产服务器（kill -HUP <主进程PID> 滚动重启）
   python run.py --test             # 运行测试
   python run.py --load-test        # 运行负载测试
   python run.py --monitor          # 启动监控
@@ -214,6 +229,11 @@ def main():
     
     parser.add_argument("--host", default="127.0.0.1", help="服务器主机地址")
     parser.add_argument("--port", type=int, default=8000, help="服务器端口")
+    parser.add_argument("--serve", action="store_true", help="启动多进程生产服务器")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker 进程数（默认CPU核数）")
+    parser.add_argument("--max-requests", type=int, default=0,
+                        help="每个 worker 处理多少请求后重启（0 表示不限制）")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="worker 优雅退出的超时时间(秒)")
     parser.add_argument("--test", action="store_true", help="运行测试套件")
     parser.add_argument("--load-test", action="store_true", help="运行负载测试")
     parser.add_argument("--monitor", action="store_true", help="启动性能监控")
@@ -240,6 +260,9 @@ def main():
             run_monitor(args.url, args.duration // 3600 or 1)  # 转换为小时
         elif args.deploy:
             deploy_to_platform(args.deploy, args.stage)
+        elif args.serve:
+            run_production_server(args.host, args.port, args.workers,
+                                  args.max_requests or None, args.graceful_timeout)
         else:
             # 默认启动开发服务器
             run_dev_server(args.host, args.port)
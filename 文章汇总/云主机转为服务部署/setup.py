@@ -61,6 +61,11 @@ setup(
             "psutil>=5.9.0",
             "prometheus-client>=0.17.0",
         ],
+        "performance": [
+            "orjson>=3.8.0",
+            "brotli>=1.0.9",
+            "zstandard>=0.21.0",
+        ],
         "all": [
             "pytest>=7.4.0",
             "pytest-asyncio>=0.21.0", 
@@ -72,6 +77,9 @@ setup(
             "boto3>=1.34.0",
             "psutil>=5.9.0",
             "prometheus-client>=0.17.0",
+            "orjson>=3.8.0",
+            "brotli>=1.0.9",
+            "zstandard>=0.21.0",
         ],
     },
     entry_points={
@@ -1,10 +1,12 @@
-from fastapi import FastAPI, HTTPException, Query, Depends
+from fastapi import FastAPI, HTTPException, Query, Path, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import textwrap
 import time
 from datetime import datetime
+from typing import Optional
 import os
 import sys
 
@@ -13,13 +15,22 @@ sys.path.append(os.path.dirname(__file__))
 
 from models.schemas import (
     APIResponse, CreateUserRequest, UpdateUserRequest, 
-    HealthCheck, UserModel
+    HealthCheck, UserModel, BulkCreateRequest, BulkUpdateRequest, BulkDeleteRequest, BatchGetRequest
 )
 from services.api_service import UserService
 from utils.helpers import (
     timer, validate_age, validate_email, sanitize_string,
-    format_response, log_request, log_response, performance_monitor
+    format_response, log_request, log_response, performance_monitor,
+    encode_cursor, decode_cursor, validate_user_fields, iter_ndjson, iter_csv, iter_json_response, parse_fields
 )
+from utils.responses import FastJSONResponse, api_response
+from utils.etag import etag_headers, etag_matches, make_etag, not_modified, params_tag
+from utils.cache import response_cache
+from utils.compression import CompressionMiddleware, PrecompressedAsset, available_encodings
+from utils.admission import AdmissionMiddleware, control_from_env
+from utils.metrics import function_timings, persistence_timings, route_metrics
+from utils import prometheus
+from services.storage import USER_COLUMNS, USER_FIELDS
 
 # 应用生命周期管理
 @asynccontextmanager
@@ -36,6 +47,7 @@ async def lifespan(app: FastAPI):
 
 # 创建FastAPI应用
 app = FastAPI(
+    default_response_class=FastJSONResponse,
     title="🚀 云主机用户管理API",
     description="""
     ## 📋 项目简介
@@ -81,6 +93,11 @@ app = FastAPI(
     ]
 )
 
+# 准入控制与限流：全局/按路由类别的并发上限 + 有界等待队列（503），按客户端令牌桶限流（429）。
+# 先于 CORS 添加（位于其内层），被拒绝的响应同样带 CORS 头
+admission = control_from_env()
+app.add_middleware(AdmissionMiddleware, control=admission)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -90,34 +107,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩：小响应不压缩，流式导出逐块压缩，大响应体在线程池中压缩
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+    encodings=available_encodings(os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip")),
+    thread_min_size=int(os.getenv("COMPRESSION_THREAD_MIN_SIZE", str(256 * 1024))),
+)
+
 # 创建服务实例
 user_service = UserService()
 
+# 批量接口单次最多处理的条目数
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# 年龄范围查询匹配的用户数达到该值时流式返回（不缓存），以下的整体构造并缓存
+AGE_RANGE_STREAM_MIN = int(os.getenv("AGE_RANGE_STREAM_MIN", "1000"))
+
+# 导出格式 -> (Content-Type, 文件扩展名)，text/* 类型由 Starlette 自动追加 charset=utf-8
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+}
+
 # 依赖注入
 def get_user_service() -> UserService:
     return user_service
 
+def route_template(request) -> Optional[str]:
+    """请求匹配到的路由模板（如 /users/{user_id}），未匹配时返回 None"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None)
+
+def projection(fields: Optional[str]) -> Optional[tuple]:
+    """解析 fields= 查询参数，不合法时返回400"""
+    try:
+        return parse_fields(fields, USER_COLUMNS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def cached_json(body: bytes, headers: Optional[dict] = None) -> Response:
+    """用缓存的已序列化响应体构造响应"""
+    return Response(body, media_type="application/json", headers=headers)
+
 # 中间件：请求性能监控
 @app.middleware("http")
 async def performance_middleware(request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
+    performance_monitor.in_flight += 1
     try:
         response = await call_next(request)
-        process_time = time.time() - start_time
-        performance_monitor.record_request(process_time, False)
+        end_time = time.perf_counter()
+        process_time = end_time - start_time
+        performance_monitor.record_request(process_time, False, end_time)
+        route_metrics.record(request.method, route_template(request), response.status_code, process_time)
         response.headers["X-Process-Time"] = str(process_time)
         response.headers["X-Cloud-Instance"] = "gpu-4090-96g-instance-318"
         return response
     except Exception as e:
-        process_time = time.time() - start_time
-        performance_monitor.record_request(process_time, True)
+        end_time = time.perf_counter()
+        performance_monitor.record_request(end_time - start_time, True, end_time)
+        route_metrics.record(request.method, route_template(request), 500, end_time - start_time)
         raise e
+    finally:
+        performance_monitor.in_flight -= 1
 
-# 自定义首页
-@app.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def custom_homepage():
-    """自定义API首页"""
-    html_content = """
+# 首页内容固定，启动时渲染一次并生成 gzip / br 版本
+HOMEPAGE_HTML = """
     <!DOCTYPE html>
     <html lang="zh-CN">
     <head>
@@ -244,7 +300,16 @@ async def custom_homepage():
     </body>
     </html>
     """
-    return HTMLResponse(content=html_content)
+HOMEPAGE = PrecompressedAsset(textwrap.dedent(HOMEPAGE_HTML).strip().encode("utf-8"), "text/html")
+
+# 自定义首页
+@app.get("/", response_class=HTMLResponse, include_in_schema=False)
+async def custom_homepage(
+    accept_encoding: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """自定义API首页（启动时预先渲染并压缩）"""
+    return HOMEPAGE.response(accept_encoding, if_none_match)
 
 # 健康检查端点
 @app.get("/health", response_model=HealthCheck, tags=["系统监控"])
@@ -277,37 +342,101 @@ async def get_stats():
     - 错误请求数
     - 平均响应时间
     - 错误率
+    - 延迟分位数（`latency_ms`: p50 / p90 / p99 / p99.9 / max）
+    - 最近 1/5/15 分钟的吞吐量（`throughput_rps`，请求/秒）
     - 用户数量
+    - 各端点处理函数的耗时直方图（`function_timings`，单位毫秒）
+    - 响应缓存的命中 / 未命中 / 淘汰 / 失效次数（`response_cache`）
+    - 准入控制的当前并发数、排队数、拒绝次数与限流次数（`admission`）
     """
     stats = performance_monitor.get_stats()
-    stats["user_count"] = len(user_service.get_all_users())
+    stats["user_count"] = user_service.count_users()
     stats["cloud_instance"] = "gpu-4090-96g-instance-318"
     stats["jupyter_lab_url"] = "https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/lab/tree/data/changetest"
+    stats["function_timings"] = function_timings.snapshot()
+    stats["response_cache"] = response_cache.stats()
+    stats["admission"] = admission.stats()
     
-    return APIResponse(
+    return api_response(
         success=True,
         message="获取统计信息成功",
         data=stats
     )
 
+# 按路由统计
+@app.get("/stats/routes", response_model=APIResponse, tags=["系统监控"])
+async def get_route_stats():
+    """
+    按路由统计请求
+    
+    以路由模板 + 方法为单位（如 `GET /users/{user_id}`），按请求数降序返回：
+    - 请求数与状态码类别分布（2xx / 4xx / 5xx ...）
+    - 错误率（5xx 占比）与客户端错误率（4xx 占比）
+    - 延迟分位数（p50 / p90 / p99 / p99.9 / max，毫秒）
+    
+    未匹配任何路由的请求统一记为 `<unmatched>`。
+    """
+    routes = route_metrics.snapshot()
+    return api_response(
+        success=True,
+        message=f"获取路由统计成功，共{len(routes)}条路由",
+        data={"routes": routes}
+    )
+
+# Prometheus 指标
+@app.get("/metrics", tags=["系统监控"], summary="Prometheus 指标",
+         response_class=Response, responses={200: {"content": {"text/plain": {}}}})
+async def get_metrics():
+    """
+    Prometheus 文本格式的指标
+    
+    - `http_requests_total`: 按路由模板 / 方法 / 状态码类别的请求数
+    - `http_request_duration_seconds`: 按路由模板 / 方法的延迟直方图
+    - `http_requests_in_flight`: 正在处理的请求数
+    - `app_function_duration_seconds`: @timer 函数耗时直方图
+    - `storage_flush_duration_seconds`: 持久化耗时直方图
+    - `app_users`: 用户数
+    - `process_resident_memory_bytes`: 进程常驻内存
+    
+    全部来自预先聚合的计数器，抓取开销只与序列数有关。
+    """
+    content = prometheus.render_metrics(
+        route_metrics, function_timings, persistence_timings,
+        in_flight=performance_monitor.in_flight,
+        user_count=user_service.count_users()
+    )
+    return Response(content, media_type=prometheus.CONTENT_TYPE)
+
 # 获取所有用户
 @app.get("/users", response_model=APIResponse, tags=["用户管理"], 
-         summary="获取用户列表", description="获取所有用户信息，支持分页查询")
+         summary="获取用户列表", description="获取所有用户信息，支持偏移量分页和游标分页")
 @timer
 async def get_users(
     limit: int = Query(100, ge=1, le=1000, description="返回用户数量限制", example=10),
     offset: int = Query(0, ge=0, description="跳过的用户数量", example=0),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入后忽略 offset"),
+    fields: Optional[str] = Query(None, description="只返回的字段，逗号分隔（id 总是返回）", example="id,name"),
+    if_none_match: Optional[str] = Header(None, description="上次响应的 ETag，数据未变化时返回 304"),
     service: UserService = Depends(get_user_service)
 ):
     """
     获取用户列表
     
-    支持分页查询，返回用户数据和分页信息。
+    支持两种分页方式，返回用户数据和分页信息：
+    - 偏移量分页: `offset` + `limit`
+    - 游标分页: 传入上一页的 `next_cursor`，从上一页最后一个用户之后继续，
+      翻页深度不影响性能，翻页期间删除用户也不会导致数据错位
     
     **示例请求:**
     ```
     GET /users?limit=10&offset=0
+    GET /users?limit=10&cursor=aWQ6MTA
+    GET /users?limit=1000&fields=id,name
     ```
+
+    `fields` 指定后每个用户只包含这些字段（在存储层完成投影），响应中也不再附带 `cloud_api_url`。
+
+    响应带 `ETag`，任何用户数据变化后改变；请求携带 `If-None-Match` 且数据未变化时返回 304。
     
     **示例响应:**
     ```json
@@ -318,39 +447,330 @@ async def get_users(
             "users": [...],
             "total": 3,
             "limit": 10,
-            "offset": 0
+            "offset": 0,
+            "has_more": false,
+            "next_cursor": null
         }
     }
     ```
     """
+    after_id = None
+    if cursor is not None:
+        try:
+            after_id = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    columns = projection(fields)
+
+    # 先取版本再取数据：并发修改时 ETag 和缓存的版本只会比数据旧
+    version_tag = service.version_tag()
+    cache_key = ("users", limit, offset if after_id is None else None, cursor, columns)
+    etag = make_etag("users", params_tag(*cache_key[1:]), version_tag)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    body = response_cache.get(cache_key, version_tag)
+    if body is not None:
+        return cached_json(body, etag_headers(etag))
+
     try:
-        all_users = service.get_all_users()
-        total = len(all_users)
-        users = all_users[offset:offset + limit]
+        total = service.count_users()
+        if after_id is not None:
+            # 多取一个用于判断是否还有下一页
+            users = service.get_users_after(after_id, limit + 1, columns)
+            has_more = len(users) > limit
+            users = users[:limit]
+        else:
+            users = service.get_all_users(offset=offset, limit=limit, fields=columns)
+            has_more = (offset + limit) < total
         
         result = {
             "users": users,
             "total": total,
             "limit": limit,
-            "offset": offset,
-            "has_more": (offset + limit) < total,
-            "cloud_api_url": "https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users"
+            "offset": offset if after_id is None else None,
+            "cursor": cursor,
+            "has_more": has_more,
+            "next_cursor": encode_cursor(users[-1]["id"]) if has_more and users else None,
         }
+        if columns is None:
+            result["cloud_api_url"] = "https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users"
         
-        return APIResponse(
+        response = api_response(
             success=True,
             message=f"获取用户列表成功，共{total}个用户",
-            data=result
+            data=result,
+            headers=etag_headers(etag)
         )
+        response_cache.put(cache_key, version_tag, response.body)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取用户列表失败: {str(e)}")
 
+# 导出全部用户
+@app.get("/users/export", tags=["用户管理"],
+         summary="导出全部用户", description="以 NDJSON 或 CSV 流式导出全部用户")
+@timer
+async def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="导出格式: ndjson / csv"),
+    chunk_size: int = Query(1000, ge=1, le=10000, description="每次从存储读取并发送的用户数"),
+    service: UserService = Depends(get_user_service)
+):
+    """
+    导出全部用户
+    
+    按ID顺序分块读取（游标方式），每块编码后立即发送，内存占用与用户总数无关。
+    导出期间新增或删除的用户不会导致重复或错位。
+    
+    **示例请求:**
+    ```
+    GET /users/export
+    GET /users/export?format=csv
+    ```
+    
+    **NDJSON 响应（每行一个用户）:**
+    ```
+    {"id": 1, "name": "张三", "email": "zhangsan@example.com", "age": 25}
+    {"id": 2, "name": "李四", "email": "lisi@example.com", "age": 30}
+    ```
+    """
+    media_type, extension = EXPORT_FORMATS[format]
+    chunks = service.iter_user_chunks(chunk_size)
+    if format == "csv":
+        body = iter_csv(chunks, ("id",) + USER_FIELDS)
+    else:
+        body = iter_ndjson(chunks)
+    
+    # 同步生成器由 Starlette 在线程池中迭代，读取存储不会阻塞事件循环
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="users.{extension}"'}
+    )
+
+# 批量接口公共逻辑
+def check_bulk_size(count: int):
+    """检查批量请求条目数"""
+    if count == 0:
+        raise HTTPException(status_code=400, detail="批量请求不能为空")
+    if count > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"单次批量请求最多{BULK_MAX_ITEMS}条")
+
+def merge_bulk_errors(validation_errors: list, service_errors: list, positions: list) -> list:
+    """合并校验错误与服务层错误，服务层的下标映射回请求中的位置"""
+    errors = validation_errors + [{**e, "index": positions[e["index"]]} for e in service_errors]
+    return sorted(errors, key=lambda e: e["index"])
+
+# 批量创建用户
+@app.post("/users/bulk", response_model=APIResponse, tags=["批量操作"],
+          summary="批量创建用户", description="一次请求创建多个用户，整批只持久化一次")
+@timer
+async def bulk_create_users(
+    request: BulkCreateRequest,
+    service: UserService = Depends(get_user_service)
+):
+    """
+    批量创建用户
+    
+    逐条校验（规则同单个创建），合法的条目一次性写入，返回逐条错误。
+    部分条目失败不影响其他条目。
+    
+    **请求体示例:**
+    ```json
+    {
+        "users": [
+            {"name": "张三", "email": "zhangsan@example.com", "age": 25},
+            {"name": "李四", "email": "lisi@example.com", "age": 30}
+        ]
+    }
+    ```
+    """
+    check_bulk_size(len(request.users))
+    
+    items, positions, validation_errors = [], [], []
+    for index, user in enumerate(request.users):
+        data = {"name": sanitize_string(user.name), "email": sanitize_string(user.email), "age": user.age}
+        error = validate_user_fields(data)
+        if error:
+            validation_errors.append({"index": index, "error": error})
+            continue
+        items.append(data)
+        positions.append(index)
+    
+    try:
+        created, service_errors = service.bulk_create(items)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量创建用户失败: {str(e)}")
+    
+    errors = merge_bulk_errors(validation_errors, service_errors, positions)
+    return api_response(
+        success=True,
+        message=f"批量创建完成，成功{len(created)}个，失败{len(errors)}个",
+        data={
+            "created": created,
+            "created_count": len(created),
+            "errors": errors,
+            "error_count": len(errors)
+        }
+    )
+
+# 批量更新用户
+@app.patch("/users/bulk", response_model=APIResponse, tags=["批量操作"],
+           summary="批量更新用户", description="一次请求更新多个用户，整批只持久化一次")
+@timer
+async def bulk_update_users(
+    request: BulkUpdateRequest,
+    service: UserService = Depends(get_user_service)
+):
+    """
+    批量更新用户
+    
+    每一项必须包含 `id`，其余字段按需提供（规则同单个更新）。
+    
+    **请求体示例:**
+    ```json
+    {
+        "users": [
+            {"id": 1, "age": 26},
+            {"id": 2, "name": "李四更新"}
+        ]
+    }
+    ```
+    """
+    check_bulk_size(len(request.users))
+    
+    items, positions, validation_errors = [], [], []
+    for index, user in enumerate(request.users):
+        data = user.dict(exclude_unset=True)
+        if data.get("name"):
+            data["name"] = sanitize_string(data["name"])
+        if data.get("email"):
+            data["email"] = sanitize_string(data["email"])
+        error = validate_user_fields(data)
+        if error:
+            validation_errors.append({"index": index, "id": user.id, "error": error})
+            continue
+        items.append(data)
+        positions.append(index)
+    
+    try:
+        updated, service_errors = service.bulk_update(items)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量更新用户失败: {str(e)}")
+    
+    errors = merge_bulk_errors(validation_errors, service_errors, positions)
+    return api_response(
+        success=True,
+        message=f"批量更新完成，成功{len(updated)}个，失败{len(errors)}个",
+        data={
+            "updated": updated,
+            "updated_count": len(updated),
+            "errors": errors,
+            "error_count": len(errors)
+        }
+    )
+
+# 批量删除用户
+@app.delete("/users/bulk", response_model=APIResponse, tags=["批量操作"],
+            summary="批量删除用户", description="一次请求删除多个用户，整批只持久化一次")
+@timer
+async def bulk_delete_users(
+    request: BulkDeleteRequest,
+    service: UserService = Depends(get_user_service)
+):
+    """
+    批量删除用户
+    
+    **请求体示例:**
+    ```json
+    {"ids": [1, 2, 3]}
+    ```
+    """
+    check_bulk_size(len(request.ids))
+    
+    try:
+        deleted, errors = service.bulk_delete(request.ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量删除用户失败: {str(e)}")
+    
+    return api_response(
+        success=True,
+        message=f"批量删除完成，成功{len(deleted)}个，失败{len(errors)}个",
+        data={
+            "deleted_user_ids": deleted,
+            "deleted_count": len(deleted),
+            "errors": errors,
+            "error_count": len(errors)
+        }
+    )
+
+def batch_get_response(user_ids: list, service: UserService) -> Response:
+    """按ID批量获取用户：去重后保持请求顺序，一次查询完成，返回找到的用户和不存在的ID"""
+    check_bulk_size(len(user_ids))
+    if any(user_id <= 0 for user_id in user_ids):
+        raise HTTPException(status_code=400, detail="用户ID必须是正整数")
+
+    users, missing = service.get_users_by_ids(list(dict.fromkeys(user_ids)))
+    return api_response(
+        success=True,
+        message=f"批量获取完成，找到{len(users)}个，不存在{len(missing)}个",
+        data={
+            "users": users,
+            "found_count": len(users),
+            "missing_ids": missing,
+            "missing_count": len(missing)
+        }
+    )
+
+# 按ID批量获取用户（查询参数）
+@app.get("/users/batch", response_model=APIResponse, tags=["批量操作"],
+         summary="按ID批量获取用户", description="一次请求获取多个指定ID的用户，代替逐个调用 GET /users/{user_id}")
+@timer
+async def batch_get_users(
+    ids: str = Query(..., description="逗号分隔的用户ID", example="1,2,3"),
+    service: UserService = Depends(get_user_service)
+):
+    """
+    按ID批量获取用户
+    
+    结果按请求中的ID顺序返回（重复的ID只返回一次），不存在的ID列在 `missing_ids` 中。
+    
+    **示例请求:**
+    ```
+    GET /users/batch?ids=3,1,99
+    ```
+    """
+    try:
+        user_ids = [int(part) for part in ids.split(",") if part.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids 必须是逗号分隔的用户ID")
+    return batch_get_response(user_ids, service)
+
+# 按ID批量获取用户（请求体，适合ID较多、超出URL长度限制的情况）
+@app.post("/users/batch-get", response_model=APIResponse, tags=["批量操作"],
+          summary="按ID批量获取用户（POST）", description="ID列表放在请求体中，语义同 GET /users/batch")
+@timer
+async def batch_get_users_post(
+    request: BatchGetRequest,
+    service: UserService = Depends(get_user_service)
+):
+    """
+    按ID批量获取用户
+    
+    **请求体示例:**
+    ```json
+    {"ids": [3, 1, 99]}
+    ```
+    """
+    return batch_get_response(request.ids, service)
+
 # 根据ID获取用户
 @app.get("/users/{user_id}", response_model=APIResponse, tags=["用户管理"],
          summary="获取用户详情", description="根据用户ID获取特定用户的详细信息")
 @timer
 async def get_user(
-    user_id: int = Query(..., description="用户ID", example=1), 
+    user_id: int = Path(..., description="用户ID", example=1), 
+    if_none_match: Optional[str] = Header(None, description="上次响应的 ETag，用户未变化时返回 304"),
     service: UserService = Depends(get_user_service)
 ):
     """
@@ -380,14 +800,21 @@ async def get_user(
     if user_id <= 0:
         raise HTTPException(status_code=400, detail="用户ID必须是正整数")
     
+    # ETag 只随该用户自身的修改变化
+    version_tag = service.user_version_tag(user_id)
+    etag = make_etag("user", user_id, version_tag) if version_tag else None
+    if etag and etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
     user = service.get_user_by_id(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    return APIResponse(
+    return api_response(
         success=True,
         message="获取用户成功",
-        data=user
+        data=user,
+        headers=etag_headers(etag) if etag else None
     )
 
 # 创建新用户
@@ -437,13 +864,16 @@ async def create_user(
         user.email = sanitize_string(user.email)
         
         new_user = service.create_user(user)
-        new_user["api_url"] = f"https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users/{new_user['id']}"
+        # 存储返回的记录是只读的，附加字段前先复制
+        new_user = {**new_user, "api_url": f"https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users/{new_user['id']}"}
         
-        return APIResponse(
+        return api_response(
             success=True,
             message="创建用户成功",
             data=new_user
         )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -499,11 +929,13 @@ async def update_user(
         if not updated_user:
             raise HTTPException(status_code=404, detail="用户不存在")
         
-        return APIResponse(
+        return api_response(
             success=True,
             message="更新用户成功",
             data=updated_user
         )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -532,11 +964,13 @@ async def delete_user(user_id: int, service: UserService = Depends(get_user_serv
         if not success:
             raise HTTPException(status_code=404, detail="用户不存在")
         
-        return APIResponse(
+        return api_response(
             success=True,
             message="删除用户成功",
             data={"deleted_user_id": user_id}
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除用户失败: {str(e)}")
 
@@ -545,7 +979,9 @@ async def delete_user(user_id: int, service: UserService = Depends(get_user_serv
          summary="搜索用户", description="根据关键词搜索用户（支持姓名和邮箱搜索）")
 @timer
 async def search_users(
-    keyword: str = Query(..., description="搜索关键词", example="张"), 
+    keyword: str = Path(..., description="搜索关键词", example="张"), 
+    fields: Optional[str] = Query(None, description="只返回的字段，逗号分隔（id 总是返回）", example="id,name"),
+    if_none_match: Optional[str] = Header(None, description="上次响应的 ETag，数据未变化时返回 304"),
     service: UserService = Depends(get_user_service)
 ):
     """
@@ -567,24 +1003,42 @@ async def search_users(
     - 用户姓名（模糊匹配）
     - 邮箱地址（模糊匹配）
     - 关键词至少2个字符
+
+    `fields` 指定后每个用户只包含这些字段，响应中也不再附带 `search_url`。
     """
     if len(keyword.strip()) < 2:
         raise HTTPException(status_code=400, detail="搜索关键词至少2个字符")
+    columns = projection(fields)
     
+    keyword = sanitize_string(keyword)
+    version_tag = service.version_tag()
+    cache_key = ("search", keyword, columns)
+    etag = make_etag("search", params_tag(keyword, columns), version_tag)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    body = response_cache.get(cache_key, version_tag)
+    if body is not None:
+        return cached_json(body, etag_headers(etag))
+
     try:
-        keyword = sanitize_string(keyword)
-        users = service.search_users(keyword)
+        users = service.search_users(keyword, columns)
         
-        return APIResponse(
+        data = {
+            "keyword": keyword,
+            "results": users,
+            "count": len(users),
+        }
+        if columns is None:
+            data["search_url"] = f"https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users/search/{keyword}"
+        response = api_response(
             success=True,
             message=f"搜索完成，找到{len(users)}个匹配用户",
-            data={
-                "keyword": keyword,
-                "results": users,
-                "count": len(users),
-                "search_url": f"https://gpu-4090-96g-instance-318-7byjgbwl-8888.550c.cloud/users/search/{keyword}"
-            }
+            data=data,
+            headers=etag_headers(etag)
         )
+        response_cache.put(cache_key, version_tag, response.body)
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
@@ -593,14 +1047,16 @@ async def search_users(
          summary="按年龄范围查询", description="获取指定年龄范围内的所有用户")
 @timer
 async def get_users_by_age_range(
-    min_age: int = Query(..., description="最小年龄", example=20), 
-    max_age: int = Query(..., description="最大年龄", example=30), 
+    min_age: int = Path(..., description="最小年龄", example=20), 
+    max_age: int = Path(..., description="最大年龄", example=30), 
     service: UserService = Depends(get_user_service)
 ):
     """
     按年龄范围查询用户
     
-    获取年龄在指定范围内的所有用户。
+    获取年龄在指定范围内的所有用户，按ID排序。
+    匹配的用户数达到 AGE_RANGE_STREAM_MIN 时从存储分块读取并流式发送（响应结构不变，
+    count 位于 users 之后），内存占用与匹配的用户数无关；较少时整体构造并缓存。
     
     **示例请求:**
     ```
@@ -615,18 +1071,73 @@ async def get_users_by_age_range(
     if min_age < 0 or max_age > 150 or min_age > max_age:
         raise HTTPException(status_code=400, detail="年龄范围无效")
     
+    version_tag = service.version_tag()
+    cache_key = ("age-range", min_age, max_age)
+    body = response_cache.get(cache_key, version_tag)
+    if body is not None:
+        return cached_json(body)
+
+    message = f"获取年龄在{min_age}-{max_age}岁的用户成功"
     try:
+        if service.count_users_by_age_range(min_age, max_age) >= AGE_RANGE_STREAM_MIN:
+            # 同步生成器由 Starlette 在线程池中迭代，读取存储不会阻塞事件循环
+            return StreamingResponse(
+                iter_json_response(
+                    message, {"age_range": {"min": min_age, "max": max_age}}, "users",
+                    service.iter_users_by_age_range(min_age, max_age)
+                ),
+                media_type="application/json"
+            )
+
         users = service.get_users_by_age_range(min_age, max_age)
         
-        return APIResponse(
+        response = api_response(
             success=True,
-            message=f"获取年龄在{min_age}-{max_age}岁的用户成功",
+            message=message,
             data={
                 "age_range": {"min": min_age, "max": max_age},
                 "users": users,
                 "count": len(users)
             }
         )
+        response_cache.put(cache_key, version_tag, response.body)
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
+
+# 按年龄范围统计用户数
+@app.get("/users/age-range/{min_age}/{max_age}/count", response_model=APIResponse, tags=["用户管理"],
+         summary="按年龄范围统计", description="只返回指定年龄范围内的用户数量，适合仪表盘轮询")
+@timer
+async def count_users_by_age_range(
+    min_age: int = Path(..., description="最小年龄", example=20),
+    max_age: int = Path(..., description="最大年龄", example=30),
+    service: UserService = Depends(get_user_service)
+):
+    """
+    按年龄范围统计用户数
+
+    直接读取年龄索引的桶大小，不加载用户数据。
+
+    **示例请求:**
+    ```
+    GET /users/age-range/20/30/count
+    ```
+    """
+    if min_age < 0 or max_age > 150 or min_age > max_age:
+        raise HTTPException(status_code=400, detail="年龄范围无效")
+
+    try:
+        count = service.count_users_by_age_range(min_age, max_age)
+
+        return api_response(
+            success=True,
+            message=f"年龄在{min_age}-{max_age}岁的用户共{count}个",
+            data={
+                "age_range": {"min": min_age, "max": max_age},
+                "count": count
+            }
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"查询失败: {str(e)}")
 
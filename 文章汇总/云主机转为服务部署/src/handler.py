@@ -1,57 +1,143 @@
+"""
+Serverless 处理器（AWS Lambda / 阿里云 / 腾讯云 / 华为云）
+
+冷启动优化：
+- 模块导入时只加载标准库；FastAPI 应用和 Mangum 在首次调用时创建，每个容器只创建一次
+- 预热事件（serverless-plugin-warmup、定时触发）只完成初始化，不经过 Mangum
+- 开启 SnapStart / 预置并发（或 HANDLER_PRELOAD=true）时在初始化阶段加载应用并处理一次内部请求，
+  快照中即包含已初始化的应用；从快照恢复后重置各实例独有的状态
+- 事件和响应默认不输出到日志：HANDLER_DEBUG=true 全部输出，HANDLER_LOG_SAMPLE_RATE 按比例抽样
+- 各云平台的 HTTP 事件由 utils/events.py 统一转换为 API Gateway 格式
+
+batch_handler 处理队列触发（SQS / Kafka）的批量事件：每条消息是一个用户操作，整批在同一个
+UserService 中执行、只持久化一次；可重试的失败通过 batchItemFailures 返回，
+无法处理的消息（格式错误、校验失败）默认不重试，见 BATCH_RETRY_INVALID。
+整批持久化失败时已应用的修改全部撤销并抛出异常，由队列重新投递整批消息。
+"""
+
+import base64
+import binascii
 import json
 import os
+import random
 import sys
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional, Tuple
 
 # 添加路径以便导入模块
 sys.path.append(os.path.dirname(__file__))
 
-try:
-    from mangum import Mangum
-    from app import app
-    
-    # 创建Mangum处理器，用于AWS Lambda
-    lambda_handler = Mangum(app, lifespan="off")
-    
-except ImportError as e:
-    print(f"导入错误: {e}")
-    # 如果mangum未安装，创建一个简单的处理器
-    def lambda_handler(event, context):
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "error": "Mangum未安装，请运行: pip install mangum"
-            })
-        }
+from utils.events import normalize_event
+
+HANDLER_DEBUG = os.getenv("HANDLER_DEBUG", "false").lower() == "true"
+# 按该比例抽样输出事件和响应，0 表示不输出
+HANDLER_LOG_SAMPLE_RATE = float(os.getenv("HANDLER_LOG_SAMPLE_RATE", "0"))
+
+# 无法处理的消息（格式错误、校验失败、邮箱重复等）也放入 batchItemFailures，
+# 由队列重新投递直到进入死信队列；默认只记录日志并确认消费，避免反复重试
+BATCH_RETRY_INVALID = os.getenv("BATCH_RETRY_INVALID", "false").lower() == "true"
+
+# 预热插件 / 定时触发器发送的事件来源
+WARMUP_SOURCES = ("serverless-plugin-warmup", "aws.events")
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type, Authorization"
+}
+
+_asgi_handler = None
+
+def _mangum_missing(event, context):
+    return {
+        "statusCode": 500,
+        "body": json.dumps({
+            "error": "Mangum未安装，请运行: pip install mangum"
+        })
+    }
+
+def get_asgi_handler():
+    """每个容器只创建一次的 Mangum 处理器（首次调用时导入应用）"""
+    global _asgi_handler
+    if _asgi_handler is None:
+        try:
+            from mangum import Mangum
+            from app import app
+        except ImportError as e:
+            print(f"导入错误: {e}")
+            # 如果mangum未安装，使用返回错误信息的处理器
+            _asgi_handler = _mangum_missing
+        else:
+            # 创建Mangum处理器，用于AWS Lambda
+            _asgi_handler = Mangum(app, lifespan="off")
+    return _asgi_handler
+
+def api_gateway_event(method: str, path: str, body: Optional[str] = None,
+                      query: Optional[Dict[str, str]] = None, request_id: str = "local") -> Dict[str, Any]:
+    """构造 API Gateway（REST API）格式的事件，用于本地测试和预热"""
+    return {
+        "resource": "/{proxy+}",
+        "httpMethod": method,
+        "path": path,
+        "headers": {"Content-Type": "application/json"},
+        "multiValueHeaders": {},
+        "queryStringParameters": query,
+        "multiValueQueryStringParameters": None,
+        "body": body,
+        "isBase64Encoded": False,
+        "requestContext": {"requestId": request_id, "identity": {"sourceIp": "127.0.0.1"}}
+    }
+
+def is_warmup_event(event: Any) -> bool:
+    """预热事件：只需要完成初始化"""
+    return isinstance(event, dict) and event.get("source") in WARMUP_SOURCES
+
+def should_log() -> bool:
+    """本次调用是否输出事件和响应"""
+    return HANDLER_DEBUG or (HANDLER_LOG_SAMPLE_RATE > 0 and random.random() < HANDLER_LOG_SAMPLE_RATE)
+
+def error_response(e: Exception, headers: Dict[str, str]) -> Dict[str, Any]:
+    """500 错误响应"""
+    return {
+        "statusCode": 500,
+        "headers": {"Content-Type": "application/json", **headers},
+        "body": json.dumps({
+            "success": False,
+            "message": "服务器内部错误",
+            "error": str(e)
+        }, ensure_ascii=False)
+    }
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """AWS Lambda 处理器"""
+    if is_warmup_event(event):
+        get_asgi_handler()
+        return {"warmed": True}
+    return get_asgi_handler()(event, context)
+
+def handle_http_event(event: Dict[str, Any], context: Any, name: str = "",
+                      error_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """规范化任意云平台的 HTTP 事件后交给 Mangum 处理（name 用于日志前缀）"""
+    log = should_log()
+    if log:
+        print(f"{name}收到事件: {json.dumps(event, ensure_ascii=False)}")
 
-def serverless_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """
-    通用Serverless处理器
-    支持AWS Lambda、阿里云函数计算、腾讯云函数
-    """
-    print(f"收到事件: {json.dumps(event, ensure_ascii=False)}")
-    
     try:
-        # 调用Lambda处理器
+        if not is_warmup_event(event):
+            event = normalize_event(event, context)
         response = lambda_handler(event, context)
-        print(f"响应: {json.dumps(response, ensure_ascii=False)}")
+        if log:
+            print(f"{name}响应: {json.dumps(response, ensure_ascii=False)}")
         return response
     except Exception as e:
-        print(f"处理请求时出错: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, Authorization"
-            },
-            "body": json.dumps({
-                "success": False,
-                "message": "服务器内部错误",
-                "error": str(e)
-            }, ensure_ascii=False)
-        }
+        print(f"{name}处理请求时出错: {str(e)}")
+        return error_response(e, error_headers or {})
+
+def serverless_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    通用Serverless处理器
+    支持AWS Lambda、腾讯云函数、华为云函数的 HTTP 事件（见 utils/events.py）
+    """
+    return handle_http_event(event, context, error_headers=CORS_HEADERS)
 
 def aliyun_handler(environ: Dict[str, Any], start_response: callable):
     """
@@ -59,110 +145,174 @@ def aliyun_handler(environ: Dict[str, Any], start_response: callable):
     使用WSGI接口
     """
     try:
-        from mangum import Mangum
-        handler = Mangum(app, lifespan="off")
+        handler = get_asgi_handler()
+        if handler is _mangum_missing:
+            raise ImportError("mangum")
         return handler(environ, start_response)
     except ImportError:
         # 简单的WSGI响应
         status = '500 Internal Server Error'
         headers = [('Content-Type', 'application/json')]
         start_response(status, headers)
-        
+
         error_response = json.dumps({
             "success": False,
             "message": "Mangum未安装",
             "error": "请运行: pip install mangum"
         }, ensure_ascii=False)
-        
+
         return [error_response.encode('utf-8')]
     except Exception as e:
         status = '500 Internal Server Error'
         headers = [('Content-Type', 'application/json')]
         start_response(status, headers)
-        
+
         error_response = json.dumps({
             "success": False,
             "message": "服务器内部错误",
             "error": str(e)
         }, ensure_ascii=False)
-        
+
         return [error_response.encode('utf-8')]
 
 def tencent_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     腾讯云函数处理器
-    兼容API Gateway事件格式
+    兼容API网关触发器与直接调用
     """
-    print(f"腾讯云函数收到事件: {json.dumps(event, ensure_ascii=False)}")
-    
-    try:
-        # 腾讯云函数的事件格式可能略有不同，需要做格式转换
-        if "requestContext" in event:
-            # API Gateway格式
-            return lambda_handler(event, context)
-        else:
-            # 直接调用格式，需要包装成API Gateway格式
-            wrapped_event = {
-                "httpMethod": "POST",
-                "path": "/",
-                "headers": event.get("headers", {}),
-                "queryStringParameters": event.get("queryStringParameters"),
-                "body": json.dumps(event.get("body", {})),
-                "isBase64Encoded": False,
-                "requestContext": {
-                    "requestId": context.request_id if hasattr(context, 'request_id') else "unknown",
-                }
-            }
-            return lambda_handler(wrapped_event, context)
-    except Exception as e:
-        print(f"腾讯云函数处理错误: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({
-                "success": False,
-                "message": "服务器内部错误",
-                "error": str(e)
-            }, ensure_ascii=False)
-        }
+    return handle_http_event(event, context, "腾讯云函数")
 
 def huawei_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     华为云函数工作流处理器
     """
-    print(f"华为云函数收到事件: {json.dumps(event, ensure_ascii=False)}")
-    
-    try:
-        # 华为云的事件格式转换
-        if "headers" in event and "httpMethod" in event:
-            # API Gateway格式
-            return lambda_handler(event, context)
+    return handle_http_event(event, context, "华为云函数")
+
+def iter_batch_records(event: Dict[str, Any]) -> Iterator[Tuple[str, Any, bool]]:
+    """拆开批量事件，依次返回 (消息标识, 原始消息体, 是否 base64 编码)；消息体在逐条处理时再解码
+
+    - SQS: {"Records": [{"messageId": ..., "body": "..."}]}
+    - Kafka: {"records": {"<topic>-<partition>": [{"offset": ..., "value": "<base64>"}]}}，标识为 "<topic>-<partition>:<offset>"
+    """
+    if "Records" in event:
+        for record in event["Records"]:
+            yield record.get("messageId", ""), record.get("body"), False
+    elif isinstance(event.get("records"), dict):
+        for partition, records in event["records"].items():
+            for record in records:
+                yield f"{partition}:{record.get('offset')}", record.get("value"), True
+    else:
+        raise ValueError("不支持的批量事件格式")
+
+def parse_operation(body: Any, is_base64: bool = False) -> Dict[str, Any]:
+    """解码、解析并校验一条用户操作（规则同对应的 HTTP 接口），不合法时抛出 ValueError"""
+    from models.schemas import UserOperation, CreateUserRequest, UpdateUserRequest
+    from utils.helpers import sanitize_string, validate_user_fields
+
+    if body is None:
+        raise ValueError("消息体为空")
+    if is_base64:
+        body = base64.b64decode(body, validate=True)
+    payload = json.loads(body)
+    if not isinstance(payload, dict):
+        raise ValueError("消息体必须是JSON对象")
+    operation = UserOperation(**payload)
+    if operation.op != "create" and operation.id is None:
+        raise ValueError(f"{operation.op} 操作缺少 id")
+    if operation.op == "delete":
+        return {"op": "delete", "id": operation.id}
+    if operation.user is None:
+        raise ValueError(f"{operation.op} 操作缺少 user")
+
+    model = CreateUserRequest if operation.op == "create" else UpdateUserRequest
+    data = {k: v for k, v in model(**operation.user).dict(exclude_unset=True).items() if v is not None}
+    for key in ("name", "email"):
+        if data.get(key):
+            data[key] = sanitize_string(data[key])
+    error = validate_user_fields(data)
+    if error:
+        raise ValueError(error)
+    return {"op": operation.op, "id": operation.id, "user": data}
+
+def operation_error(e: Exception) -> str:
+    """操作解析错误的简短描述（pydantic 校验错误只取第一条）"""
+    errors = getattr(e, "errors", None)
+    if callable(errors):
+        first = errors()[0]
+        return f"{'.'.join(map(str, first['loc']))}: {first['msg']}"
+    return str(e)
+
+def batch_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    队列触发的批量处理器（SQS / Kafka）
+    合法的操作按消息顺序在同一个 UserService 中执行，整批只持久化一次；
+    可重试的失败（已回滚的存储异常，如 SQLite 数据库被锁）放入 batchItemFailures（SQS 只重新投递这些消息）；
+    无法处理的消息重试也不会成功，默认只记录日志（BATCH_RETRY_INVALID=true 时同样重新投递）。
+    results 按消息顺序给出逐条结果，retryable 区分两类失败。
+    整批持久化（快照/日志写入或 SQLite 提交）失败时撤销整批修改并抛出异常，由队列重新投递整批消息
+    """
+    if is_warmup_event(event):
+        get_asgi_handler()
+        return {"warmed": True}
+    log = should_log()
+    if log:
+        print(f"收到批量事件: {json.dumps(event, ensure_ascii=False)}")
+
+    from app import user_service
+
+    identifiers, results, operations, positions = [], [], [], []
+    for index, (identifier, body, is_base64) in enumerate(iter_batch_records(event)):
+        identifiers.append(identifier)
+        try:
+            operations.append(parse_operation(body, is_base64))
+        except (ValueError, TypeError, binascii.Error, UnicodeDecodeError) as e:
+            results.append({"success": False, "error": operation_error(e), "retryable": False})
+            continue
+        positions.append(index)
+        results.append(None)
+
+    for index, result in zip(positions, user_service.apply_operations(operations)):
+        results[index] = result
+
+    failures = []
+    for identifier, result in zip(identifiers, results):
+        if result["success"]:
+            continue
+        if result["retryable"] or BATCH_RETRY_INVALID:
+            failures.append({"itemIdentifier": identifier})
         else:
-            # 其他格式转换
-            wrapped_event = {
-                "httpMethod": event.get("method", "POST"),
-                "path": event.get("path", "/"),
-                "headers": event.get("headers", {}),
-                "queryStringParameters": event.get("queryStringParameters"),
-                "body": event.get("body"),
-                "isBase64Encoded": event.get("isBase64Encoded", False)
-            }
-            return lambda_handler(wrapped_event, context)
-    except Exception as e:
-        print(f"华为云函数处理错误: {str(e)}")
-        return {
-            "statusCode": 500,
-            "headers": {
-                "Content-Type": "application/json"
-            },
-            "body": json.dumps({
-                "success": False,
-                "message": "服务器内部错误", 
-                "error": str(e)
-            }, ensure_ascii=False)
-        }
+            print(f"⚠️ 跳过无法处理的消息 {identifier}: {result['error']}")
+
+    response = {
+        "batchItemFailures": failures,
+        "results": [{"itemIdentifier": identifier, **result} for identifier, result in zip(identifiers, results)]
+    }
+    if log:
+        print(f"批量处理结果: {json.dumps(response, ensure_ascii=False)}")
+    return response
+
+def after_restore():
+    """从 SnapStart 快照恢复后调用：同一快照会恢复出多个实例，重置各实例独有的状态"""
+    random.seed()
+    from app import user_service
+    from utils.cache import response_cache
+    user_service.storage.after_restore()
+    response_cache.clear()
+
+def preload():
+    """在初始化阶段加载应用并处理一次内部请求，使首个真实请求不再承担初始化开销"""
+    get_asgi_handler()(api_gateway_event("GET", "/health", request_id="preload"), None)
+    if os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") == "snap-start":
+        try:
+            from snapshot_restore_py import register_after_restore
+        except ImportError:  # 只在开启 SnapStart 的 Lambda 运行时中提供
+            print("⚠️ 未找到 snapshot_restore_py，快照恢复后不会重置实例状态")
+        else:
+            register_after_restore(after_restore)
+
+if (os.getenv("HANDLER_PRELOAD", "false").lower() == "true"
+        or os.getenv("AWS_LAMBDA_INITIALIZATION_TYPE") in ("snap-start", "provisioned-concurrency")):
+    preload()
 
 def test_handler_locally():
     """
@@ -170,64 +320,45 @@ def test_handler_locally():
     """
     # 模拟AWS Lambda事件
     test_events = [
-        {
-            "httpMethod": "GET",
-            "path": "/",
-            "headers": {"Content-Type": "application/json"},
-            "queryStringParameters": None,
-            "body": None,
-            "isBase64Encoded": False,
-            "requestContext": {"requestId": "test-request-1"}
-        },
-        {
-            "httpMethod": "GET",
-            "path": "/users",
-            "headers": {"Content-Type": "application/json"},
-            "queryStringParameters": None,
-            "body": None,
-            "isBase64Encoded": False,
-            "requestContext": {"requestId": "test-request-2"}
-        },
-        {
-            "httpMethod": "POST",
-            "path": "/users",
-            "headers": {"Content-Type": "application/json"},
-            "queryStringParameters": None,
-            "body": json.dumps({
-                "name": "测试用户",
-                "email": "test@example.com",
-                "age": 25
-            }),
-            "isBase64Encoded": False,
-            "requestContext": {"requestId": "test-request-3"}
-        }
+        api_gateway_event("GET", "/", request_id="test-request-1"),
+        api_gateway_event("GET", "/users", request_id="test-request-2"),
+        api_gateway_event("POST", "/users", json.dumps({
+            "name": "测试用户",
+            "email": "test@example.com",
+            "age": 25
+        }), request_id="test-request-3"),
+        {"source": "serverless-plugin-warmup"}
     ]
-    
+
     class MockContext:
         def __init__(self, request_id):
             self.request_id = request_id
             self.function_name = "test-function"
             self.memory_limit_in_mb = 256
             self.remaining_time_in_millis = 30000
-    
+
     print("=== 开始本地测试 ===")
-    
+
     for i, event in enumerate(test_events):
         print(f"\n--- 测试 {i+1} ---")
         context = MockContext(f"test-{i+1}")
-        
+
         try:
             response = serverless_handler(event, context)
             print(f"状态码: {response.get('statusCode')}")
-            
+
             if response.get('body'):
-                body = json.loads(response['body'])
-                print(f"响应: {json.dumps(body, ensure_ascii=False, indent=2)}")
+                body = response['body']
+                if response.get('headers', {}).get('content-type', '').startswith('application/json'):
+                    body = json.dumps(json.loads(body), ensure_ascii=False, indent=2)
+                print(f"响应: {body[:500]}")
+            else:
+                print(f"响应: {response}")
         except Exception as e:
             print(f"测试失败: {str(e)}")
-    
+
     print("\n=== 测试完成 ===")
 
 if __name__ == "__main__":
     # 本地测试
-    test_handler_locally() 
\ No newline at end of file
+    test_handler_locally()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Any, Optional
+from typing import Any, Dict, List, Literal, Optional
 
 class UserModel(BaseModel):
     id: int
@@ -17,6 +17,27 @@ class UpdateUserRequest(BaseModel):
     email: Optional[str] = None
     age: Optional[int] = None
 
+class BulkCreateRequest(BaseModel):
+    users: List[CreateUserRequest]
+
+class BulkUpdateItem(UpdateUserRequest):
+    id: int
+
+class BulkUpdateRequest(BaseModel):
+    users: List[BulkUpdateItem]
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[int]
+
+class BatchGetRequest(BaseModel):
+    ids: List[int]
+
+class UserOperation(BaseModel):
+    """队列批量事件中的单条用户操作（create 需要 user，update 需要 id 和 user，delete 需要 id）"""
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None
+    user: Optional[Dict[str, Any]] = None
+
 class APIResponse(BaseModel):
     success: bool
     message: str
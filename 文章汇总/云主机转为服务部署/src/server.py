@@ -0,0 +1,242 @@
+"""
+生产环境多进程服务器（prefork）
+
+父进程预先导入应用（fork 后子进程以写时复制方式共享已加载的代码和数据），
+绑定监听套接字后 fork 出 N 个 uvicorn worker 共同 accept。父进程只负责管理：
+
+  SIGTERM / SIGINT  通知所有 worker 处理完在途请求后退出
+  SIGHUP            滚动重启：逐个启动新 worker，就绪后再让旧 worker 优雅退出，
+                    任意时刻都有 worker 在 accept，不中断服务
+  worker 异常退出    自动拉起新的 worker（包括达到 max_requests 后主动退出的）
+
+多个 worker 进程之间的数据一致性依赖存储后端，因此该模式固定使用 SQLite
+（USER_STORAGE_BACKEND=sqlite）。
+"""
+
+from typing import Dict, Optional, Tuple
+import asyncio
+import gc
+import importlib.util
+import os
+import select
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+# worker 退出时停止 accept 后等待的时间：刚被 accept、请求还没读到的连接会被
+# uvicorn 当成空闲连接直接关闭，先给它们一点时间把请求发上来
+ACCEPT_DRAIN_SECONDS = 0.3
+
+def pick_implementations() -> Tuple[str, str]:
+    """选择事件循环和HTTP解析器：已安装时优先使用 uvloop / httptools"""
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return loop, http
+
+def use_shared_storage():
+    """多进程模式下切换到 SQLite 存储（必须在导入应用之前调用）"""
+    backend = os.getenv("USER_STORAGE_BACKEND", "memory").lower()
+    if backend != "sqlite":
+        print(f"ℹ️ 多进程模式需要各 worker 共享数据，存储后端由 {backend} 切换为 sqlite")
+        os.environ["USER_STORAGE_BACKEND"] = "sqlite"
+
+class PreforkServer:
+    """预加载应用的多进程 uvicorn 管理器"""
+
+    def __init__(self, app, host: str = "0.0.0.0", port: int = 8000, workers: Optional[int] = None,
+                 max_requests: Optional[int] = None, graceful_timeout: int = 30, backlog: int = 2048,
+                 access_log: bool = False):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.max_requests = max_requests or None
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.access_log = access_log
+        self.loop, self.http = pick_implementations()
+
+        self._sock: Optional[socket.socket] = None
+        # pid -> 启动时间
+        self._children: Dict[int, float] = {}
+        self._stopping = False
+        self._reload_requested = False
+
+    # ---------- 父进程 ----------
+
+    def _bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def run(self):
+        """启动 worker 并进入管理循环，直到收到停止信号"""
+        self._sock = self._bind()
+        print(f"🚀 多进程服务器: http://{self.host}:{self.port}  "
+              f"workers={self.workers} loop={self.loop} http={self.http} 主进程PID={os.getpid()}")
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        # 预加载的对象移出 GC 跟踪，避免子进程中的垃圾回收触碰这些页面而破坏写时复制
+        gc.collect()
+        gc.freeze()
+
+        try:
+            for _ in range(self.workers):
+                self._spawn()
+            while not self._stopping:
+                self._reap()
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._recycle()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+
+    def _spawn(self) -> Optional[int]:
+        """fork 一个 worker 并等待其就绪"""
+        ready_r, ready_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            try:
+                self._run_worker(ready_w)
+            finally:
+                os._exit(0)
+
+        os.close(ready_w)
+        self._children[pid] = time.time()
+        try:
+            readable, _, _ = select.select([ready_r], [], [], 30)
+            if not readable or not os.read(ready_r, 1):
+                print(f"⚠️ worker {pid} 未能在30秒内就绪")
+        finally:
+            os.close(ready_r)
+        return pid
+
+    def _reap(self):
+        """回收已退出的 worker，并在非停止状态下补齐数量"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self._children.pop(pid, None) is not None and not self._stopping:
+                print(f"🔁 worker {pid} 已退出（状态 {status}），启动新的 worker")
+                self._spawn()
+
+    def _wait_worker(self, pid: int, timeout: float):
+        """等待 worker 退出，超时后强制结束"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if done:
+                return
+            time.sleep(0.05)
+        print(f"⚠️ worker {pid} 未能在{timeout:.0f}秒内退出，强制结束")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+
+    def _stop_worker(self, pid: int):
+        """让 worker 处理完在途请求后退出"""
+        self._children.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _recycle(self):
+        """滚动重启全部 worker：先启动替换者，再停止旧 worker"""
+        print("🔄 滚动重启 worker...")
+        for old_pid in list(self._children):
+            if self._stopping:
+                return
+            self._spawn()
+            self._stop_worker(old_pid)
+            self._wait_worker(old_pid, self.graceful_timeout + 5)
+        print("✅ 滚动重启完成")
+
+    def _shutdown(self):
+        """通知全部 worker 退出并等待"""
+        self._stopping = True
+        pids = list(self._children)
+        for pid in pids:
+            self._stop_worker(pid)
+        deadline = time.time() + self.graceful_timeout + 5
+        for pid in pids:
+            self._wait_worker(pid, max(0.1, deadline - time.time()))
+        if self._sock is not None:
+            self._sock.close()
+        print("⏹️ 多进程服务器已停止")
+
+    # ---------- worker 进程 ----------
+
+    def _run_worker(self, ready_fd: int):
+        # 管理信号只由父进程处理；uvicorn 会自行接管 SIGTERM / SIGINT
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        config = uvicorn.Config(
+            self.app,
+            loop=self.loop,
+            http=self.http,
+            lifespan="on",
+            access_log=self.access_log,
+            limit_max_requests=self.max_requests,
+            timeout_graceful_shutdown=self.graceful_timeout,
+        )
+        server = _WorkerServer(config, ready_fd)
+        server.run(sockets=[self._sock])
+        sys.stdout.flush()
+
+class _WorkerServer(uvicorn.Server):
+    """启动完成后通过管道通知父进程"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+    async def shutdown(self, sockets=None):
+        for server in self.servers:
+            server.close()
+        await asyncio.sleep(ACCEPT_DRAIN_SECONDS)
+        await super().shutdown(sockets=sockets)
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: Optional[int] = None,
+          max_requests: Optional[int] = None, graceful_timeout: int = 30, access_log: bool = False):
+    """以多进程模式启动用户管理API"""
+    use_shared_storage()
+    # 预加载：在父进程中导入应用，fork 后各 worker 共享
+    from app import app
+    PreforkServer(app, host, port, workers, max_requests, graceful_timeout,
+                  access_log=access_log).run()
@@ -1,104 +1,174 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple
 from models.schemas import UserModel, CreateUserRequest, UpdateUserRequest
-import json
-import os
+from services.storage import UserStorage, create_storage
 
 class UserService:
-    def __init__(self):
-        # 初始化示例数据
-        self.users_db = [
-            {"id": 1, "name": "张三", "email": "zhangsan@example.com", "age": 25},
-            {"id": 2, "name": "李四", "email": "lisi@example.com", "age": 30},
-            {"id": 3, "name": "王五", "email": "wangwu@example.com", "age": 28}
-        ]
-        self._load_data()
-    
-    def _load_data(self):
-        """从环境变量或文件加载数据（生产环境可连接数据库）"""
-        data_file = os.getenv('USER_DATA_FILE', '/tmp/users.json')
-        if os.path.exists(data_file):
-            try:
-                with open(data_file, 'r', encoding='utf-8') as f:
-                    self.users_db = json.load(f)
-            except Exception as e:
-                print(f"加载数据失败: {e}")
-    
-    def _save_data(self):
-        """保存数据到文件（生产环境可保存到数据库）"""
-        data_file = os.getenv('USER_DATA_FILE', '/tmp/users.json')
-        try:
-            with open(data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users_db, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存数据失败: {e}")
-    
-    def get_all_users(self) -> List[Dict]:
-        """获取所有用户"""
-        return self.users_db
-    
+    def __init__(self, storage: Optional[UserStorage] = None):
+        # 存储后端由 USER_STORAGE_BACKEND 选择（memory / sqlite）
+        self.storage = storage or create_storage()
+
+    @property
+    def users_db(self) -> List[Dict]:
+        """兼容旧接口：以列表形式返回全部用户"""
+        return self.storage.list_users()
+
+    @users_db.setter
+    def users_db(self, users: List[Dict]):
+        self.storage.replace_all(users)
+
+    def get_all_users(self, offset: int = 0, limit: Optional[int] = None,
+                      fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        """获取所有用户（按ID排序，可分页；fields 指定只返回的字段）"""
+        return self.storage.list_users(offset, limit, fields)
+
+    def get_users_after(self, after_id: int, limit: int, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        """游标分页：ID大于 after_id 的前 limit 个用户"""
+        return self.storage.list_after(after_id, limit, fields)
+
+    def iter_user_chunks(self, chunk_size: int = 1000) -> Iterator[List[Dict]]:
+        """按ID顺序分块遍历全部用户（游标方式取块，内存占用与总用户数无关）"""
+        after_id = 0
+        while True:
+            chunk = self.storage.list_after(after_id, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            after_id = chunk[-1]["id"]
+
+    def count_users(self) -> int:
+        """用户总数"""
+        return self.storage.count()
+
+    def version_tag(self) -> str:
+        """全部用户数据的版本标识，任何修改后改变"""
+        return f"{self.storage.epoch}-{self.storage.version()}"
+
+    def user_version_tag(self, user_id: int) -> Optional[str]:
+        """单个用户的版本标识，只在该用户被修改后改变；用户不存在返回 None"""
+        version = self.storage.user_version(user_id)
+        return f"{self.storage.epoch}-{version}" if version is not None else None
+
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """根据ID获取用户"""
-        return next((u for u in self.users_db if u["id"] == user_id), None)
-    
+        return self.storage.get(user_id)
+
+    def get_users_by_ids(self, user_ids: List[int]) -> Tuple[List[Dict], List[int]]:
+        """按ID批量获取用户：按 user_ids 的顺序返回找到的用户，以及不存在的ID"""
+        users, missing = [], []
+        for user_id, user in zip(user_ids, self.storage.get_many(user_ids)):
+            if user is None:
+                missing.append(user_id)
+            else:
+                users.append(user)
+        return users, missing
+
+    def get_user_by_email(self, email: str) -> Optional[Dict]:
+        """根据邮箱获取用户（忽略大小写）"""
+        return self.storage.get_by_email(email)
+
     def create_user(self, user_data: CreateUserRequest) -> Dict:
-        """创建新用户"""
-        # 检查邮箱是否已存在
-        if any(u["email"] == user_data.email for u in self.users_db):
-            raise ValueError("邮箱已存在")
-        
-        # 生成新ID
-        new_id = max([u["id"] for u in self.users_db]) + 1 if self.users_db else 1
-        
-        new_user = {
-            "id": new_id,
+        """创建新用户，邮箱已存在时抛出 ValueError"""
+        return self.storage.insert({
             "name": user_data.name,
             "email": user_data.email,
             "age": user_data.age
-        }
-        
-        self.users_db.append(new_user)
-        self._save_data()
-        return new_user
-    
+        })
+
     def update_user(self, user_id: int, user_data: UpdateUserRequest) -> Optional[Dict]:
-        """更新用户信息"""
-        user = self.get_user_by_id(user_id)
-        if not user:
-            return None
-        
-        # 更新字段
-        update_data = user_data.dict(exclude_unset=True)
-        
-        # 检查邮箱唯一性
-        if "email" in update_data:
-            if any(u["email"] == update_data["email"] and u["id"] != user_id for u in self.users_db):
-                raise ValueError("邮箱已存在")
-        
-        user.update(update_data)
-        self._save_data()
-        return user
-    
+        """更新用户信息（值为 null 的字段视为未提供）"""
+        update_data = {k: v for k, v in user_data.dict(exclude_unset=True).items() if v is not None}
+        return self.storage.update(user_id, update_data)
+
     def delete_user(self, user_id: int) -> bool:
         """删除用户"""
-        user = self.get_user_by_id(user_id)
-        if not user:
-            return False
-        
-        self.users_db = [u for u in self.users_db if u["id"] != user_id]
-        self._save_data()
-        return True
-    
-    def search_users(self, keyword: str) -> List[Dict]:
+        return self.storage.delete(user_id)
+
+    def bulk_create(self, items: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """批量创建用户，整批只持久化一次；返回 (创建成功的用户, 逐条错误)"""
+        created, errors = [], []
+        with self.storage.batch():
+            for index, item in enumerate(items):
+                try:
+                    created.append(self.storage.insert(item))
+                except ValueError as e:
+                    errors.append({"index": index, "error": str(e)})
+        return created, errors
+
+    def bulk_update(self, items: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """批量更新用户（每项必须包含 id），整批只持久化一次"""
+        updated, errors = [], []
+        with self.storage.batch():
+            for index, item in enumerate(items):
+                update_data = {k: v for k, v in item.items() if k != "id" and v is not None}
+                try:
+                    user = self.storage.update(item["id"], update_data)
+                except ValueError as e:
+                    errors.append({"index": index, "id": item["id"], "error": str(e)})
+                    continue
+                if user is None:
+                    errors.append({"index": index, "id": item["id"], "error": "用户不存在"})
+                else:
+                    updated.append(user)
+        return updated, errors
+
+    def bulk_delete(self, user_ids: List[int]) -> Tuple[List[int], List[Dict]]:
+        """批量删除用户，整批只持久化一次"""
+        deleted, errors = [], []
+        with self.storage.batch():
+            for index, user_id in enumerate(user_ids):
+                if self.storage.delete(user_id):
+                    deleted.append(user_id)
+                else:
+                    errors.append({"index": index, "id": user_id, "error": "用户不存在"})
+        return deleted, errors
+
+    def apply_operations(self, operations: List[Dict]) -> List[Dict]:
+        """按顺序执行一批创建/更新/删除操作（已校验），整批只持久化一次；返回逐条结果
+
+        每项形如 {"op": "create", "user": {...}}、{"op": "update", "id": 1, "user": {...}}
+        或 {"op": "delete", "id": 1}；结果形如 {"success": True, "data": ...} 或
+        {"success": False, "error": ..., "retryable": ...}：邮箱重复、用户不存在等业务错误重试也不会成功；
+        存储异常只有在存储保证该条已完整回滚时（atomic_writes，如 SQLite 批量中每条操作使用 SAVEPOINT）
+        才可以重试，内存存储的异常可能已修改了部分索引，按不可重试处理。
+        整批持久化失败时撤销整批修改并抛出异常。
+        """
+        results = []
+        with self.storage.batch():
+            for operation in operations:
+                op = operation["op"]
+                try:
+                    if op == "create":
+                        data = self.storage.insert(operation["user"])
+                    elif op == "update":
+                        data = self.storage.update(operation["id"], operation["user"])
+                    else:
+                        data = operation["id"] if self.storage.delete(operation["id"]) else None
+                except ValueError as e:
+                    results.append({"success": False, "error": str(e), "retryable": False})
+                    continue
+                except Exception as e:
+                    results.append({"success": False, "error": str(e), "retryable": self.storage.atomic_writes})
+                    continue
+                if data is None:
+                    results.append({"success": False, "error": "用户不存在", "retryable": False})
+                else:
+                    results.append({"success": True, "data": data})
+        return results
+
+    def search_users(self, keyword: str, fields: Optional[Sequence[str]] = None) -> List[Dict]:
         """搜索用户"""
-        keyword = keyword.lower()
-        return [
-            u for u in self.users_db 
-            if keyword in u["name"].lower() or keyword in u["email"].lower()
-        ]
-    
+        return self.storage.search(keyword.lower(), fields)
+
     def get_users_by_age_range(self, min_age: int, max_age: int) -> List[Dict]:
         """按年龄范围获取用户"""
-        return [
-            u for u in self.users_db 
-            if min_age <= u["age"] <= max_age
-        ] 
\ No newline at end of file
+        return self.storage.age_range(min_age, max_age)
+
+    def iter_users_by_age_range(self, min_age: int, max_age: int) -> Iterator[Dict]:
+        """按ID顺序流式返回年龄范围内的用户"""
+        return self.storage.iter_age_range(min_age, max_age)
+
+    def count_users_by_age_range(self, min_age: int, max_age: int) -> int:
+        """年龄范围内的用户数"""
+        return self.storage.count_age_range(min_age, max_age)
@@ -0,0 +1,181 @@
+"""
+内存存储使用的二级索引
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+import bisect
+import heapq
+from itertools import islice
+
+class NGramIndex:
+    """字符 bigram/trigram 倒排索引，用于子串搜索
+
+    中文姓名没有空格可切分，因此按字符 n-gram 建索引。查询时取关键词的
+    n-gram 对应的倒排列表求交集得到候选集，调用方再对候选做一次子串校验。
+    """
+
+    def __init__(self, sizes: Iterable[int] = (2, 3)):
+        self.sizes = tuple(sorted(sizes))
+        self.min_size = self.sizes[0]
+        self.max_size = self.sizes[-1]
+        # n-gram -> 文档ID集合
+        self._postings: Dict[str, Set[int]] = {}
+
+    def _grams(self, texts: Iterable[str]) -> Set[str]:
+        """文档的全部 n-gram（各字段分别切分，不跨字段拼接）"""
+        grams = set()
+        for text in texts:
+            for n in self.sizes:
+                grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+        return grams
+
+    def add(self, doc_id: int, texts: Iterable[str]):
+        """索引一个文档，texts 需已转为小写"""
+        postings = self._postings
+        for gram in self._grams(texts):
+            ids = postings.get(gram)
+            if ids is None:
+                postings[gram] = {doc_id}
+            else:
+                ids.add(doc_id)
+
+    def remove(self, doc_id: int, texts: Iterable[str]):
+        """移除一个文档，texts 必须与 add 时一致"""
+        postings = self._postings
+        for gram in self._grams(texts):
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del postings[gram]
+
+    def clear(self):
+        self._postings = {}
+
+    def candidates(self, keyword: str) -> Optional[Set[int]]:
+        """可能包含 keyword 的文档ID；关键词短于最小 n-gram 时返回 None（无法使用索引）"""
+        if len(keyword) < self.min_size:
+            return None
+
+        n = min(len(keyword), self.max_size)
+        grams = {keyword[i:i + n] for i in range(len(keyword) - n + 1)}
+        postings: List[Set[int]] = []
+        for gram in grams:
+            ids = self._postings.get(gram)
+            if not ids:
+                return set()
+            postings.append(ids)
+
+        # 从最短的倒排列表开始求交集
+        postings.sort(key=len)
+        result = set(postings[0])
+        for ids in postings[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+class AgeIndex:
+    """按年龄分桶的有序二级索引
+
+    年龄是 1-150 的有界整数，每个年龄一个桶，桶内ID升序。范围查询对落在
+    范围内的桶做多路归并，按ID顺序流式输出，总耗时 O(k + log n)；计数只需
+    累加桶长度，与用户数无关。
+    """
+
+    def __init__(self):
+        # 升序的不同年龄值
+        self._ages: List[int] = []
+        # 年龄 -> 升序ID列表
+        self._buckets: Dict[int, List[int]] = {}
+
+    def add(self, age: int, doc_id: int):
+        bucket = self._buckets.get(age)
+        if bucket is None:
+            bisect.insort(self._ages, age)
+            self._buckets[age] = [doc_id]
+        elif bucket[-1] < doc_id:
+            # ID单调递增，新用户总是追加到桶尾
+            bucket.append(doc_id)
+        else:
+            bisect.insort(bucket, doc_id)
+
+    def remove(self, age: int, doc_id: int):
+        bucket = self._buckets.get(age)
+        if bucket is None:
+            return
+        pos = bisect.bisect_left(bucket, doc_id)
+        if pos < len(bucket) and bucket[pos] == doc_id:
+            del bucket[pos]
+        if not bucket:
+            del self._buckets[age]
+            del self._ages[bisect.bisect_left(self._ages, age)]
+
+    def clear(self):
+        self._ages = []
+        self._buckets = {}
+
+    def _ages_in_range(self, min_age: int, max_age: int) -> List[int]:
+        lo = bisect.bisect_left(self._ages, min_age)
+        hi = bisect.bisect_right(self._ages, max_age)
+        return self._ages[lo:hi]
+
+    def iter_range(self, min_age: int, max_age: int) -> Iterator[int]:
+        """按ID升序流式返回年龄在 [min_age, max_age] 的ID"""
+        buckets = [self._buckets[age] for age in self._ages_in_range(min_age, max_age)]
+        if len(buckets) == 1:
+            return iter(buckets[0])
+        return heapq.merge(*buckets)
+
+    def range_after(self, min_age: int, max_age: int, after_id: int, limit: int) -> List[int]:
+        """年龄在 [min_age, max_age] 且ID大于 after_id 的前 limit 个ID（升序），O(桶数 * log n + limit)"""
+        iterators = []
+        for age in self._ages_in_range(min_age, max_age):
+            bucket = self._buckets[age]
+            start = bisect.bisect_right(bucket, after_id)
+            if start < len(bucket):
+                # 按下标从 start 开始取，不逐个跳过前面的元素
+                iterators.append(map(bucket.__getitem__, range(start, len(bucket))))
+        return list(islice(heapq.merge(*iterators), limit))
+
+    def count_range(self, min_age: int, max_age: int) -> int:
+        """年龄在 [min_age, max_age] 的用户数"""
+        return sum(len(self._buckets[age]) for age in self._ages_in_range(min_age, max_age))
+
+class OrderedIdIndex:
+    """升序ID列表，支持按偏移量和按游标（上一页最后一个ID）取页，均为 O(log n + limit)"""
+
+    def __init__(self):
+        self._ids: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, doc_id: int):
+        ids = self._ids
+        if not ids or ids[-1] < doc_id:
+            # ID单调递增，新用户总是追加到末尾
+            ids.append(doc_id)
+            return
+        pos = bisect.bisect_left(ids, doc_id)
+        if pos == len(ids) or ids[pos] != doc_id:
+            ids.insert(pos, doc_id)
+
+    def remove(self, doc_id: int):
+        ids = self._ids
+        pos = bisect.bisect_left(ids, doc_id)
+        if pos < len(ids) and ids[pos] == doc_id:
+            del ids[pos]
+
+    def clear(self):
+        self._ids = []
+
+    def slice(self, offset: int, limit: Optional[int] = None) -> List[int]:
+        """按偏移量取一页ID"""
+        stop = offset + limit if limit is not None else None
+        return self._ids[offset:stop]
+
+    def after(self, after_id: int, limit: int) -> List[int]:
+        """取大于 after_id 的前 limit 个ID"""
+        start = bisect.bisect_right(self._ids, after_id)
+        return self._ids[start:start + limit]
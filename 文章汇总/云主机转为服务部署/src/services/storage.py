@@ -0,0 +1,962 @@
+"""
+用户数据存储后端
+
+UserService 只依赖 UserStorage 接口，具体实现通过环境变量选择：
+  USER_STORAGE_BACKEND=memory  进程内字典索引 + JSON快照/追加日志持久化（默认）
+  USER_STORAGE_BACKEND=sqlite  SQLite(WAL模式)，多个worker进程共享同一份数据
+
+返回的用户记录是只读快照：内存后端直接返回内部记录（更新时整体替换而不是原地修改），
+调用方需要附加字段时应先复制。
+
+每次修改递增全局数据版本号，并把该用户的版本号记为修改后的全局版本号；
+版本号与随机生成的 epoch 组合成版本标识（见 version_tag），数据重建或进程重启后
+版本号从头计数也不会与旧标识重复。修改时先改数据再递增版本号，因此先读版本号
+再读数据时，版本标识只会比数据旧（多一次不必要的重新获取），不会比数据新。
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from typing import Callable, List, Dict, Iterator, Optional, Sequence
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+
+from services.indexes import AgeIndex, NGramIndex, OrderedIdIndex
+from utils.metrics import persistence_timings
+
+# 默认示例数据（数据文件不存在时使用）
+DEFAULT_USERS = [
+    {"id": 1, "name": "张三", "email": "zhangsan@example.com", "age": 25},
+    {"id": 2, "name": "李四", "email": "lisi@example.com", "age": 30},
+    {"id": 3, "name": "王五", "email": "wangwu@example.com", "age": 28}
+]
+
+# 允许更新的用户字段
+USER_FIELDS = ("name", "email", "age")
+# 用户记录的全部字段（字段投影 fields= 的可选值）
+USER_COLUMNS = ("id",) + USER_FIELDS
+
+# 存储后端
+STORAGE_BACKENDS = ("memory", "sqlite")
+
+# 持久化模式: snapshot = 每次修改整体重写数据文件; wal = 追加写日志 + 定期压缩为快照; none = 不持久化
+PERSISTENCE_MODES = ("snapshot", "wal", "none")
+# 日志超过该大小（字节）后压缩为新快照
+DEFAULT_LOG_MAX_BYTES = 4 * 1024 * 1024
+# 无锁读与写操作冲突时的重试次数，超过后加写锁读取
+READ_RETRIES = 3
+# 流式范围查询每次（一次无锁读）取出的用户数
+RANGE_CHUNK_SIZE = 1000
+
+def email_key(email: str) -> str:
+    """邮箱索引键（忽略大小写）"""
+    return (email or "").lower()
+
+def project(users: List[Dict], fields: Optional[Sequence[str]]) -> List[Dict]:
+    """只保留 fields 中的字段，fields 为 None 时原样返回"""
+    if fields is None:
+        return users
+    return [{field: user[field] for field in fields} for user in users]
+
+class UserStorage(ABC):
+    """用户存储接口，所有返回的用户记录都是 {"id", "name", "email", "age"} 字典（只读）
+
+    列表类查询的 fields 参数为要返回的字段（USER_COLUMNS 的子集），None 表示全部字段。
+    """
+
+    # 版本号的 epoch（十六进制字符串），由具体实现在初始化时生成
+    epoch = ""
+    # 单条写操作抛出异常时是否已完整回滚（可以安全重试）
+    atomic_writes = False
+
+    @abstractmethod
+    def count(self) -> int:
+        """用户总数"""
+
+    @abstractmethod
+    def get(self, user_id: int) -> Optional[Dict]:
+        """按ID获取用户"""
+
+    def get_many(self, user_ids: List[int]) -> List[Optional[Dict]]:
+        """按ID批量获取用户，结果与 user_ids 一一对应，不存在的为 None"""
+        return [self.get(user_id) for user_id in user_ids]
+
+    @abstractmethod
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        """按邮箱获取用户（忽略大小写）"""
+
+    @abstractmethod
+    def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                   fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        """按ID顺序分页列出用户"""
+
+    @abstractmethod
+    def list_after(self, after_id: int, limit: int, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        """按ID顺序列出ID大于 after_id 的前 limit 个用户（游标分页）"""
+
+    @abstractmethod
+    def version(self) -> int:
+        """全局数据版本号，任何修改后递增"""
+
+    @abstractmethod
+    def user_version(self, user_id: int) -> Optional[int]:
+        """用户最后一次修改时的全局版本号，用户不存在返回 None"""
+
+    @abstractmethod
+    def insert(self, user: Dict) -> Dict:
+        """插入新用户并分配ID，邮箱重复时抛出 ValueError"""
+
+    @abstractmethod
+    def update(self, user_id: int, update_data: Dict) -> Optional[Dict]:
+        """更新用户字段，用户不存在返回 None，邮箱重复时抛出 ValueError"""
+
+    @abstractmethod
+    def delete(self, user_id: int) -> bool:
+        """删除用户"""
+
+    @abstractmethod
+    def search(self, keyword: str, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        """在小写的姓名/邮箱中做子串匹配，keyword 已转为小写"""
+
+    @abstractmethod
+    def iter_age_range(self, min_age: int, max_age: int) -> Iterator[Dict]:
+        """按ID顺序流式返回年龄在 [min_age, max_age] 之间的用户"""
+
+    def age_range(self, min_age: int, max_age: int) -> List[Dict]:
+        """年龄在 [min_age, max_age] 之间的用户，按ID排序"""
+        return list(self.iter_age_range(min_age, max_age))
+
+    @abstractmethod
+    def count_age_range(self, min_age: int, max_age: int) -> int:
+        """年龄在 [min_age, max_age] 之间的用户数"""
+
+    @abstractmethod
+    def replace_all(self, users: List[Dict]):
+        """用给定列表替换全部数据"""
+
+    def batch(self):
+        """批量写入上下文：其中的所有修改只持久化一次"""
+        return nullcontext()
+
+    def after_restore(self):
+        """从快照（如 Lambda SnapStart）恢复出新实例后调用：重新生成 epoch，使各实例的版本标识互不相同"""
+        self.epoch = os.urandom(4).hex()
+
+    def close(self):
+        """释放资源"""
+
+class MemoryUserStorage(UserStorage):
+    """进程内存储: 字典索引 + JSON快照/追加日志持久化
+
+    并发模型：写操作（包括整个 batch）由一把写锁串行化；读操作不加锁。
+    用户记录不可变，更新时生成新字典整体替换，读者拿到的记录不会被改写。
+    写者修改索引前后各递增一次 _seq（修改期间为奇数），读者比较读取前后的
+    _seq，期间发生过写入就重试，多次冲突后再加写锁读取。
+    """
+
+    def __init__(self, data_file: Optional[str] = None, mode: Optional[str] = None):
+        # 主索引: id -> 用户记录（dict 保持插入顺序，即ID顺序）
+        self._users: Dict[int, Dict] = {}
+        # 邮箱索引: 小写邮箱 -> id
+        self._email_index: Dict[str, int] = {}
+        # 单调递增的ID计数器，删除用户后不会复用ID
+        self._next_id = 1
+        # 姓名/邮箱的 n-gram 倒排索引，用于搜索
+        self._search_index = NGramIndex()
+        # 年龄分桶索引，用于范围查询
+        self._age_index = AgeIndex()
+        # 有序ID索引，用于分页
+        self._id_index = OrderedIdIndex()
+        # 数据版本：全局版本号与每个用户最后修改时的版本号；epoch 区分不同进程/实例的计数
+        self.epoch = os.urandom(4).hex()
+        self._version = 0
+        self._user_versions: Dict[int, int] = {}
+
+        # 持久化配置
+        self.data_file = data_file or os.getenv('USER_DATA_FILE', '/tmp/users.json')
+        self.persistence_mode = (mode or os.getenv('USER_DATA_MODE', 'snapshot')).lower()
+        if self.persistence_mode not in PERSISTENCE_MODES:
+            raise ValueError(f"不支持的持久化模式: {self.persistence_mode}")
+        self.log_file = os.getenv('USER_DATA_LOG', self.data_file + '.log')
+        self.log_max_bytes = int(os.getenv('USER_DATA_LOG_MAX_BYTES', DEFAULT_LOG_MAX_BYTES))
+        self._log_handle = None
+        # 批量写入期间暂存的日志记录及对应的撤销操作，None 表示不在批量模式
+        self._pending: Optional[List[Dict]] = None
+        self._pending_undo: List[Callable[[], None]] = []
+        # 写锁（可重入：batch 内的单条写操作再次获取）与修改序号
+        self._write_lock = threading.RLock()
+        self._seq = 0
+
+        self._rebuild_indexes([dict(u) for u in DEFAULT_USERS])
+        if self.persistence_mode != "none":
+            self._load_data()
+
+    def _rebuild_indexes(self, users: List[Dict]):
+        """根据用户列表重建全部索引"""
+        self._users = {}
+        self._email_index = {}
+        self._user_versions = {}
+        self._next_id = 1
+        self._search_index.clear()
+        self._age_index.clear()
+        self._id_index.clear()
+        for user in sorted(users, key=lambda u: u["id"]):
+            self._apply_create(user)
+
+    def _load_data(self):
+        """从快照文件加载数据，WAL模式下再重放日志"""
+        if os.path.exists(self.data_file):
+            try:
+                with open(self.data_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                # 快照格式: {"next_id": ..., "users": [...]}；旧版本的快照只是用户列表
+                if isinstance(data, list):
+                    data = {"users": data}
+                self._rebuild_indexes(data["users"])
+                # 删除的最大ID在重启后也不会被复用
+                self._next_id = max(self._next_id, data.get("next_id", 1))
+            except Exception as e:
+                print(f"加载数据失败: {e}")
+
+        if self.persistence_mode == "wal":
+            self._replay_log()
+
+    def _replay_log(self):
+        """按顺序重放日志记录（重放是幂等的，压缩中途崩溃也能恢复）"""
+        if not os.path.exists(self.log_file):
+            return
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下半行记录，忽略即可
+                    print(f"跳过损坏的日志记录: {self.log_file}:{line_no}")
+                    continue
+                try:
+                    self._apply_record(record)
+                except (KeyError, TypeError, AttributeError):
+                    # 缺少字段或结构不对的记录不应阻止启动
+                    print(f"跳过无效的日志记录: {self.log_file}:{line_no}")
+
+    def _apply_record(self, record: Dict):
+        """将一条日志记录应用到内存索引"""
+        op = record.get("op")
+        if op == "create":
+            self._apply_create(dict(record["user"]))
+        elif op == "update":
+            self._apply_update(record["id"], record["data"])
+        elif op == "delete":
+            self._apply_delete(record["id"])
+
+    @staticmethod
+    def _search_texts(user: Dict):
+        """参与搜索的小写字段"""
+        return (user["name"].lower(), user["email"].lower())
+
+    def _apply_create(self, user: Dict):
+        """写入新用户并更新索引"""
+        existing = self._users.get(user["id"])
+        if existing is not None:
+            self._drop_email(existing)
+            self._search_index.remove(existing["id"], self._search_texts(existing))
+            self._age_index.remove(existing["age"], existing["id"])
+        self._users[user["id"]] = user
+        self._email_index[email_key(user["email"])] = user["id"]
+        self._search_index.add(user["id"], self._search_texts(user))
+        self._age_index.add(user["age"], user["id"])
+        self._id_index.add(user["id"])
+        self._next_id = max(self._next_id, user["id"] + 1)
+        self._bump_version(user["id"])
+
+    def _bump_version(self, user_id: int):
+        """数据修改完成后递增版本号"""
+        self._version += 1
+        self._user_versions[user_id] = self._version
+
+    def _apply_update(self, user_id: int, update_data: Dict) -> Optional[Dict]:
+        """更新用户字段并同步索引"""
+        user = self._users.get(user_id)
+        if user is None:
+            return None
+        if "email" in update_data:
+            self._drop_email(user)
+            self._email_index[email_key(update_data["email"])] = user_id
+        reindex = "name" in update_data or "email" in update_data
+        if reindex:
+            self._search_index.remove(user_id, self._search_texts(user))
+        if "age" in update_data:
+            self._age_index.remove(user["age"], user_id)
+        # 不修改原记录：读者可能正持有它
+        user = self._users[user_id] = {**user, **update_data}
+        if reindex:
+            self._search_index.add(user_id, self._search_texts(user))
+        if "age" in update_data:
+            self._age_index.add(user["age"], user_id)
+        self._bump_version(user_id)
+        return user
+
+    def _apply_delete(self, user_id: int) -> Optional[Dict]:
+        """删除用户并清理索引"""
+        user = self._users.pop(user_id, None)
+        if user is not None:
+            self._drop_email(user)
+            self._search_index.remove(user_id, self._search_texts(user))
+            self._age_index.remove(user["age"], user_id)
+            self._id_index.remove(user_id)
+            self._user_versions.pop(user_id, None)
+            self._version += 1
+        return user
+
+    def _restore_user(self, user: Dict):
+        """撤销删除：放回原记录，并保持 _users 按ID排序"""
+        in_order = not self._users or next(reversed(self._users)) < user["id"]
+        self._apply_create(user)
+        if not in_order:
+            users = self._users
+            self._users = {user_id: users[user_id] for user_id in sorted(users)}
+
+    def _drop_email(self, user: Dict):
+        """从邮箱索引中移除该用户的邮箱"""
+        key = email_key(user["email"])
+        if self._email_index.get(key) == user["id"]:
+            del self._email_index[key]
+
+    @contextmanager
+    def _mutating(self):
+        """修改内存索引（调用方已持有写锁）；期间 _seq 为奇数"""
+        self._seq += 1
+        try:
+            yield
+        finally:
+            self._seq += 1
+
+    def _read(self, func, *args):
+        """无锁读：读取前后 _seq 相同且为偶数时结果一致，否则重试"""
+        for _ in range(READ_RETRIES):
+            seq = self._seq
+            if seq & 1:
+                continue
+            try:
+                result = func(*args)
+            except (KeyError, IndexError, RuntimeError):
+                # 并发修改导致的异常（记录已删除、字典大小改变）按冲突处理
+                if self._seq == seq:
+                    raise
+                continue
+            if self._seq == seq:
+                return result
+        with self._write_lock:
+            return func(*args)
+
+    def _persist(self, record: Dict, undo: Callable[[], None]):
+        """持久化一次修改：snapshot模式重写快照，wal模式追加一行日志
+
+        undo 撤销已应用到内存的修改；持久化失败时先撤销再抛出异常，
+        内存中不会留下磁盘上没有的数据。
+        """
+        if self._pending is not None:
+            self._pending.append(record)
+            self._pending_undo.append(undo)
+        else:
+            self._flush([record], [undo])
+
+    def _flush(self, records: List[Dict], undos: List[Callable[[], None]]):
+        """写入一组修改；失败时按相反顺序撤销这些修改并抛出异常"""
+        try:
+            if self.persistence_mode == "wal":
+                self._append_log(records)
+            elif self.persistence_mode == "snapshot":
+                self._write_snapshot()
+        except Exception:
+            with self._mutating():
+                for undo in reversed(undos):
+                    undo()
+            raise
+
+    @contextmanager
+    def batch(self):
+        """批量写入：期间的修改只在退出时持久化一次（一次快照或一次日志追加）
+
+        持久化失败时撤销整批修改并抛出异常。
+        """
+        with self._write_lock:
+            if self._pending is not None:
+                # 嵌套批量并入外层
+                yield
+                return
+            self._pending, self._pending_undo = [], []
+            try:
+                yield
+            finally:
+                records, self._pending = self._pending, None
+                undos, self._pending_undo = self._pending_undo, []
+                if records:
+                    self._flush(records, undos)
+
+    def _append_log(self, records: List[Dict]):
+        """追加紧凑的日志记录（一次写入），超过阈值时压缩；写入失败时抛出异常"""
+        start_time = time.perf_counter()
+        if self._log_handle is None:
+            self._log_handle = self._open_log()
+        # 每次追加后都已 flush，文件大小就是最后一条完整记录的末尾
+        offset = os.fstat(self._log_handle.fileno()).st_size
+        try:
+            self._log_handle.write("".join(
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records
+            ))
+            self._log_handle.flush()
+        except Exception:
+            self._discard_log_tail(offset)
+            raise
+        persistence_timings.get("wal_append").observe(time.perf_counter() - start_time)
+        if self._log_handle.tell() >= self.log_max_bytes:
+            try:
+                self.compact()
+            except Exception as e:
+                # 日志已完整保留，下次追加时再尝试压缩
+                print(f"压缩日志失败，保留日志: {e}")
+
+    def _discard_log_tail(self, offset: int):
+        """关闭日志并截断到 offset（最后一条完整记录之后），下次追加时重新打开"""
+        handle, self._log_handle = self._log_handle, None
+        try:
+            handle.close()
+        except Exception:
+            # 缓冲区中未写出的数据随句柄一起丢弃
+            pass
+        try:
+            os.truncate(self.log_file, offset)
+        except OSError as e:
+            # 截断失败时残留的半行在重放时会被跳过
+            print(f"截断日志失败: {e}")
+
+    def _open_log(self):
+        """以追加方式打开日志；若末尾是崩溃留下的半行，先补换行隔开"""
+        needs_newline = False
+        if os.path.exists(self.log_file) and os.path.getsize(self.log_file) > 0:
+            with open(self.log_file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        handle = open(self.log_file, 'a', encoding='utf-8')
+        if needs_newline:
+            handle.write("\n")
+            handle.flush()
+        return handle
+
+    def compact(self):
+        """将当前数据写成新快照并清空日志；快照写入失败时保留日志并抛出异常"""
+        with self._write_lock:
+            self._write_snapshot(indent=None)
+            if self._log_handle is not None:
+                self._log_handle.close()
+                self._log_handle = None
+            # 快照已落盘后再清空日志；若在两步之间崩溃，重放旧日志也不会出错
+            self._atomic_write(self.log_file, "")
+
+    @staticmethod
+    def _atomic_write(path: str, content: str):
+        """写临时文件后原子重命名，崩溃时不会留下写了一半的文件"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _write_snapshot(self, indent: Optional[int] = 2):
+        """写快照文件（写临时文件后原子重命名），失败时抛出异常"""
+        start_time = time.perf_counter()
+        data = {"next_id": self._next_id, "users": list(self._users.values())}
+        if indent is None:
+            content = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        else:
+            content = json.dumps(data, ensure_ascii=False, indent=indent)
+        self._atomic_write(self.data_file, content)
+        persistence_timings.get("snapshot").observe(time.perf_counter() - start_time)
+
+    def _save_data(self, indent: Optional[int] = 2):
+        """保存数据到快照文件（snapshot 模式，失败时只输出警告）"""
+        try:
+            self._write_snapshot(indent)
+        except Exception as e:
+            print(f"保存数据失败: {e}")
+
+    def count(self) -> int:
+        return len(self._users)
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        return self._users.get(user_id)
+
+    def version(self) -> int:
+        return self._version
+
+    def user_version(self, user_id: int) -> Optional[int]:
+        return self._user_versions.get(user_id)
+
+    def _get_many(self, user_ids: List[int]) -> List[Optional[Dict]]:
+        get = self._users.get
+        return [get(user_id) for user_id in user_ids]
+
+    def get_many(self, user_ids: List[int]) -> List[Optional[Dict]]:
+        # 一次无锁读完成全部查找，结果来自同一个数据版本
+        return self._read(self._get_many, user_ids)
+
+    def _get_by_email(self, key: str) -> Optional[Dict]:
+        user_id = self._email_index.get(key)
+        return self._users[user_id] if user_id is not None else None
+
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        return self._read(self._get_by_email, email_key(email))
+
+    def _list_users(self, offset: int, limit: Optional[int]) -> List[Dict]:
+        if offset == 0 and limit is None:
+            return list(self._users.values())
+        users = self._users
+        return [users[user_id] for user_id in self._id_index.slice(offset, limit)]
+
+    def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                   fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        # 记录写时复制、不会原地修改，投影可以在无锁读之外进行
+        return project(self._read(self._list_users, offset, limit), fields)
+
+    def _list_after(self, after_id: int, limit: int) -> List[Dict]:
+        users = self._users
+        return [users[user_id] for user_id in self._id_index.after(after_id, limit)]
+
+    def list_after(self, after_id: int, limit: int, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        return project(self._read(self._list_after, after_id, limit), fields)
+
+    def insert(self, user: Dict) -> Dict:
+        with self._write_lock:
+            if email_key(user["email"]) in self._email_index:
+                raise ValueError("邮箱已存在")
+
+            next_id = self._next_id
+            new_user = {"id": next_id, **{field: user[field] for field in USER_FIELDS}}
+            with self._mutating():
+                self._apply_create(new_user)
+
+            def undo():
+                self._apply_delete(new_user["id"])
+                self._next_id = next_id
+            self._persist({"op": "create", "user": new_user}, undo)
+        return new_user
+
+    def update(self, user_id: int, update_data: Dict) -> Optional[Dict]:
+        with self._write_lock:
+            if user_id not in self._users:
+                return None
+
+            # 检查邮箱唯一性
+            if "email" in update_data:
+                owner_id = self._email_index.get(email_key(update_data["email"]))
+                if owner_id is not None and owner_id != user_id:
+                    raise ValueError("邮箱已存在")
+
+            old_user = self._users[user_id]
+            with self._mutating():
+                user = self._apply_update(user_id, update_data)
+            self._persist(
+                {"op": "update", "id": user_id, "data": update_data},
+                lambda: self._apply_update(user_id, {field: old_user[field] for field in update_data}),
+            )
+        return user
+
+    def delete(self, user_id: int) -> bool:
+        with self._write_lock:
+            if user_id not in self._users:
+                return False
+
+            with self._mutating():
+                old_user = self._apply_delete(user_id)
+            self._persist({"op": "delete", "id": user_id}, lambda: self._restore_user(old_user))
+        return True
+
+    def _search(self, keyword: str) -> List[Dict]:
+        candidates = self._search_index.candidates(keyword)
+        if candidates is None:
+            # 关键词太短无法使用索引，退化为全表扫描
+            users = self._users.values()
+        else:
+            users = (self._users[user_id] for user_id in sorted(candidates))
+        # n-gram 交集只是候选集，仍需校验子串
+        return [
+            u for u in users
+            if keyword in u["name"].lower() or keyword in u["email"].lower()
+        ]
+
+    def search(self, keyword: str, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        return project(self._read(self._search, keyword), fields)
+
+    def _age_range(self, min_age: int, max_age: int) -> List[Dict]:
+        users = self._users
+        return [users[user_id] for user_id in self._age_index.iter_range(min_age, max_age)]
+
+    def _age_range_after(self, min_age: int, max_age: int, after_id: int, limit: int) -> List[Dict]:
+        users = self._users
+        return [users[user_id] for user_id in self._age_index.range_after(min_age, max_age, after_id, limit)]
+
+    def age_range(self, min_age: int, max_age: int) -> List[Dict]:
+        return self._read(self._age_range, min_age, max_age)
+
+    def iter_age_range(self, min_age: int, max_age: int) -> Iterator[Dict]:
+        # 按ID游标分块读取，每块是一次一致的无锁读，内存占用与匹配的用户数无关
+        after_id = 0
+        while True:
+            chunk = self._read(self._age_range_after, min_age, max_age, after_id, RANGE_CHUNK_SIZE)
+            yield from chunk
+            if len(chunk) < RANGE_CHUNK_SIZE:
+                return
+            after_id = chunk[-1]["id"]
+
+    def count_age_range(self, min_age: int, max_age: int) -> int:
+        return self._read(self._age_index.count_range, min_age, max_age)
+
+    def replace_all(self, users: List[Dict]):
+        with self._write_lock:
+            with self._mutating():
+                self._rebuild_indexes(users)
+            if self.persistence_mode == "wal":
+                self.compact()
+            elif self.persistence_mode == "snapshot":
+                self._save_data()
+
+    def close(self):
+        with self._write_lock:
+            if self._log_handle is not None:
+                self._log_handle.close()
+                self._log_handle = None
+
+class SQLiteUserStorage(UserStorage):
+    """SQLite存储: WAL模式，每个线程一个连接，多个进程可共享同一个数据库文件"""
+
+    # 每条写操作在事务（批量中为 SAVEPOINT）内执行，失败时整条回滚
+    atomic_writes = True
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        age INTEGER NOT NULL,
+        name_lower TEXT NOT NULL,
+        email_lower TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email_lower);
+    CREATE INDEX IF NOT EXISTS idx_users_age ON users(age, id);
+    CREATE TABLE IF NOT EXISTS user_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    -- 用户数由触发器维护，count() 无需全表扫描
+    CREATE TRIGGER IF NOT EXISTS users_count_insert AFTER INSERT ON users BEGIN
+        UPDATE user_meta SET value = value + 1 WHERE key = 'user_count';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_count_delete AFTER DELETE ON users BEGIN
+        UPDATE user_meta SET value = value - 1 WHERE key = 'user_count';
+    END;
+    -- 每个年龄的用户数同样由触发器维护，年龄范围计数只需累加至多 151 行
+    CREATE TABLE IF NOT EXISTS age_counts (
+        age INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    );
+    CREATE TRIGGER IF NOT EXISTS users_age_insert AFTER INSERT ON users BEGIN
+        INSERT INTO age_counts(age, count) VALUES (NEW.age, 1)
+            ON CONFLICT(age) DO UPDATE SET count = count + 1;
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_age_delete AFTER DELETE ON users BEGIN
+        UPDATE age_counts SET count = count - 1 WHERE age = OLD.age;
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_age_update AFTER UPDATE OF age ON users WHEN OLD.age <> NEW.age BEGIN
+        UPDATE age_counts SET count = count - 1 WHERE age = OLD.age;
+        INSERT INTO age_counts(age, count) VALUES (NEW.age, 1)
+            ON CONFLICT(age) DO UPDATE SET count = count + 1;
+    END;
+    -- 数据版本号：任何修改递增全局版本号，并记为该行的版本号。插入时行版本号由
+    -- INSERT 语句直接写入（NEXT_VERSION），触发器内更新只涉及 version 列，
+    -- 不会再次触发 UPDATE OF name, email, age
+    CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users BEGIN
+        UPDATE user_meta SET value = value + 1 WHERE key = 'version';
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_version_update AFTER UPDATE OF name, email, age ON users BEGIN
+        UPDATE user_meta SET value = value + 1 WHERE key = 'version';
+        UPDATE users SET version = (SELECT value FROM user_meta WHERE key = 'version') WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN
+        UPDATE user_meta SET value = value + 1 WHERE key = 'version';
+    END;
+    """
+
+    COLUMNS = "id, name, email, age"
+    # 单条语句的占位符数量（旧版本 SQLite 上限为 999）
+    MAX_PARAMS = 900
+    # 插入行的版本号：插入触发器递增后的全局版本号
+    NEXT_VERSION = "(SELECT value + 1 FROM user_meta WHERE key = 'version')"
+
+    def __init__(self, db_path: Optional[str] = None, busy_timeout_ms: int = 5000):
+        self.db_path = db_path or os.getenv('USER_DB_PATH', '/tmp/users.db')
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._init_schema()
+        if hasattr(os, "register_at_fork"):
+            # SQLite 连接不能跨 fork 使用：子进程丢弃继承的连接，按需重新打开
+            storage = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: storage() and storage()._reset_after_fork())
+
+    def _reset_after_fork(self):
+        """fork 后在子进程中调用：丢弃（不关闭）从父进程继承的连接"""
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def after_restore(self):
+        # 快照中的连接和数据库文件都是实例私有的副本：丢弃连接，并为副本生成新的 epoch
+        self._reset_after_fork()
+        epoch = int.from_bytes(os.urandom(4), "big")
+        with self._write() as cur:
+            cur.execute("UPDATE user_meta SET value = ? WHERE key = 'epoch'", (epoch,))
+        self.epoch = format(epoch, "08x")
+
+    def _conn(self) -> sqlite3.Connection:
+        """当前线程的连接（首次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: 自动提交，写操作显式 BEGIN IMMEDIATE
+            # check_same_thread=False 仅为了 close() 能在其他线程统一关闭，连接本身不跨线程使用
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                   timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _write(self):
+        """写事务上下文；批量模式下用 SAVEPOINT，单条失败只回滚该条"""
+        if getattr(self._local, "in_batch", False):
+            return _Savepoint(self._conn())
+        return _WriteTransaction(self._conn())
+
+    @contextmanager
+    def batch(self):
+        """批量写入：整批放在一个事务里，只提交一次"""
+        if getattr(self._local, "in_batch", False):
+            yield
+            return
+        with _WriteTransaction(self._conn()):
+            self._local.in_batch = True
+            try:
+                yield
+            finally:
+                self._local.in_batch = False
+
+    def _init_schema(self):
+        """建表并在首次创建时写入示例数据"""
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+        if columns and "version" not in columns:
+            # 旧版本创建的表没有版本号列
+            conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        conn.executescript(self.SCHEMA)
+        with self._write() as cur:
+            # 旧版本创建的数据库没有计数行，按当前行数初始化一次
+            cur.execute("INSERT OR IGNORE INTO user_meta(key, value) SELECT 'user_count', COUNT(*) FROM users")
+            cur.execute("INSERT OR IGNORE INTO user_meta(key, value) VALUES ('version', 0)")
+            if cur.execute("SELECT 1 FROM user_meta WHERE key = 'age_counts'").fetchone() is None:
+                # 旧版本创建的数据库没有年龄计数，按现有数据统计一次
+                cur.execute("DELETE FROM age_counts")
+                cur.execute("INSERT INTO age_counts(age, count) SELECT age, COUNT(*) FROM users GROUP BY age")
+                cur.execute("INSERT INTO user_meta(key, value) VALUES ('age_counts', 1)")
+            # epoch 随数据库创建生成，所有共享该数据库的进程一致
+            cur.execute("INSERT OR IGNORE INTO user_meta(key, value) VALUES ('epoch', ?)",
+                        (int.from_bytes(os.urandom(4), "big"),))
+            self.epoch = format(cur.execute("SELECT value FROM user_meta WHERE key = 'epoch'").fetchone()[0], "08x")
+            seeded = cur.execute("SELECT value FROM user_meta WHERE key = 'seeded'").fetchone()
+            if seeded is None:
+                self._insert_rows(cur, DEFAULT_USERS)
+                cur.execute("INSERT INTO user_meta(key, value) VALUES ('seeded', 1)")
+
+    @classmethod
+    def _insert_rows(cls, cur: sqlite3.Cursor, users: List[Dict]):
+        cur.executemany(
+            "INSERT INTO users(id, name, email, age, name_lower, email_lower, version) "
+            f"VALUES (?, ?, ?, ?, ?, ?, {cls.NEXT_VERSION})",
+            [(u["id"], u["name"], u["email"], u["age"], u["name"].lower(), email_key(u["email"])) for u in users]
+        )
+
+    @staticmethod
+    def _row_to_user(row) -> Dict:
+        return {"id": row[0], "name": row[1], "email": row[2], "age": row[3]}
+
+    def _select(self, where: str = "", params=(), suffix: str = "",
+                fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        if fields is None:
+            sql = f"SELECT {self.COLUMNS} FROM users {where} {suffix}"
+            return [self._row_to_user(row) for row in self._conn().execute(sql, params)]
+        # 只查询需要的列（列名限定在 USER_COLUMNS 内）
+        columns = [column for column in fields if column in USER_COLUMNS]
+        sql = f"SELECT {', '.join(columns)} FROM users {where} {suffix}"
+        return [dict(zip(columns, row)) for row in self._conn().execute(sql, params)]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT value FROM user_meta WHERE key = 'user_count'").fetchone()[0]
+
+    def version(self) -> int:
+        return self._conn().execute("SELECT value FROM user_meta WHERE key = 'version'").fetchone()[0]
+
+    def user_version(self, user_id: int) -> Optional[int]:
+        row = self._conn().execute("SELECT version FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        rows = self._select("WHERE id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def get_many(self, user_ids: List[int]) -> List[Optional[Dict]]:
+        found = {}
+        conn = self._conn()
+        # 分段查询，占位符数量不超过 SQLite 的上限
+        for start in range(0, len(user_ids), self.MAX_PARAMS):
+            chunk = user_ids[start:start + self.MAX_PARAMS]
+            sql = f"SELECT {self.COLUMNS} FROM users WHERE id IN ({','.join('?' * len(chunk))})"
+            for row in conn.execute(sql, chunk):
+                found[row[0]] = self._row_to_user(row)
+        return [found.get(user_id) for user_id in user_ids]
+
+    def get_by_email(self, email: str) -> Optional[Dict]:
+        rows = self._select("WHERE email_lower = ?", (email_key(email),))
+        return rows[0] if rows else None
+
+    def list_users(self, offset: int = 0, limit: Optional[int] = None,
+                   fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        return self._select("", (-1 if limit is None else limit, offset), "ORDER BY id LIMIT ? OFFSET ?", fields)
+
+    def list_after(self, after_id: int, limit: int, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        return self._select("WHERE id > ?", (after_id, limit), "ORDER BY id LIMIT ?", fields)
+
+    def insert(self, user: Dict) -> Dict:
+        try:
+            with self._write() as cur:
+                cur.execute(
+                    "INSERT INTO users(name, email, age, name_lower, email_lower, version) "
+                    f"VALUES (?, ?, ?, ?, ?, {self.NEXT_VERSION})",
+                    (user["name"], user["email"], user["age"], user["name"].lower(), email_key(user["email"]))
+                )
+                user_id = cur.lastrowid
+        except sqlite3.IntegrityError:
+            raise ValueError("邮箱已存在")
+        return {"id": user_id, **{field: user[field] for field in USER_FIELDS}}
+
+    def update(self, user_id: int, update_data: Dict) -> Optional[Dict]:
+        columns = {field: update_data[field] for field in USER_FIELDS if field in update_data}
+        if "name" in columns:
+            columns["name_lower"] = columns["name"].lower()
+        if "email" in columns:
+            columns["email_lower"] = email_key(columns["email"])
+
+        try:
+            with self._write() as cur:
+                if columns:
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    cur.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*columns.values(), user_id))
+                row = cur.execute(f"SELECT {self.COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone()
+        except sqlite3.IntegrityError:
+            raise ValueError("邮箱已存在")
+        return self._row_to_user(row) if row else None
+
+    def delete(self, user_id: int) -> bool:
+        with self._write() as cur:
+            cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            return cur.rowcount > 0
+
+    def search(self, keyword: str, fields: Optional[Sequence[str]] = None) -> List[Dict]:
+        return self._select(
+            "WHERE instr(name_lower, ?) > 0 OR instr(email_lower, ?) > 0", (keyword, keyword), "ORDER BY id", fields
+        )
+
+    def iter_age_range(self, min_age: int, max_age: int) -> Iterator[Dict]:
+        cursor = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM users WHERE age BETWEEN ? AND ? ORDER BY id", (min_age, max_age)
+        )
+        return (self._row_to_user(row) for row in cursor)
+
+    def count_age_range(self, min_age: int, max_age: int) -> int:
+        # 累加触发器维护的每个年龄的用户数，与匹配的用户数无关
+        return self._conn().execute(
+            "SELECT COALESCE(SUM(count), 0) FROM age_counts WHERE age BETWEEN ? AND ?", (min_age, max_age)
+        ).fetchone()[0]
+
+    def replace_all(self, users: List[Dict]):
+        with self._write() as cur:
+            cur.execute("DELETE FROM users")
+            self._insert_rows(cur, users)
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+class _WriteTransaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK，立即获取写锁避免升级死锁"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            start_time = time.perf_counter()
+            self.conn.execute("COMMIT")
+            persistence_timings.get("sqlite_commit").observe(time.perf_counter() - start_time)
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
+
+class _Savepoint:
+    """批量事务内的单条写操作"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Cursor:
+        self.conn.execute("SAVEPOINT batch_item")
+        return self.conn.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.conn.execute("ROLLBACK TO batch_item")
+        self.conn.execute("RELEASE batch_item")
+        return False
+
+def create_storage() -> UserStorage:
+    """根据 USER_STORAGE_BACKEND 创建存储后端"""
+    backend = os.getenv('USER_STORAGE_BACKEND', 'memory').lower()
+    if backend == "sqlite":
+        return SQLiteUserStorage()
+    if backend == "memory":
+        return MemoryUserStorage()
+    raise ValueError(f"不支持的存储后端: {backend}，可选: {', '.join(STORAGE_BACKENDS)}")
@@ -0,0 +1,277 @@
+"""
+准入控制与按客户端限流
+
+- ConcurrencyLimiter: 并发上限 + 有界等待队列，队列已满或等待超时时立即拒绝（503 + Retry-After）
+- TokenBuckets: 按客户端的令牌桶，每个客户端只保存 [令牌数, 上次更新时间]，
+  客户端数超过上限时淘汰最久未访问的（空闲客户端的令牌桶必然是满的，淘汰后重建等价）
+- AdmissionControl / AdmissionMiddleware: 按路由类别（read / search / write）分别配置
+  限流速率和并发上限，另有一个全局并发上限
+
+所有状态只在事件循环线程中访问，不加锁；多进程部署时各 worker 分别计数。
+"""
+
+from collections import OrderedDict, deque
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+import asyncio
+import math
+import os
+import time
+
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+from utils.helpers import format_response
+
+# 路由类别
+ROUTE_CLASSES = ("read", "search", "write")
+
+# 计算量较大的只读接口（搜索、范围查询、全量导出）
+SEARCH_PREFIXES = ("/users/search", "/users/age-range", "/users/export")
+# 只读但使用 POST 的接口
+READ_ONLY_POSTS = ("/users/batch-get",)
+
+def route_class(method: str, path: str) -> str:
+    """按请求方法和路径划分路由类别"""
+    if method not in ("GET", "HEAD", "OPTIONS") and path not in READ_ONLY_POSTS:
+        return "write"
+    if path.startswith(SEARCH_PREFIXES):
+        return "search"
+    return "read"
+
+def _parse_pairs(spec: str) -> Dict[str, str]:
+    """解析 "类别=值,类别=值" 形式的配置"""
+    result = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        name = name.strip()
+        if name not in ROUTE_CLASSES:
+            raise ValueError(f"不支持的路由类别: {name}，可选: {', '.join(ROUTE_CLASSES)}")
+        result[name] = value.strip()
+    return result
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """解析限流配置 "read=50:100,search=5:10"（每秒令牌数:桶容量，省略容量时等于速率）"""
+    limits = {}
+    for name, value in _parse_pairs(spec).items():
+        rate, _, burst = value.partition(":")
+        try:
+            limits[name] = (float(rate), float(burst or rate))
+        except ValueError:
+            raise ValueError(f"限流配置格式不正确: {name}={value}")
+        if limits[name][0] <= 0 or limits[name][1] < 1:
+            raise ValueError(f"限流速率必须大于0、桶容量至少为1: {name}={value}")
+    return limits
+
+def parse_class_limits(spec: str) -> Dict[str, int]:
+    """解析并发上限配置 "search=32,write=64" """
+    limits = {}
+    for name, value in _parse_pairs(spec).items():
+        if not value.isdigit() or int(value) <= 0:
+            raise ValueError(f"并发上限必须是正整数: {name}={value}")
+        limits[name] = int(value)
+    return limits
+
+class TokenBuckets:
+    """按客户端的令牌桶（LRU 淘汰空闲客户端）"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        # 客户端 -> [令牌数, 上次更新时间]
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()
+        self.limited = 0
+        self.evictions = 0
+
+    def acquire(self, key: Hashable, now: Optional[float] = None) -> float:
+        """取一个令牌：成功返回0，否则返回还需等待的秒数"""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.limited += 1
+        return (1 - bucket[0]) / self.rate
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "clients": len(self._buckets),
+            "limited": self.limited,
+            "evictions": self.evictions,
+        }
+
+class ConcurrencyLimiter:
+    """并发上限 + 有界等待队列（先到先得）"""
+
+    def __init__(self, max_concurrent: int, max_queue: int = 0, queue_timeout: float = 1.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque = deque()
+        self.rejected = 0
+        self.timeouts = 0
+
+    async def acquire(self) -> bool:
+        """获取一个名额；队列已满或等待超时返回 False"""
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return False
+        except asyncio.CancelledError:
+            # 已经分到名额但请求被取消：把名额交给下一个
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        return True
+
+    def release(self):
+        """释放名额：有排队的请求时直接转交给队首"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+class AdmissionControl:
+    """准入控制与限流策略
+
+    - rate_limits: 路由类别 -> (每秒令牌数, 桶容量)，按客户端限流，超出返回 429
+    - class_limits: 路由类别 -> 并发上限；max_concurrent: 全局并发上限（0 表示不限制）
+    - 超过并发上限的请求最多排队 max_queue 个、等待 queue_timeout 秒，否则返回 503
+    - 客户端默认按连接的对端地址区分，trust_forwarded=True 时使用 X-Forwarded-For 的第一个地址
+    """
+
+    def __init__(self, max_concurrent: int = 0, max_queue: int = 0, queue_timeout: float = 1.0,
+                 class_limits: Optional[Dict[str, int]] = None,
+                 rate_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_clients: int = 10000, trust_forwarded: bool = False,
+                 exempt_paths: Sequence[str] = ("/health",)):
+        self.limiters: Dict[str, ConcurrencyLimiter] = {
+            name: ConcurrencyLimiter(limit, max_queue, queue_timeout)
+            for name, limit in (class_limits or {}).items()
+        }
+        self.global_limiter = ConcurrencyLimiter(max_concurrent, max_queue, queue_timeout) if max_concurrent else None
+        self.buckets: Dict[str, TokenBuckets] = {
+            name: TokenBuckets(rate, burst, max_clients) for name, (rate, burst) in (rate_limits or {}).items()
+        }
+        self.trust_forwarded = trust_forwarded
+        self.exempt_paths = frozenset(exempt_paths)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limiters or self.global_limiter or self.buckets)
+
+    def client_key(self, scope) -> str:
+        if self.trust_forwarded:
+            forwarded = Headers(scope=scope).get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "global": self.global_limiter.stats() if self.global_limiter else None,
+            "classes": {name: limiter.stats() for name, limiter in self.limiters.items()},
+            "rate_limits": {name: buckets.stats() for name, buckets in self.buckets.items()},
+        }
+
+class AdmissionMiddleware:
+    """按 AdmissionControl 的策略限流并控制并发的纯 ASGI 中间件"""
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        control = self.control
+        if scope["type"] != "http" or not control.enabled or scope["path"] in control.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], scope["path"])
+
+        buckets = control.buckets.get(name)
+        if buckets is not None:
+            wait = buckets.acquire(control.client_key(scope))
+            if wait:
+                await self._reject(scope, receive, send, 429, "请求过于频繁，请稍后重试", wait)
+                return
+
+        # 先占类别名额再占全局名额，避免排队中的重请求占满全局名额
+        acquired = []
+        for limiter in (control.limiters.get(name), control.global_limiter):
+            if limiter is None:
+                continue
+            if not await limiter.acquire():
+                for held in acquired:
+                    held.release()
+                await self._reject(scope, receive, send, 503, "服务繁忙，请稍后重试", limiter.queue_timeout)
+                return
+            acquired.append(limiter)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            for limiter in acquired:
+                limiter.release()
+
+    @staticmethod
+    async def _reject(scope, receive, send, status: int, message: str, retry_after: float):
+        response = JSONResponse(
+            status_code=status,
+            content=format_response(success=False, message=message, error=f"HTTP {status}"),
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+def control_from_env() -> AdmissionControl:
+    """按环境变量创建准入控制策略"""
+    return AdmissionControl(
+        max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "256")),
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "512")),
+        queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
+        class_limits=parse_class_limits(os.getenv("ADMISSION_CLASS_LIMITS", "search=32")),
+        rate_limits=parse_rate_limits(os.getenv("RATE_LIMITS", "")),
+        max_clients=int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000")),
+        trust_forwarded=os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true",
+    )
@@ -0,0 +1,102 @@
+"""
+版本化响应缓存
+
+缓存已经序列化好的响应体（bytes），按字节数而不是条目数限制容量，超出后按
+LRU 淘汰。缓存不设 TTL，而是绑定数据版本标识（UserService.version_tag）：
+版本变化时整体失效，因此命中的响应总是与当前数据一致。
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+import os
+import threading
+
+# 每个条目在响应体之外的估算开销（键、OrderedDict 节点等）
+ENTRY_OVERHEAD = 200
+
+class ResponseCache:
+    """按字节数限制容量的 LRU 响应缓存（线程安全）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        # 单个响应超过容量的 1/4 时不缓存，避免一次大响应把其它条目全部挤出
+        self.max_entry_bytes = max_bytes // 4
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _check_version(self, version: str):
+        """数据版本变化时清空缓存（调用方已持有锁）"""
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+            self._version = version
+
+    def get(self, key: Hashable, version: str) -> Optional[bytes]:
+        """取出与 version 对应的缓存响应体，未命中返回 None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(version)
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key: Hashable, version: str, body: bytes):
+        """缓存 version 版本数据生成的响应体（version 必须在读取数据之前获取）"""
+        size = len(body) + ENTRY_OVERHEAD
+        if not self.enabled or size > self.max_entry_bytes:
+            return
+        with self._lock:
+            # 生成期间数据已经变化（get 已切换到新版本）：结果过期，不缓存
+            if version != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old) + ENTRY_OVERHEAD
+            self._entries[key] = body
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted) + ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = None
+
+    def stats(self) -> Dict:
+        """命中率与容量统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+# 热点读接口的响应缓存，RESPONSE_CACHE_MAX_BYTES=0 关闭
+response_cache = ResponseCache(int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(16 * 1024 * 1024))))
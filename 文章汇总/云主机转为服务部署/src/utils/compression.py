@@ -0,0 +1,243 @@
+"""
+HTTP 响应压缩
+
+- negotiate_encoding: 按 Accept-Encoding（含 q 值）选择内容编码
+- PrecompressedAsset: 启动时一次性生成 identity / gzip / br / zstd 各版本与 ETag 的静态内容，
+  请求时只做协商和查表
+- CompressionMiddleware: 纯 ASGI 压缩中间件，小响应不压缩，流式响应逐块压缩，
+  大响应体放到线程池压缩，不阻塞事件循环
+"""
+
+from typing import Dict, Optional, Sequence, Tuple
+import gzip
+import hashlib
+import zlib
+
+import anyio
+from fastapi.responses import Response
+from starlette.datastructures import Headers, MutableHeaders
+
+from utils.etag import etag_matches
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：pip install .[performance]
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖：pip install .[performance]
+    zstandard = None
+
+# 已安装的编码，按静态内容的偏好顺序（q 值相同时靠前者优先）
+SUPPORTED_ENCODINGS = tuple(
+    encoding for encoding, available in (("br", brotli), ("zstd", zstandard), ("gzip", zlib))
+    if available is not None
+)
+
+# 预压缩静态内容使用的最高压缩级别
+MAX_LEVELS = {"gzip": 9, "br": 11, "zstd": 19}
+# 动态压缩的默认级别：压缩率与 CPU 开销的折中（见 tests/benchmark.py compression）
+DEFAULT_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """按编码一次性压缩；level 为 None 时使用最高压缩级别（适合预压缩的静态内容）"""
+    level = MAX_LEVELS[encoding] if level is None else level
+    if encoding == "gzip":
+        # mtime=0 保证同样的输入得到同样的输出
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"不支持的压缩编码: {encoding}")
+
+class StreamEncoder:
+    """增量压缩器：每块输出都可以立即解码（流式响应不用等到结束）"""
+
+    def __init__(self, encoding: str, level: Optional[int] = None):
+        self.encoding = encoding
+        level = DEFAULT_LEVELS[encoding] if level is None else level
+        if encoding == "gzip":
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        elif encoding == "br" and brotli is not None:
+            self._compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd" and zstandard is not None:
+            self._compressor = zstandard.ZstdCompressor(level=level, write_content_size=False).compressobj()
+        else:
+            raise ValueError(f"不支持的压缩编码: {encoding}")
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        """压缩一块数据；final=True 时结束压缩流，否则刷新到字节边界"""
+        compressor = self._compressor
+        if self.encoding == "br":
+            out = compressor.process(data) if data else b""
+            return out + (compressor.finish() if final else compressor.flush())
+        if not final and not data:
+            return b""
+        out = compressor.compress(data)
+        if final:
+            return out + compressor.flush()
+        if self.encoding == "gzip":
+            return out + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return out + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    """解析 Accept-Encoding：编码 -> q 值"""
+    result: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        result[coding] = q
+    return result
+
+def negotiate_encoding(header: Optional[str], available: Sequence[str] = SUPPORTED_ENCODINGS) -> Optional[str]:
+    """从 available（按服务端偏好排序）中选出客户端可接受且 q 值最高的编码，都不可接受时返回 None"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class PrecompressedAsset:
+    """预先压缩的静态内容"""
+
+    def __init__(self, body: bytes, media_type: str, cache_control: str = "public, max-age=86400"):
+        self.media_type = media_type
+        self.cache_control = cache_control
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        # 编码 -> (内容, ETag)；同一内容的不同编码是不同的表示，ETag 也不同
+        self.variants: Dict[str, tuple] = {"identity": (body, f'"{digest}"')}
+        for encoding in SUPPORTED_ENCODINGS:
+            compressed = compress(body, encoding)
+            if len(compressed) < len(body):
+                self.variants[encoding] = (compressed, f'"{digest}-{encoding}"')
+        self.encodings = tuple(e for e in SUPPORTED_ENCODINGS if e in self.variants)
+
+    def response(self, accept_encoding: Optional[str] = None, if_none_match: Optional[str] = None) -> Response:
+        """按 Accept-Encoding 返回对应版本，If-None-Match 命中时返回 304"""
+        encoding = negotiate_encoding(accept_encoding, self.encodings) or "identity"
+        body, etag = self.variants[encoding]
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+# 值得压缩的内容类型（前缀匹配）
+COMPRESSIBLE_TYPES = (
+    "text/", "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "image/svg+xml",
+)
+
+def available_encodings(names: str) -> Tuple[str, ...]:
+    """逗号分隔的编码列表中已安装的部分（保持顺序，空字符串表示不压缩）"""
+    return tuple(name.strip() for name in names.split(",") if name.strip() in SUPPORTED_ENCODINGS)
+
+class CompressionMiddleware:
+    """纯 ASGI 响应压缩中间件
+
+    - 按 Accept-Encoding 在 encodings（服务端偏好顺序）中协商编码
+    - 一次性响应小于 minimum_size 字节时原样返回
+    - 流式响应（more_body=True）逐块压缩并立即发送，不缓冲整个响应
+    - 单块数据不小于 thread_min_size 字节时在线程池中压缩（zlib/brotli/zstd 压缩时释放 GIL）
+    - 已带 Content-Encoding 的响应（如预压缩的首页）、304/204 与不可压缩类型直接透传
+    - 压缩后的响应把强 ETag 改为弱 ETag（表示变了，语义不变），If-None-Match 仍可命中
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, encodings: Optional[Sequence[str]] = None,
+                 levels: Optional[Dict[str, int]] = None, thread_min_size: int = 256 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = tuple(SUPPORTED_ENCODINGS if encodings is None else encodings)
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.thread_min_size = thread_min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding"), self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(self, encoding, send).send)
+
+class _CompressingSender:
+    """单个响应的压缩状态"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message = None
+        self.encoder: Optional[StreamEncoder] = None
+        self.passthrough = False
+
+    def _should_compress(self, body: bytes, more_body: bool) -> bool:
+        status = self.start_message["status"]
+        headers = Headers(raw=self.start_message["headers"])
+        if status < 200 or status in (204, 304) or "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        # 流式响应无法预知总大小，一律压缩
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    async def _compress(self, body: bytes, final: bool) -> bytes:
+        if len(body) >= self.middleware.thread_min_size:
+            return await anyio.to_thread.run_sync(self.encoder.compress, body, final)
+        return self.encoder.compress(body, final)
+
+    async def send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # 等到第一块响应体再决定是否压缩
+            self.start_message = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            if not self._should_compress(body, more_body):
+                self.passthrough = True
+                await self._send(self.start_message)
+                await self._send(message)
+                return
+            self.encoder = StreamEncoder(self.encoding, self.middleware.levels.get(self.encoding))
+            headers = MutableHeaders(scope=self.start_message)
+            headers["Content-Encoding"] = self.encoding
+            if "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = await self._compress(body, True)
+                headers["Content-Length"] = str(len(body))
+                await self._send(self.start_message)
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            await self._send(self.start_message)
+
+        body = await self._compress(body, not more_body)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
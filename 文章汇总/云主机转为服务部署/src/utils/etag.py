@@ -0,0 +1,44 @@
+"""
+ETag 条件请求
+
+ETag 由存储的数据版本标识生成，不需要哈希响应体；请求携带的 If-None-Match
+命中时直接返回 304，既不查询数据也不序列化。
+
+ETag 使用弱形式（W/"..."）：同一数据版本的响应按 Accept-Encoding 可能压缩、也可能不压缩，
+字节不同但语义相同；200 与 304 总是返回同样的 ETag 和 Vary。
+"""
+
+from typing import Dict, Optional
+import hashlib
+
+from fastapi.responses import Response
+
+# 每次使用前都要向服务端验证（轮询场景下配合 304 节省带宽）
+CACHE_CONTROL = "no-cache"
+
+def make_etag(*parts) -> str:
+    """由资源类型、请求参数摘要和版本标识组成的弱 ETag"""
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+def params_tag(*params) -> str:
+    """请求参数的短摘要：不同参数（关键词、分页、字段）的响应 ETag 不同"""
+    return hashlib.sha1(repr(params).encode("utf-8")).hexdigest()[:12]
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中：按 RFC 9110 使用弱比较（忽略 W/ 前缀），* 匹配任意版本"""
+    if not if_none_match:
+        return False
+    etag = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    """200 与 304 响应共用的缓存相关响应头（响应可能被压缩，304 也要带上 Vary）"""
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"}
+
+def not_modified(etag: str) -> Response:
+    """304 响应（无响应体）"""
+    return Response(status_code=304, headers=etag_headers(etag))
@@ -0,0 +1,126 @@
+"""
+Serverless 事件规范化
+
+把各云平台的 HTTP 事件统一转换为 Mangum 可识别的 API Gateway（REST API）事件：
+
+- 按事件结构识别来源并选定适配器；同一结构（顶层字段集合相同）的事件来自同一来源，
+  选定结果按字段集合缓存，之后的调用只做一次字典查找
+- 请求体原样以 bytes 传递（base64 只在这里解码一次），不做 JSON 解析和重新编码；
+  只有直接调用时传入的对象才序列化一次
+- 只使用标准库，不影响 handler 的冷启动
+"""
+
+from typing import Any, Callable, Dict, FrozenSet, Optional
+import base64
+import json
+
+Adapter = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+
+# 缓存的事件结构数上限（直接调用的事件字段不固定，避免无限增长）
+MAX_CACHED_SHAPES = 64
+
+def body_bytes(body: Any, is_base64: bool = False) -> bytes:
+    """请求体转为 bytes：字符串只编码一次，base64 解码一次，对象（直接调用）序列化一次"""
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    elif not isinstance(body, (bytes, bytearray)):
+        return json.dumps(body, ensure_ascii=False).encode("utf-8")
+    return base64.b64decode(body) if is_base64 else bytes(body)
+
+def rest_event(method: str, path: str, headers: Optional[Dict[str, Any]], query: Optional[Dict[str, Any]],
+               body: bytes, request_id: str, source_ip: Optional[str]) -> Dict[str, Any]:
+    """构造 API Gateway（REST API）格式的事件（请求体为 bytes）"""
+    return {
+        "resource": "/{proxy+}",
+        "httpMethod": method.upper(),
+        "path": path or "/",
+        "headers": headers or {},
+        "multiValueHeaders": {},
+        # 值为列表的参数（重复的查询参数）由 Mangum 按多值处理
+        "queryStringParameters": query or None,
+        "multiValueQueryStringParameters": None,
+        "body": body,
+        "isBase64Encoded": False,
+        "requestContext": {"requestId": request_id, "identity": {"sourceIp": source_ip}}
+    }
+
+def _context_request_id(context: Any) -> str:
+    return getattr(context, "request_id", None) or getattr(context, "aws_request_id", None) or "unknown"
+
+def aws_adapter(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """AWS API Gateway（REST / HTTP API）与 ALB 事件：Mangum 直接支持，原样返回"""
+    return event
+
+def tencent_gateway_adapter(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """腾讯云 API 网关触发器：查询参数在 queryString，客户端地址在 requestContext.sourceIp"""
+    request_context = event.get("requestContext") or {}
+    return rest_event(
+        event.get("httpMethod") or request_context.get("httpMethod") or "GET",
+        event.get("path") or request_context.get("path"),
+        event.get("headers"),
+        event.get("queryString") or event.get("queryStringParameters"),
+        body_bytes(event.get("body"), event.get("isBase64Encoded", False)),
+        request_context.get("requestId") or _context_request_id(context),
+        request_context.get("sourceIp") or (request_context.get("identity") or {}).get("sourceIp"),
+    )
+
+def gateway_adapter(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """带 httpMethod 的 API 网关事件（华为云 APIG 等，请求体通常为 base64）"""
+    request_context = event.get("requestContext") or {}
+    return rest_event(
+        event["httpMethod"],
+        event.get("path"),
+        event.get("headers"),
+        event.get("queryStringParameters"),
+        body_bytes(event.get("body"), event.get("isBase64Encoded", False)),
+        request_context.get("requestId") or _context_request_id(context),
+        (request_context.get("identity") or {}).get("sourceIp"),
+    )
+
+def direct_adapter(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """直接调用（控制台 / SDK 调用、华为云 method 字段格式）：默认 POST /"""
+    return rest_event(
+        event.get("method") or "POST",
+        event.get("path"),
+        event.get("headers"),
+        event.get("queryStringParameters"),
+        body_bytes(event.get("body"), event.get("isBase64Encoded", False)),
+        _context_request_id(context),
+        None,
+    )
+
+def detect_adapter(event: Dict[str, Any]) -> Adapter:
+    """按事件结构识别来源"""
+    request_context = event.get("requestContext")
+    if "requestContext" in event and ("resource" in event or "version" in event
+                                      or "elb" in (request_context or {})):
+        return aws_adapter
+    if "serviceId" in (request_context or {}) or "queryString" in event:
+        return tencent_gateway_adapter
+    if "httpMethod" in event:
+        return gateway_adapter
+    return direct_adapter
+
+class EventNormalizer:
+    """按事件结构缓存适配器的事件规范化器"""
+
+    def __init__(self, max_shapes: int = MAX_CACHED_SHAPES):
+        self.max_shapes = max_shapes
+        self._adapters: Dict[FrozenSet[str], Adapter] = {}
+
+    def adapter_for(self, event: Dict[str, Any]) -> Adapter:
+        shape = frozenset(event)
+        adapter = self._adapters.get(shape)
+        if adapter is None:
+            adapter = detect_adapter(event)
+            if len(self._adapters) < self.max_shapes:
+                self._adapters[shape] = adapter
+        return adapter
+
+    def __call__(self, event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+        """转换为 API Gateway（REST API）事件"""
+        return self.adapter_for(event)(event, context)
+
+normalize_event = EventNormalizer()
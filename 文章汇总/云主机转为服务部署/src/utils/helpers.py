@@ -1,9 +1,22 @@
 import logging
+import inspect
+import os
+import random
+import threading
 import time
 from datetime import datetime
 from functools import wraps
-from typing import Any, Callable
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
 import json
+import base64
+import csv
+import io
+from itertools import islice
+
+from utils.metrics import (
+    HDR_BUCKET_COUNT, HDR_HALF_COUNT, HDR_SUB_BUCKET_BITS, HDR_SUB_BUCKET_COUNT,
+    function_timings, hdr_quantiles
+)
 
 # 配置日志
 logging.basicConfig(
@@ -13,15 +26,35 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 按该比例抽样输出耗时日志，0 表示不输出（耗时始终记录到直方图）
+TIMER_LOG_SAMPLE_RATE = float(os.getenv("TIMER_LOG_SAMPLE_RATE", "0"))
+
 def timer(func: Callable) -> Callable:
-    """装饰器：记录函数执行时间"""
+    """装饰器：记录函数执行时间到按函数名划分的延迟直方图（支持 async 函数）"""
+    histogram = function_timings.get(func.__name__)
+
+    def record(elapsed: float):
+        histogram.observe(elapsed)
+        if TIMER_LOG_SAMPLE_RATE > 0 and random.random() < TIMER_LOG_SAMPLE_RATE:
+            logger.info(f"{func.__name__} 执行时间: {elapsed:.4f}秒")
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record(time.perf_counter() - start_time)
+        return async_wrapper
+
     @wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        logger.info(f"{func.__name__} 执行时间: {end_time - start_time:.4f}秒")
-        return result
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(time.perf_counter() - start_time)
     return wrapper
 
 def validate_age(age: int) -> bool:
@@ -32,12 +65,87 @@ def validate_email(email: str) -> bool:
     """简单的邮箱验证"""
     return "@" in email and "." in email.split("@")[1]
 
+def validate_user_fields(data: dict) -> Optional[str]:
+    """校验用户字段（只检查提供了的字段），返回错误信息，合法时返回 None"""
+    if data.get("age") is not None and not validate_age(data["age"]):
+        return "年龄必须在1-150之间"
+    if data.get("email") is not None and not validate_email(data["email"]):
+        return "邮箱格式不正确"
+    return None
+
 def sanitize_string(text: str) -> str:
     """清理字符串，移除特殊字符"""
     if not text:
         return ""
     return text.strip().replace("<", "&lt;").replace(">", "&gt;")
 
+def encode_cursor(last_id: int) -> str:
+    """生成不透明的分页游标（上一页最后一个用户ID）"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except Exception:
+        raise ValueError("无效的分页游标")
+    prefix, _, value = raw.partition(":")
+    if prefix != "id" or not value.isdigit():
+        raise ValueError("无效的分页游标")
+    return int(value)
+
+def parse_fields(fields: Optional[str], columns: Sequence[str]) -> Optional[tuple]:
+    """解析逗号分隔的字段投影参数，按 columns 的顺序返回（总是包含 columns[0] 即ID）；
+    未指定或包含全部字段时返回 None，包含未知字段时抛出 ValueError"""
+    if fields is None or not fields.strip():
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested.difference(columns)
+    if unknown:
+        raise ValueError(f"不支持的字段: {','.join(sorted(unknown))}，可选字段: {','.join(columns)}")
+    requested.add(columns[0])
+    if len(requested) == len(columns):
+        return None
+    return tuple(column for column in columns if column in requested)
+
+def iter_ndjson(chunks: Iterable[List[Dict]]) -> Iterator[bytes]:
+    """把用户块编码为 NDJSON，每块输出一段字节（一次 flush）"""
+    for chunk in chunks:
+        yield "".join(json.dumps(user, ensure_ascii=False) + "\n" for user in chunk).encode("utf-8")
+
+def iter_csv(chunks: Iterable[List[Dict]], fields: Sequence[str]) -> Iterator[bytes]:
+    """把用户块编码为 CSV（首段为表头），每块输出一段字节"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue().encode("utf-8")
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([user.get(field) for field in fields] for user in chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+def iter_json_response(message: str, data: Dict, list_key: str, items: Iterable[Dict],
+                       chunk_size: int = 1000) -> Iterator[bytes]:
+    """流式输出与 api_response 结构相同的 JSON：data 中先是给定字段，然后是按块编码的
+    data[list_key] 数组，最后是数组长度 data["count"]"""
+    fields = "".join(
+        f"{json.dumps(key)}: {json.dumps(value, ensure_ascii=False)}, " for key, value in data.items()
+    )
+    yield (json.dumps({"success": True, "message": message}, ensure_ascii=False)[:-1]
+           + f', "data": {{{fields}{json.dumps(list_key)}: [').encode("utf-8")
+    items = iter(items)
+    count = 0
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            break
+        yield (("," if count else "") + ",".join(
+            json.dumps(item, ensure_ascii=False) for item in chunk
+        )).encode("utf-8")
+        count += len(chunk)
+    yield f'], "count": {count}}}, "error": null}}'.encode("utf-8")
+
 def format_response(success: bool, message: str, data: Any = None, error: str = None) -> dict:
     """格式化API响应"""
     response = {
@@ -62,32 +170,133 @@ def log_response(response_data: dict):
     """记录响应日志"""
     logger.info(f"返回响应: {json.dumps(response_data, ensure_ascii=False)}")
 
+# 吞吐量滑动窗口（秒）
+THROUGHPUT_WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+THROUGHPUT_RING_SIZE = max(THROUGHPUT_WINDOWS.values())
+
+class _MonitorShard:
+    """单个线程独占的统计分片，只有所属线程写入，无需加锁"""
+    __slots__ = ("counts", "requests", "errors", "total_time", "max_time",
+                 "second", "ring_seconds", "ring_requests")
+
+    def __init__(self):
+        self.counts = [0] * HDR_BUCKET_COUNT
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # 当前所在的秒；进入新的一秒时在环形缓冲区记下"该秒开始前的累计请求数"，
+        # 因此每次记录只需比较一次秒数
+        self.second = -1
+        self.ring_seconds = [-1] * THROUGHPUT_RING_SIZE
+        self.ring_requests = [0] * THROUGHPUT_RING_SIZE
+
+    def requests_since(self, first_second: int) -> int:
+        """first_second（含）之后的请求数"""
+        start = None
+        for second, requests in zip(self.ring_seconds, self.ring_requests):
+            if second >= first_second and (start is None or second < start[0]):
+                start = (second, requests)
+        return self.requests - start[1] if start else 0
+
 class PerformanceMonitor:
-    """性能监控类"""
+    """性能监控类
+
+    每个线程写自己的分片（HDR 风格对数-线性直方图 + 按秒的累计计数环），
+    记录路径不加锁、不分配内存；get_stats() 读取时合并所有分片。读取与写入
+    并发时结果可能差一两个请求，对监控统计无影响。
+    """
     
     def __init__(self):
-        self.requests_count = 0
-        self.total_time = 0
-        self.errors_count = 0
+        self._local = threading.local()
+        self._shards: List[_MonitorShard] = []
+        self._shards_lock = threading.Lock()
+        self._started = time.perf_counter()
+        # 正在处理的请求数，由 performance_middleware 在事件循环线程中增减
+        self.in_flight = 0
+
+    def _shard(self) -> _MonitorShard:
+        """当前线程的分片（首次调用时创建并登记）"""
+        shard = _MonitorShard()
+        with self._shards_lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
     
-    def record_request(self, execution_time: float, is_error: bool = False):
-        """记录请求"""
-        self.requests_count += 1
-        self.total_time += execution_time
+    def record_request(self, execution_time: float, is_error: bool = False, now: Optional[float] = None):
+        """记录请求；now 为请求结束时的 time.perf_counter()，调用方已有时传入可省去一次取时"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        
+        second = int(now if now is not None else time.perf_counter())
+        if second != shard.second:
+            slot = second % THROUGHPUT_RING_SIZE
+            shard.ring_seconds[slot] = second
+            shard.ring_requests[slot] = shard.requests
+            shard.second = second
+        
+        # 热路径：内联 hdr_index，省去一次函数调用
+        micros = int(execution_time * 1_000_000)
+        if micros < HDR_SUB_BUCKET_COUNT:
+            index = micros if micros > 0 else 0
+        else:
+            shift = micros.bit_length() - HDR_SUB_BUCKET_BITS
+            index = shift * HDR_HALF_COUNT + (micros >> shift)
+            if index >= HDR_BUCKET_COUNT:
+                index = HDR_BUCKET_COUNT - 1
+        shard.counts[index] += 1
+        shard.requests += 1
+        shard.total_time += execution_time
+        if execution_time > shard.max_time:
+            shard.max_time = execution_time
         if is_error:
-            self.errors_count += 1
+            shard.errors += 1
     
     def get_stats(self) -> dict:
         """获取统计信息"""
-        avg_time = self.total_time / self.requests_count if self.requests_count > 0 else 0
-        error_rate = self.errors_count / self.requests_count if self.requests_count > 0 else 0
+        with self._shards_lock:
+            shards = list(self._shards)
+        
+        counts = [0] * HDR_BUCKET_COUNT
+        requests = errors = 0
+        total_time = max_time = 0.0
+        now = time.perf_counter()
+        window_requests = dict.fromkeys(THROUGHPUT_WINDOWS, 0)
+        for shard in shards:
+            for index, count in enumerate(shard.counts):
+                if count:
+                    counts[index] += count
+            requests += shard.requests
+            errors += shard.errors
+            total_time += shard.total_time
+            max_time = max(max_time, shard.max_time)
+            for name, window in THROUGHPUT_WINDOWS.items():
+                window_requests[name] += shard.requests_since(int(now) - window + 1)
+        
+        avg_time = total_time / requests if requests > 0 else 0
+        error_rate = errors / requests if requests > 0 else 0
+        max_ms = max_time * 1000
+        # 分位数取所在桶的上界（相对误差 < 1/64），不超过实际最大值
+        quantiles = ("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p99.9", 0.999)
+        values = hdr_quantiles(counts, requests, [q for _, q in quantiles])
+        latency = {name: round(min(value / 1000, max_ms), 3) for (name, _), value in zip(quantiles, values)}
+        latency["max"] = round(max_ms, 3)
+        uptime = now - self._started
         
         return {
-            "total_requests": self.requests_count,
-            "total_errors": self.errors_count,
+            "total_requests": requests,
+            "total_errors": errors,
             "average_response_time": round(avg_time, 4),
-            "error_rate": round(error_rate * 100, 2)
+            "error_rate": round(error_rate * 100, 2),
+            "latency_ms": latency,
+            # 启动不足一个窗口时按实际运行时长计算
+            "throughput_rps": {
+                name: round(window_requests[name] / max(1.0, min(window, uptime)), 3)
+                for name, window in THROUGHPUT_WINDOWS.items()
+            }
         }
 
 # 全局性能监控实例
-performance_monitor = PerformanceMonitor() 
\ No newline at end of file
+performance_monitor = PerformanceMonitor() 
@@ -0,0 +1,298 @@
+"""
+延迟直方图
+
+- LatencyHistogram: 固定分桶的直方图，记录一次只是一次二分查找加计数，
+  内存占用与调用次数无关，可以放在每个请求的热路径上。分位数按桶上界估算。
+- hdr_index / hdr_upper: HDR 风格的对数-线性分桶（微秒），每个 2 的幂区间
+  再细分 64 个子桶，任意取值的相对误差不超过 1/64，桶下标只需位运算。
+- RouteMetrics: 按路由模板 + 方法 + 状态码类别统计请求，基于 HdrHistogram。
+"""
+
+from typing import Dict, List, Optional, Sequence
+import bisect
+import os
+import sys
+import threading
+
+# HDR 分桶参数：小于 2^7 微秒的值逐微秒计数，更大的值每个 2 的幂区间 64 个子桶
+HDR_SUB_BUCKET_BITS = 7
+HDR_SUB_BUCKET_COUNT = 1 << HDR_SUB_BUCKET_BITS
+HDR_HALF_COUNT = HDR_SUB_BUCKET_COUNT >> 1
+# 覆盖到 2^36 微秒（约19小时），更大的值计入最后一个桶
+HDR_BUCKET_COUNT = (36 - HDR_SUB_BUCKET_BITS + 2) * HDR_HALF_COUNT
+
+def hdr_index(micros: int) -> int:
+    """微秒值对应的桶下标"""
+    if micros < HDR_SUB_BUCKET_COUNT:
+        return micros if micros > 0 else 0
+    shift = micros.bit_length() - HDR_SUB_BUCKET_BITS
+    index = shift * HDR_HALF_COUNT + (micros >> shift)
+    return index if index < HDR_BUCKET_COUNT else HDR_BUCKET_COUNT - 1
+
+def hdr_upper(index: int) -> int:
+    """桶下标对应的上界（微秒，含）"""
+    if index < HDR_SUB_BUCKET_COUNT:
+        return index
+    shift = index // HDR_HALF_COUNT - 1
+    mantissa = index - shift * HDR_HALF_COUNT
+    return ((mantissa + 1) << shift) - 1
+
+def hdr_quantiles(counts: List[int], total: int, quantiles: Sequence[float]) -> List[int]:
+    """按合并后的桶计数计算分位数（微秒，取桶上界），quantiles 需升序"""
+    results = []
+    if not total:
+        return [0] * len(quantiles)
+    targets = iter(quantiles)
+    q = next(targets)
+    seen = 0
+    for index, count in enumerate(counts):
+        if not count:
+            continue
+        seen += count
+        while seen >= q * total:
+            results.append(hdr_upper(index))
+            q = next(targets, None)
+            if q is None:
+                return results
+    # 浮点误差导致未命中的分位数取最后一个非空桶
+    last = max(i for i, c in enumerate(counts) if c)
+    return results + [hdr_upper(last)] * (len(quantiles) - len(results))
+
+# 桶上界（秒），最后一个桶收纳超过上界的全部样本
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图（线程安全）"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """记录一次耗时"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    def state(self):
+        """(各桶计数（非累计，最后一个为溢出桶）, 总次数, 总耗时) 的一致快照"""
+        with self._lock:
+            return list(self._counts), self._count, self._sum
+
+    def _quantile(self, counts: List[int], total: int, q: float) -> float:
+        """按桶上界估算分位数，落在溢出桶时返回最大值"""
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self._max
+        return self._max
+
+    def snapshot(self) -> Dict:
+        """统计快照（时间单位：毫秒）"""
+        with self._lock:
+            counts = list(self._counts)
+            total, total_sum, max_time = self._count, self._sum, self._max
+
+        result = {
+            "count": total,
+            "avg_ms": round(total_sum / total * 1000, 3) if total else 0,
+            "max_ms": round(max_time * 1000, 3),
+        }
+        if total:
+            for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+                result[name] = round(min(self._quantile(counts, total, q), max_time) * 1000, 3)
+        labels = [f"le_{bound * 1000:g}ms" for bound in self.buckets] + ["le_inf"]
+        result["buckets"] = {label: count for label, count in zip(labels, counts) if count}
+        return result
+
+class HistogramRegistry:
+    """按名称管理直方图"""
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> LatencyHistogram:
+        """获取（不存在时创建）指定名称的直方图"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def items(self) -> List:
+        """按名称排序的 (名称, 直方图) 列表"""
+        return sorted(list(self._histograms.items()))
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """全部已有调用的直方图快照"""
+        snapshots = {name: histogram.snapshot() for name, histogram in sorted(list(self._histograms.items()))}
+        return {name: snapshot for name, snapshot in snapshots.items() if snapshot["count"]}
+
+# @timer 装饰的函数耗时，按函数名记录
+function_timings = HistogramRegistry()
+# 持久化耗时（快照重写 / 日志追加 / SQLite 提交），按操作记录
+persistence_timings = HistogramRegistry()
+
+class HdrHistogram:
+    """单写者的 HDR 风格延迟直方图（不加锁，由调用方保证同一时间只有一个线程写入）"""
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * HDR_BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[hdr_index(int(seconds * 1_000_000))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "HdrHistogram"):
+        """把另一个直方图累加进来"""
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def latency_ms(self) -> Dict[str, float]:
+        """延迟分位数与最大值（毫秒），分位数不超过实际最大值"""
+        max_ms = self.max * 1000
+        names = ("p50", "p90", "p99", "p99.9")
+        values = hdr_quantiles(self.counts, self.count, (0.5, 0.9, 0.99, 0.999))
+        result = {name: round(min(value / 1000, max_ms), 3) for name, value in zip(names, values)}
+        result["max"] = round(max_ms, 3)
+        return result
+
+# 未匹配任何路由的请求（404 等）统一归到一个序列，避免按原始路径产生无限多的序列
+UNMATCHED_ROUTE = "<unmatched>"
+# 序列数超过上限后新出现的序列归到这里
+OVERFLOW_ROUTE = "<other>"
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+class _RouteSeries:
+    """单个 (方法, 路由模板) 的统计"""
+    __slots__ = ("key", "histogram", "statuses")
+
+    def __init__(self, key):
+        self.key = key
+        self.histogram = HdrHistogram()
+        self.statuses = [0] * len(STATUS_CLASSES)
+
+class RouteMetrics:
+    """按 路由模板 + 方法 + 状态码类别 统计请求
+
+    键使用路由模板（如 /users/{user_id}）而不是原始路径；未知方法记为 OTHER，
+    未匹配路由记为 <unmatched>，序列总数再受 max_series 限制，因此基数有界。
+    与 PerformanceMonitor 一样每个线程写自己的分片，读取时合并。
+    """
+
+    def __init__(self, max_series: int = 200):
+        self.max_series = max_series
+        self._local = threading.local()
+        self._shards: List[Dict] = []
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    def _series(self, shard: Dict, key) -> _RouteSeries:
+        """分片中首次出现的键：登记到全局键集合（超出上限时归入溢出序列）"""
+        with self._lock:
+            target = key
+            if key not in self._keys:
+                if len(self._keys) >= self.max_series:
+                    target = ("*", OVERFLOW_ROUTE)
+                self._keys.add(target)
+        series = shard.get(target)
+        if series is None:
+            series = shard[target] = _RouteSeries(target)
+        # 溢出的键直接指向溢出序列，下次无需再加锁
+        shard[key] = series
+        return series
+
+    def record(self, method: str, route: Optional[str], status_code: int, seconds: float):
+        """记录一次请求，route 为路由模板，未匹配路由时传 None"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+
+        key = (method if method in KNOWN_METHODS else "OTHER", route or UNMATCHED_ROUTE)
+        series = shard.get(key)
+        if series is None:
+            series = self._series(shard, key)
+        series.histogram.record(seconds)
+        status_class = status_code // 100 - 1
+        series.statuses[status_class if 0 <= status_class < len(STATUS_CLASSES) else 4] += 1
+
+    def merged(self) -> Dict:
+        """合并各线程分片：(方法, 路由模板) -> _RouteSeries"""
+        with self._lock:
+            shards = [list(shard.values()) for shard in self._shards]
+
+        merged: Dict = {}
+        for shard in shards:
+            # 溢出的键与溢出序列指向同一个对象，按对象去重
+            for series in {id(s): s for s in shard}.values():
+                total = merged.get(series.key)
+                if total is None:
+                    total = merged[series.key] = _RouteSeries(series.key)
+                total.histogram.merge(series.histogram)
+                total.statuses = [a + b for a, b in zip(total.statuses, series.statuses)]
+        return merged
+
+    def snapshot(self) -> List[Dict]:
+        """各路由的请求数、状态码分布、错误率与延迟分位数，按请求数降序"""
+        routes = []
+        for (method, route), series in self.merged().items():
+            requests = series.histogram.count
+            statuses = dict(zip(STATUS_CLASSES, series.statuses))
+            routes.append({
+                "method": method,
+                "route": route,
+                "requests": requests,
+                "status": {name: count for name, count in statuses.items() if count},
+                "error_rate": round(statuses["5xx"] / requests * 100, 2) if requests else 0,
+                "client_error_rate": round(statuses["4xx"] / requests * 100, 2) if requests else 0,
+                "latency_ms": series.histogram.latency_ms()
+            })
+        return sorted(routes, key=lambda r: r["requests"], reverse=True)
+
+# 按路由统计的请求指标
+route_metrics = RouteMetrics(int(os.getenv("ROUTE_METRICS_MAX_SERIES", "200")))
+
+def process_rss_bytes() -> int:
+    """进程当前常驻内存（字节）；非 Linux 平台退化为峰值常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return usage if sys.platform == "darwin" else usage * 1024
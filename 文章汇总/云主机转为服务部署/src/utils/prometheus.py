@@ -0,0 +1,119 @@
+"""
+Prometheus 文本格式（0.0.4）指标输出
+
+所有数值都来自已经聚合好的计数器和直方图，一次抓取的开销只与序列数
+（路由数、函数数）有关，与用户数和请求数无关。
+"""
+
+from typing import Dict, List, Sequence
+
+from utils.metrics import (
+    LATENCY_BUCKETS, STATUS_CLASSES, HistogramRegistry, RouteMetrics,
+    hdr_index, process_rss_bytes
+)
+
+# Starlette 会为 text/* 类型自动追加 charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# HDR 直方图折算为 Prometheus 累计桶时，每个上界对应的最后一个 HDR 桶下标；
+# HDR 桶宽带来的误差不超过 1/64
+_HDR_CUTS = [hdr_index(int(bound * 1_000_000)) for bound in LATENCY_BUCKETS]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsWriter:
+    """按指标族输出 HELP / TYPE 与样本行"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def family(self, name: str, metric_type: str, help_text: str):
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def sample(self, name: str, value: float, labels: Dict[str, str] = None):
+        self.lines.append(f"{name}{_labels(labels or {})} {_number(value)}")
+
+    def histogram(self, name: str, labels: Dict[str, str], cumulative: Sequence[int],
+                  count: int, total: float):
+        """cumulative 为与 LATENCY_BUCKETS 对应的累计计数"""
+        for bound, value in zip(LATENCY_BUCKETS, cumulative):
+            self.sample(f"{name}_bucket", value, {**labels, "le": f"{bound:g}"})
+        self.sample(f"{name}_bucket", count, {**labels, "le": "+Inf"})
+        self.sample(f"{name}_sum", total, labels)
+        self.sample(f"{name}_count", count, labels)
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+def _hdr_cumulative(counts: List[int]) -> List[int]:
+    """HDR 桶计数折算为 LATENCY_BUCKETS 上的累计计数（单次遍历）"""
+    result = []
+    seen = 0
+    index = 0
+    for cut in _HDR_CUTS:
+        while index <= cut:
+            seen += counts[index]
+            index += 1
+        result.append(seen)
+    return result
+
+def _fixed_cumulative(counts: List[int]) -> List[int]:
+    """LatencyHistogram 的桶计数（与 LATENCY_BUCKETS 对齐）转为累计计数"""
+    result = []
+    seen = 0
+    for count in counts[:len(LATENCY_BUCKETS)]:
+        seen += count
+        result.append(seen)
+    return result
+
+def _registry_histograms(writer: MetricsWriter, name: str, label: str, registry: HistogramRegistry):
+    for key, histogram in registry.items():
+        counts, count, total = histogram.state()
+        if count:
+            writer.histogram(name, {label: key}, _fixed_cumulative(counts), count, total)
+
+def render_metrics(routes: RouteMetrics, function_timings: HistogramRegistry,
+                   persistence_timings: HistogramRegistry, in_flight: int, user_count: int) -> str:
+    """生成 /metrics 的响应内容"""
+    writer = MetricsWriter()
+    series = sorted(routes.merged().items())
+
+    writer.family("http_requests_total", "counter", "HTTP requests by route template, method and status class.")
+    for (method, route), item in series:
+        for status, count in zip(STATUS_CLASSES, item.statuses):
+            if count:
+                writer.sample("http_requests_total", count, {"method": method, "route": route, "status": status})
+
+    writer.family("http_request_duration_seconds", "histogram", "HTTP request latency by route template and method.")
+    for (method, route), item in series:
+        hist = item.histogram
+        writer.histogram("http_request_duration_seconds", {"method": method, "route": route},
+                         _hdr_cumulative(hist.counts), hist.count, hist.total)
+
+    writer.family("http_requests_in_flight", "gauge", "HTTP requests currently being processed.")
+    writer.sample("http_requests_in_flight", in_flight)
+
+    writer.family("app_function_duration_seconds", "histogram", "Duration of @timer decorated functions.")
+    _registry_histograms(writer, "app_function_duration_seconds", "function", function_timings)
+
+    writer.family("storage_flush_duration_seconds", "histogram",
+                  "Persistence flush duration (snapshot rewrite, log append, SQLite commit).")
+    _registry_histograms(writer, "storage_flush_duration_seconds", "operation", persistence_timings)
+
+    writer.family("app_users", "gauge", "Number of stored users.")
+    writer.sample("app_users", user_count)
+
+    writer.family("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.")
+    writer.sample("process_resident_memory_bytes", process_rss_bytes())
+
+    return writer.render()
@@ -0,0 +1,77 @@
+"""
+快速 JSON 响应
+
+FastAPI 默认对 response_model 做一次校验，再经 jsonable_encoder 逐字段转换后用
+标准库 json 编码；列表接口的 CPU 大头都花在这里。本模块提供：
+
+- FastJSONResponse: 优先使用 orjson 编码，未安装时回退到标准库 json
+- api_response: 直接构造与 APIResponse 结构相同的响应对象。端点返回 Response
+  实例时 FastAPI 跳过 response_model 校验与 jsonable_encoder，
+  response_model 仍用于生成 OpenAPI 文档
+"""
+
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Optional
+import json
+import os
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # 可选依赖：pip install .[performance]
+    orjson = None
+
+def _default(obj: Any) -> Any:
+    """标准 JSON 类型以外的对象"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化类型: {type(obj).__name__}")
+
+def stdlib_dumps(content: Any) -> bytes:
+    """标准库编码，输出与 Starlette JSONResponse 一致"""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None,
+        separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+def orjson_dumps(content: Any) -> bytes:
+    """orjson 编码（原生支持 datetime，非字符串键转为字符串）"""
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+JSON_BACKENDS: Dict[str, Callable[[Any], bytes]] = {"stdlib": stdlib_dumps}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = orjson_dumps
+
+def resolve_backend(name: Optional[str] = None) -> str:
+    """解析 JSON 编码后端：auto（默认，有 orjson 用 orjson）/ orjson / stdlib"""
+    name = (name or os.getenv("JSON_RESPONSE_BACKEND", "auto")).lower()
+    if name == "auto":
+        return "orjson" if "orjson" in JSON_BACKENDS else "stdlib"
+    if name not in ("orjson", "stdlib"):
+        raise ValueError(f"不支持的JSON编码后端: {name}")
+    if name not in JSON_BACKENDS:
+        print("⚠️ 未安装 orjson，JSON 编码回退到标准库")
+        return "stdlib"
+    return name
+
+JSON_BACKEND = resolve_backend()
+
+class FastJSONResponse(JSONResponse):
+    """使用可配置编码后端的 JSON 响应"""
+
+    dumps = staticmethod(JSON_BACKENDS[JSON_BACKEND])
+
+    def render(self, content: Any) -> bytes:
+        return self.dumps(content)
+
+def api_response(success: bool, message: str, data: Any = None, error: Optional[str] = None,
+                 status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> FastJSONResponse:
+    """构造与 APIResponse 结构一致的响应（不经过模型校验）"""
+    return FastJSONResponse(
+        {"success": success, "message": message, "data": data, "error": error},
+        status_code=status_code, headers=headers
+    )
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+性能基准测试脚本
+
+使用方式：
+  python tests/benchmark.py user-service                    # UserService 点查/插入基准
+  python tests/benchmark.py user-service --sizes 1000 100000
+  python tests/benchmark.py search                          # 搜索: n-gram索引 vs 全表扫描
+  python tests/benchmark.py bulk                            # 批量导入: 各存储后端/持久化模式
+  python tests/benchmark.py responses                       # /users?limit=1000 响应序列化: 模型校验 vs 快速路径
+  python tests/benchmark.py batch-get                       # 200 个ID: 逐个 GET /users/{id} vs GET /users/batch
+  python tests/benchmark.py compression                     # /users?limit=1000 响应压缩: 各编码/级别的传输字节数 vs CPU 耗时
+  python tests/benchmark.py cold-start                      # handler.py: 导入到首个响应的耗时、每次调用的额外开销
+  python tests/benchmark.py queue-batch                     # 500 个创建操作: 逐个 API Gateway 事件 vs 一个 SQS 批量事件
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from typing import Callable, Dict, List
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+# 基准测试不读写真实数据文件
+os.environ.setdefault("USER_DATA_FILE", os.path.join(tempfile.mkdtemp(), "users.json"))
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+SURNAMES = "张李王刘陈杨赵黄周吴徐孙胡朱高林何郭马罗"
+GIVEN_NAMES = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂"
+
+def make_users(count: int, seed: int = 42) -> List[Dict]:
+    """生成合成用户数据"""
+    rng = random.Random(seed)
+    users = []
+    for i in range(1, count + 1):
+        name = rng.choice(SURNAMES) + "".join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+        users.append({
+            "id": i,
+            "name": name,
+            "email": f"user{i}@example{i % 97}.com",
+            "age": rng.randint(1, 150)
+        })
+    return users
+
+def measure(func: Callable[[], None], iterations: int) -> float:
+    """返回单次调用平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+def peak_rss_mb() -> float:
+    """进程峰值内存（MB），不支持的平台返回0"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return usage / 1024 / 1024 if sys.platform == "darwin" else usage / 1024
+
+async def asgi_get(app, path: str, query: str = "") -> bytes:
+    """直接调用 ASGI 应用发送 GET 请求，排除网络和HTTP解析开销"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    import asyncio
+    body = []
+    requested, done = False, asyncio.Event()
+
+    async def receive():
+        # 请求体只发送一次；之后（中间件监听断开连接时）等到响应结束
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+def make_service(size: int):
+    """创建预装 size 个用户的 UserService（跳过持久化，只测内存索引）"""
+    from services.api_service import UserService
+    from services.storage import MemoryUserStorage
+    service = UserService(MemoryUserStorage(mode="none"))
+    service.users_db = make_users(size)
+    return service
+
+def bench_user_service(args):
+    """UserService 点查与插入基准"""
+    from models.schemas import CreateUserRequest
+
+    print(f"{'用户数':>10} | {'按ID查询(µs)':>12} | {'按邮箱查询(µs)':>14} | {'插入(µs)':>10}")
+    print("-" * 58)
+    for size in args.sizes:
+        service = make_service(size)
+        rng = random.Random(size)
+        ids = [rng.randint(1, size) for _ in range(args.iterations)]
+        emails = [f"USER{i}@example{i % 97}.com" for i in ids]
+
+        id_iter = iter(ids)
+        get_by_id = measure(lambda: service.get_user_by_id(next(id_iter)), len(ids))
+        email_iter = iter(emails)
+        get_by_email = measure(lambda: service.get_user_by_email(next(email_iter)), len(emails))
+
+        requests = iter([
+            CreateUserRequest(name="基准用户", email=f"bench{i}@example.com", age=30)
+            for i in range(args.inserts)
+        ])
+        insert = measure(lambda: service.create_user(next(requests)), args.inserts)
+
+        print(f"{size:>10} | {get_by_id:>12.3f} | {get_by_email:>14.3f} | {insert:>10.3f}")
+
+def linear_search(users: List[Dict], keyword: str) -> List[Dict]:
+    """原始实现：逐个用户转小写后做子串匹配"""
+    keyword = keyword.lower()
+    return [u for u in users if keyword in u["name"].lower() or keyword in u["email"].lower()]
+
+def bench_search(args):
+    """搜索基准：n-gram 倒排索引 vs 全表扫描"""
+    from services.storage import MemoryUserStorage
+
+    users = make_users(args.size)
+    storage = MemoryUserStorage(mode="none")
+    start = time.perf_counter()
+    storage.replace_all(users)
+    print(f"📦 {args.size} 个用户，建索引耗时: {time.perf_counter() - start:.2f}秒，峰值内存: {peak_rss_mb():.0f}MB")
+
+    keywords = args.keywords or ["张伟", "李芳娜", "user12345", "example7", "@example12.", "不存在"]
+    print(f"{'关键词':>14} | {'结果数':>8} | {'全表扫描(ms)':>12} | {'索引(ms)':>10} | {'加速比':>8}")
+    print("-" * 66)
+    for keyword in keywords:
+        expected = linear_search(users, keyword)
+        results = storage.search(keyword.lower())
+        assert results == expected, f"结果不一致: {keyword}"
+
+        scan_ms = measure(lambda: linear_search(users, keyword), args.repeat) / 1000
+        index_ms = measure(lambda: storage.search(keyword.lower()), args.repeat) / 1000
+        print(f"{keyword:>14} | {len(results):>8} | {scan_ms:>12.2f} | {index_ms:>10.3f} | {scan_ms / index_ms:>7.0f}x")
+
+def bench_bulk(args):
+    """批量导入基准：bulk_create 在各存储后端/持久化模式下的耗时"""
+    from services.api_service import UserService
+    from services.storage import MemoryUserStorage, SQLiteUserStorage
+
+    items = [{"name": u["name"], "email": f"bulk-{u['email']}", "age": u["age"]} for u in make_users(args.size)]
+    workdir = tempfile.mkdtemp()
+    backends = {
+        "memory/snapshot": lambda: MemoryUserStorage(os.path.join(workdir, "snapshot.json"), mode="snapshot"),
+        "memory/wal": lambda: MemoryUserStorage(os.path.join(workdir, "wal.json"), mode="wal"),
+        "sqlite": lambda: SQLiteUserStorage(os.path.join(workdir, "users.db")),
+    }
+
+    print(f"📦 批量导入 {args.size} 个用户（每批 {args.batch_size} 条）")
+    for name, factory in backends.items():
+        service = UserService(factory())
+        start = time.perf_counter()
+        for i in range(0, len(items), args.batch_size):
+            service.bulk_create(items[i:i + args.batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"   {name:>16}: {elapsed:.2f}秒 ({args.size / elapsed:,.0f} 用户/秒)")
+        service.storage.close()
+
+def bench_responses(args):
+    """响应序列化基准：APIResponse 校验路径 vs api_response 快速路径（单进程，即每核 请求/秒）"""
+    import asyncio
+    import json
+    from fastapi import FastAPI
+    from models.schemas import APIResponse
+    from utils import responses
+
+    service = make_service(args.size)
+    app = FastAPI()
+
+    def page() -> Dict:
+        users = service.get_all_users(limit=args.limit)
+        return {"users": users, "total": service.count_users(), "limit": args.limit, "offset": 0}
+
+    @app.get("/validated", response_model=APIResponse)
+    async def validated():
+        return APIResponse(success=True, message="ok", data=page())
+
+    @app.get("/fast", response_model=APIResponse)
+    async def fast():
+        return responses.api_response(True, "ok", page())
+
+    async def call(path: str) -> bytes:
+        return await asgi_get(app, path)
+
+    async def run(path: str) -> float:
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            await call(path)
+        return args.requests / (time.perf_counter() - start)
+
+    cases = [("APIResponse 校验 + jsonable_encoder", "/validated", None)]
+    cases += [(f"api_response + {backend}", "/fast", backend) for backend in responses.JSON_BACKENDS]
+
+    print(f"📦 {args.size} 个用户，每个响应 {args.limit} 个用户，每种方式 {args.requests} 次请求")
+    print(f"{'方式':>36} | {'请求/秒':>10} | {'加速比':>8}")
+    print("-" * 62)
+    baseline, expected = None, None
+    for label, path, backend in cases:
+        if backend:
+            responses.FastJSONResponse.dumps = staticmethod(responses.JSON_BACKENDS[backend])
+        body = asyncio.run(call(path))
+        expected = expected or json.loads(body)
+        assert json.loads(body) == expected, f"响应内容不一致: {label}"
+        rps = asyncio.run(run(path))
+        baseline = baseline or rps
+        print(f"{label:>36} | {rps:>10.0f} | {rps / baseline:>7.1f}x")
+
+def bench_batch_get(args):
+    """按ID批量获取基准：逐个 GET /users/{id} vs 一次 GET /users/batch 的服务端CPU时间"""
+    import asyncio
+    import json
+    from app import app, user_service
+
+    user_service.users_db = make_users(args.size)
+    ids = random.Random(7).sample(range(1, args.size + 1), args.ids)
+
+    async def single():
+        return [json.loads(await asgi_get(app, f"/users/{user_id}"))["data"] for user_id in ids]
+
+    async def batch():
+        return json.loads(await asgi_get(app, "/users/batch", "ids=" + ",".join(map(str, ids))))["data"]["users"]
+
+    assert asyncio.run(single()) == asyncio.run(batch())
+
+    def cpu_ms(func) -> float:
+        start = time.process_time()
+        for _ in range(args.repeat):
+            asyncio.run(func())
+        return (time.process_time() - start) / args.repeat * 1000
+
+    # 批量请求只有几毫秒，单轮比值受噪声影响较大：交替测量多轮，报告中位数与范围
+    import statistics
+    rounds = [(cpu_ms(single), cpu_ms(batch)) for _ in range(args.rounds)]
+    ratios = sorted(single_ms / batch_ms for single_ms, batch_ms in rounds)
+    single_ms = statistics.median(r[0] for r in rounds)
+    batch_ms = statistics.median(r[1] for r in rounds)
+    print(f"📦 {args.size} 个用户中随机取 {args.ids} 个，{args.rounds} 轮 x {args.repeat} 次取中位数（进程CPU时间）")
+    print(f"   逐个 GET /users/{{id}}: {single_ms:8.2f} ms")
+    print(f"   GET /users/batch:      {batch_ms:8.2f} ms")
+    print(f"   CPU时间比: 中位数 {statistics.median(ratios):.0f}x，范围 {ratios[0]:.0f}x - {ratios[-1]:.0f}x"
+          f"（目标 >= {args.target:.0f}x：{'达到' if ratios[0] >= args.target else '未全部达到'}）")
+
+def bench_compression(args):
+    """响应压缩基准：各编码/级别下 /users?limit=1000 响应体的传输字节数与压缩耗时"""
+    from utils import compression, responses
+
+    service = make_service(args.size)
+    page = {"users": service.get_all_users(limit=args.limit), "total": service.count_users(),
+            "limit": args.limit, "offset": 0}
+    body = responses.api_response(True, "ok", page).body
+    levels = {"gzip": [1, 6, 9], "br": [1, 4, 6, 11], "zstd": [1, 3, 9, 19]}
+
+    print(f"📦 响应体 {len(body):,} 字节（{args.limit} 个用户），每个级别压缩 {args.repeat} 次取平均")
+    print(f"{'编码':>6} | {'级别':>4} | {'传输字节':>10} | {'压缩率':>7} | {'耗时(ms)':>9} | {'MB/秒':>8}")
+    print("-" * 62)
+    for encoding in compression.SUPPORTED_ENCODINGS:
+        for level in levels[encoding]:
+            compressed = compression.compress(body, encoding, level)
+            elapsed_ms = measure(lambda: compression.compress(body, encoding, level), args.repeat) / 1000
+            mark = " *" if level == compression.DEFAULT_LEVELS[encoding] else ""
+            print(f"{encoding:>6} | {level:>4} | {len(compressed):>10,} | {len(body) / len(compressed):>6.1f}x | "
+                  f"{elapsed_ms:>9.3f} | {len(body) / elapsed_ms / 1000:>8.1f}{mark}")
+    print("* 为 CompressionMiddleware 的默认级别")
+
+# 在新进程中导入 handler 并用构造的 API Gateway 事件调用，输出各阶段耗时（毫秒）
+COLD_START_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import handler
+imported = time.perf_counter()
+event = handler.api_gateway_event("GET", "/users", query={"limit": "10"})
+assert handler.lambda_handler(event, None)["statusCode"] == 200
+first = time.perf_counter()
+timings = []
+for _ in range(int(sys.argv[1])):
+    t = time.perf_counter()
+    handler.serverless_handler(event, None)
+    timings.append(time.perf_counter() - t)
+timings.sort()
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "first": (first - imported) * 1000,
+    "p50": timings[len(timings) // 2] * 1000,
+    "p99": timings[int(len(timings) * 0.99)] * 1000,
+}))
+"""
+
+def bench_cold_start(args):
+    """Serverless 冷启动基准：每次在新进程中测量导入 handler 与首个响应的耗时、热调用的单次耗时"""
+    import asyncio
+    import json
+    import statistics
+    import subprocess
+
+    src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../src")
+    configs = [
+        ("默认（首次调用时初始化）", {}),
+        ("HANDLER_PRELOAD=true", {"HANDLER_PRELOAD": "true"}),
+        ("HANDLER_DEBUG=true", {"HANDLER_DEBUG": "true"}),
+    ]
+
+    print(f"🧊 每种配置启动 {args.runs} 个新进程取中位数，每个进程热调用 {args.invocations} 次")
+    print(f"{'配置':>24} | {'导入(ms)':>9} | {'首个响应(ms)':>12} | {'合计(ms)':>9} | {'p50(ms)':>8} | {'p99(ms)':>8}")
+    print("-" * 88)
+    for label, extra_env in configs:
+        results = []
+        for _ in range(args.runs):
+            env = {**os.environ, **extra_env, "USER_DATA_FILE": os.path.join(tempfile.mkdtemp(), "users.json")}
+            output = subprocess.run(
+                [sys.executable, "-c", COLD_START_SCRIPT, str(args.invocations)],
+                cwd=src_dir, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        median = {key: statistics.median(r[key] for r in results) for key in results[0]}
+        print(f"{label:>24} | {median['import']:>9.1f} | {median['first']:>12.1f} | "
+              f"{median['import'] + median['first']:>9.1f} | {median['p50']:>8.3f} | {median['p99']:>8.3f}")
+
+    # 同一请求直接走 ASGI 应用（不经过 Mangum 事件转换）的耗时，作为单次调用开销的基准
+    from app import app
+
+    async def direct() -> float:
+        await asgi_get(app, "/users", "limit=10")
+        start = time.perf_counter()
+        for _ in range(args.invocations):
+            await asgi_get(app, "/users", "limit=10")
+        return (time.perf_counter() - start) / args.invocations * 1000
+
+    elapsed_ms = asyncio.run(direct())
+    print(f"{'直接调用 ASGI 应用':>24} | {'':>9} | {'':>12} | {'':>9} | {elapsed_ms:>8.3f} |")
+
+def bench_queue_batch(args):
+    """队列批量处理基准：N 个创建操作逐个通过 API Gateway 事件调用 vs 放在一个 SQS 批量事件中"""
+    import asyncio
+    import json
+    import handler
+    from app import user_service
+
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    print(f"📦 已有 {args.size} 个用户，创建 {args.ops} 个用户（USER_DATA_MODE={user_service.storage.persistence_mode}）")
+    for label, batched in (("逐个 POST /users 事件", False), ("一个 SQS 批量事件", True)):
+        user_service.users_db = make_users(args.size)
+        users = [{"name": f"队列{i}", "email": f"queue{i}@example.com", "age": 30} for i in range(args.ops)]
+        start = time.perf_counter()
+        if batched:
+            event = {"Records": [
+                {"messageId": str(i), "body": json.dumps({"op": "create", "user": user})} for i, user in enumerate(users)
+            ]}
+            assert handler.batch_handler(event, None)["batchItemFailures"] == []
+        else:
+            for user in users:
+                response = handler.lambda_handler(handler.api_gateway_event("POST", "/users", json.dumps(user)), None)
+                assert response["statusCode"] == 200
+        elapsed = time.perf_counter() - start
+        print(f"   {label:<20} {elapsed * 1000:9.1f} ms  ({args.ops / elapsed:8.0f} 操作/秒)")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="API性能基准测试工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    user_parser = subparsers.add_parser("user-service", help="UserService 点查/插入基准")
+    user_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                             help="数据规模列表 (默认: 1k 10k 100k 1M)")
+    user_parser.add_argument("--iterations", type=int, default=100_000, help="每种查询的次数")
+    user_parser.add_argument("--inserts", type=int, default=10_000, help="插入次数")
+    user_parser.set_defaults(func=bench_user_service)
+
+    search_parser = subparsers.add_parser("search", help="搜索: n-gram索引 vs 全表扫描")
+    search_parser.add_argument("--size", type=int, default=1_000_000, help="用户数 (默认: 1M)")
+    search_parser.add_argument("--keywords", nargs="+", help="查询关键词")
+    search_parser.add_argument("--repeat", type=int, default=3, help="每个关键词的重复次数")
+    search_parser.set_defaults(func=bench_search)
+
+    bulk_parser = subparsers.add_parser("bulk", help="批量导入: 各存储后端/持久化模式")
+    bulk_parser.add_argument("--size", type=int, default=100_000, help="用户数 (默认: 100k)")
+    bulk_parser.add_argument("--batch-size", type=int, default=10_000, help="每批条数 (默认: 10k)")
+    bulk_parser.set_defaults(func=bench_bulk)
+
+    responses_parser = subparsers.add_parser("responses", help="响应序列化: 模型校验 vs 快速路径")
+    responses_parser.add_argument("--size", type=int, default=10_000, help="用户数 (默认: 10k)")
+    responses_parser.add_argument("--limit", type=int, default=1000, help="每个响应的用户数 (默认: 1000)")
+    responses_parser.add_argument("--requests", type=int, default=500, help="每种方式的请求数")
+    responses_parser.set_defaults(func=bench_responses)
+
+    batch_parser = subparsers.add_parser("batch-get", help="按ID批量获取: 逐个请求 vs 批量接口")
+    batch_parser.add_argument("--size", type=int, default=10_000, help="用户数 (默认: 10k)")
+    batch_parser.add_argument("--ids", type=int, default=200, help="每次获取的ID数 (默认: 200)")
+    batch_parser.add_argument("--repeat", type=int, default=20, help="每轮重复次数")
+    batch_parser.add_argument("--rounds", type=int, default=5, help="测量轮数 (默认: 5)")
+    batch_parser.add_argument("--target", type=float, default=50, help="目标CPU时间比 (默认: 50)")
+    batch_parser.set_defaults(func=bench_batch_get)
+
+    compression_parser = subparsers.add_parser("compression", help="响应压缩: 传输字节数 vs CPU 耗时")
+    compression_parser.add_argument("--size", type=int, default=10_000, help="用户数 (默认: 10k)")
+    compression_parser.add_argument("--limit", type=int, default=1000, help="响应中的用户数 (默认: 1000)")
+    compression_parser.add_argument("--repeat", type=int, default=20, help="每个级别的压缩次数")
+    compression_parser.set_defaults(func=bench_compression)
+
+    cold_parser = subparsers.add_parser("cold-start", help="Serverless 冷启动: 导入到首个响应的耗时与单次调用开销")
+    cold_parser.add_argument("--runs", type=int, default=5, help="每种配置启动的进程数 (默认: 5)")
+    cold_parser.add_argument("--invocations", type=int, default=200, help="每个进程的热调用次数 (默认: 200)")
+    cold_parser.set_defaults(func=bench_cold_start)
+
+    queue_parser = subparsers.add_parser("queue-batch", help="队列批量处理: 逐个事件 vs 批量事件")
+    queue_parser.add_argument("--size", type=int, default=10_000, help="已有用户数 (默认: 10k)")
+    queue_parser.add_argument("--ops", type=int, default=500, help="创建操作数 (默认: 500)")
+    queue_parser.set_defaults(func=bench_queue_batch)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
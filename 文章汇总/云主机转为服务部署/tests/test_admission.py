@@ -0,0 +1,174 @@
+import pytest
+import sys
+import os
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from utils.admission import (
+    AdmissionControl, AdmissionMiddleware, ConcurrencyLimiter, TokenBuckets,
+    parse_class_limits, parse_rate_limits, route_class
+)
+
+def make_app(control: AdmissionControl) -> FastAPI:
+    """带准入控制的最小应用，搜索接口耗时 0.2 秒"""
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, control=control)
+
+    @app.get("/users/search/{keyword}")
+    async def search(keyword: str):
+        await asyncio.sleep(0.2)
+        return {"keyword": keyword}
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: int):
+        return {"id": user_id}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    return app
+
+async def fetch_all(app: FastAPI, paths):
+    """并发发送请求，返回各响应"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await asyncio.gather(*(client.get(path) for path in paths))
+
+class TestConfig:
+    """路由类别与配置解析测试"""
+
+    def test_route_class(self):
+        """测试按方法和路径划分路由类别"""
+        assert route_class("GET", "/users/1") == "read"
+        assert route_class("POST", "/users/batch-get") == "read"
+        assert route_class("GET", "/users/search/张三") == "search"
+        assert route_class("GET", "/users/export") == "search"
+        assert route_class("POST", "/users") == "write"
+        assert route_class("DELETE", "/users/bulk") == "write"
+
+    def test_parse(self):
+        """测试解析限流与并发上限配置"""
+        assert parse_rate_limits("read=50:100, search=5") == {"read": (50.0, 100.0), "search": (5.0, 5.0)}
+        assert parse_class_limits("search=32,write=8") == {"search": 32, "write": 8}
+        assert parse_rate_limits("") == {}
+        for spec in ("admin=1", "read=abc", "read=0"):
+            with pytest.raises(ValueError):
+                parse_rate_limits(spec)
+        with pytest.raises(ValueError):
+            parse_class_limits("search=-1")
+
+class TestTokenBuckets:
+    """令牌桶测试"""
+
+    def test_burst_and_refill(self):
+        """测试桶容量内放行、耗尽后返回等待时间、按速率补充"""
+        buckets = TokenBuckets(rate=2, burst=3)
+        assert [buckets.acquire("a", now=0) for _ in range(3)] == [0, 0, 0]
+        assert buckets.acquire("a", now=0) == pytest.approx(0.5)
+        assert buckets.acquire("b", now=0) == 0
+        assert buckets.acquire("a", now=0.5) == 0
+        assert buckets.acquire("a", now=0.5) > 0
+        # 补充不超过桶容量
+        assert [buckets.acquire("a", now=100) for _ in range(4)][-1] > 0
+        assert buckets.stats()["limited"] == 3
+
+    def test_lru_eviction(self):
+        """测试客户端数不超过上限，淘汰最久未访问的客户端"""
+        buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+        buckets.acquire("a", now=0)
+        buckets.acquire("b", now=0)
+        buckets.acquire("a", now=0)
+        buckets.acquire("c", now=0)
+        assert list(buckets._buckets) == ["a", "c"]
+        assert buckets.stats()["evictions"] == 1
+
+class TestConcurrencyLimiter:
+    """并发上限与等待队列测试"""
+
+    def test_queue_and_handoff(self):
+        """测试超过上限的请求排队，释放后按顺序转交名额，队列满时立即拒绝"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=5)
+            assert await limiter.acquire()
+            waiting = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            assert limiter.stats()["queued"] == 1
+            assert not await limiter.acquire()
+            limiter.release()
+            assert await waiting
+            assert limiter.active == 1
+            limiter.release()
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+        assert (stats["active"], stats["queued"], stats["rejected"]) == (0, 0, 1)
+
+    def test_timeout(self):
+        """测试排队超时返回 False 并移出队列"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+            await limiter.acquire()
+            assert not await limiter.acquire()
+            limiter.release()
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+        assert (stats["active"], stats["queued"], stats["timeouts"]) == (0, 0, 1)
+
+    def test_cancelled_waiter(self):
+        """测试排队中被取消的请求不占用名额"""
+        async def scenario():
+            limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=2, queue_timeout=5)
+            await limiter.acquire()
+            cancelled = asyncio.ensure_future(limiter.acquire())
+            waiting = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            limiter.release()
+            assert await waiting
+            limiter.release()
+            return limiter.stats()
+
+        stats = asyncio.run(scenario())
+        assert (stats["active"], stats["queued"]) == (0, 0)
+
+class TestAdmissionMiddleware:
+    """准入控制中间件测试"""
+
+    def test_search_concurrency_limit(self):
+        """测试搜索并发超限返回503且不影响其它类别的请求"""
+        control = AdmissionControl(class_limits={"search": 1})
+        responses = asyncio.run(fetch_all(make_app(control), ["/users/search/a", "/users/search/b", "/users/1"]))
+        assert [r.status_code for r in responses] == [200, 503, 200]
+        assert responses[1].headers["retry-after"] == "1"
+        assert responses[1].json()["success"] is False
+        assert control.stats()["classes"]["search"]["active"] == 0
+
+    def test_queue_absorbs_burst(self):
+        """测试等待队列吸收短时突发"""
+        control = AdmissionControl(max_concurrent=1, max_queue=2, queue_timeout=5)
+        responses = asyncio.run(fetch_all(make_app(control), [f"/users/search/{i}" for i in range(3)]))
+        assert [r.status_code for r in responses] == [200, 200, 200]
+
+    def test_rate_limit(self):
+        """测试按客户端限流返回429，健康检查不受限制"""
+        control = AdmissionControl(rate_limits={"read": (0.5, 2)})
+        app = make_app(control)
+        responses = asyncio.run(fetch_all(app, ["/users/1"] * 3 + ["/health"] * 3))
+        assert [r.status_code for r in responses] == [200, 200, 429, 200, 200, 200]
+        assert responses[2].headers["retry-after"] == "2"
+
+    def test_disabled(self):
+        """测试未配置任何限制时直接放行"""
+        control = AdmissionControl()
+        assert not control.enabled
+        responses = asyncio.run(fetch_all(make_app(control), ["/users/search/a"] * 3))
+        assert {r.status_code for r in responses} == {200}
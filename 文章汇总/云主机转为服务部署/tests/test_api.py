@@ -2,18 +2,30 @@ import pytest
 import sys
 import os
 import json
+import tempfile
 from typing import Dict, Any
 
 # 添加src目录到Python路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
 
+# 使用临时数据文件，避免读到之前运行留下的用户
+_data_dir = tempfile.mkdtemp()
+os.environ["USER_DATA_FILE"] = os.path.join(_data_dir, "users.json")
+os.environ["USER_DB_PATH"] = os.path.join(_data_dir, "users.db")
+
 from fastapi.testclient import TestClient
-from app import app
+from app import app, user_service
+from services.storage import DEFAULT_USERS
 from models.schemas import CreateUserRequest, UpdateUserRequest
 
 # 创建测试客户端
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def reset_users():
+    """每个测试前恢复默认示例数据"""
+    user_service.users_db = [dict(user) for user in DEFAULT_USERS]
+
 @pytest.fixture
 def sample_user():
     """示例用户数据"""
@@ -36,7 +48,7 @@ class TestHealthCheck:
     
     def test_health_check(self):
         """测试健康检查端点"""
-        response = client.get("/")
+        response = client.get("/health")
         assert response.status_code == 200
         data = response.json()
         assert "status" in data
@@ -44,6 +56,21 @@ class TestHealthCheck:
         assert "timestamp" in data
         assert "version" in data
 
+    def test_homepage_precompressed(self):
+        """测试首页按 Accept-Encoding 返回预压缩版本并支持304"""
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert "云主机用户管理API" in response.text
+        assert "max-age" in response.headers["cache-control"]
+
+        plain = client.get("/", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+        assert plain.text == response.text
+
+        etag = response.headers["etag"]
+        assert client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}).status_code == 304
+
     def test_stats_endpoint(self):
         """测试统计端点"""
         response = client.get("/stats")
@@ -52,6 +79,7 @@ class TestHealthCheck:
         assert data["success"] == True
         assert "data" in data
         assert "total_requests" in data["data"]
+        assert data["data"]["admission"]["enabled"] is True
 
 class TestUserCRUD:
     """用户CRUD操作测试"""
@@ -77,6 +105,21 @@ class TestUserCRUD:
         assert data["data"]["limit"] == 2
         assert data["data"]["offset"] == 0
 
+    def test_get_users_with_cursor(self):
+        """测试游标分页"""
+        first = client.get("/users?limit=1").json()["data"]
+        assert first["has_more"] == True
+        assert first["next_cursor"]
+
+        second = client.get(f"/users?limit=1&cursor={first['next_cursor']}").json()["data"]
+        assert second["users"][0]["id"] > first["users"][0]["id"]
+        assert second["offset"] is None
+
+    def test_get_users_invalid_cursor(self):
+        """测试无效游标"""
+        response = client.get("/users?cursor=not-a-cursor")
+        assert response.status_code == 400
+
     def test_get_user_by_id_existing(self):
         """测试获取存在的用户"""
         response = client.get("/users/1")
@@ -186,13 +229,156 @@ class TestUserCRUD:
         response = client.delete("/users/999")
         assert response.status_code == 404
 
+class TestBulkOperations:
+    """批量操作测试"""
+    
+    def test_bulk_create(self):
+        """测试批量创建"""
+        response = client.post("/users/bulk", json={"users": [
+            {"name": "批量用户1", "email": "bulk1@example.com", "age": 20},
+            {"name": "批量用户2", "email": "invalid-email", "age": 20},
+            {"name": "批量用户3", "email": "bulk3@example.com", "age": 200},
+        ]})
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["created_count"] == 1
+        assert [e["index"] for e in data["errors"]] == [1, 2]
+
+    def test_bulk_update(self):
+        """测试批量更新"""
+        created = client.post("/users/bulk", json={"users": [
+            {"name": "批量更新", "email": "bulk-update@example.com", "age": 20}
+        ]}).json()["data"]["created"][0]
+        response = client.patch("/users/bulk", json={"users": [
+            {"id": created["id"], "age": 21},
+            {"id": 999999, "age": 21},
+        ]})
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["updated"][0]["age"] == 21
+        assert data["errors"][0]["id"] == 999999
+
+    def test_bulk_delete(self):
+        """测试批量删除"""
+        created = client.post("/users/bulk", json={"users": [
+            {"name": "批量删除", "email": "bulk-delete@example.com", "age": 20}
+        ]}).json()["data"]["created"][0]
+        response = client.request("DELETE", "/users/bulk", json={"ids": [created["id"], 999999]})
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["deleted_user_ids"] == [created["id"]]
+        assert client.get(f"/users/{created['id']}").status_code == 404
+
+    def test_bulk_empty(self):
+        """测试空批量请求"""
+        response = client.post("/users/bulk", json={"users": []})
+        assert response.status_code == 400
+
+class TestFieldProjection:
+    """字段投影测试"""
+
+    def test_users_fields(self):
+        """测试列表按 fields 只返回指定字段，并去掉附加的链接"""
+        data = client.get("/users?limit=2&fields=name").json()["data"]
+        assert data["users"] == [{"id": 1, "name": "张三"}, {"id": 2, "name": "李四"}]
+        assert "cloud_api_url" not in data
+        data = client.get(f"/users?limit=2&cursor={data['next_cursor']}&fields=age").json()["data"]
+        assert data["users"] == [{"id": 3, "age": 28}]
+        # 不同投影的响应分别缓存
+        assert "email" in client.get("/users?limit=2").json()["data"]["users"][0]
+
+    def test_search_fields(self):
+        """测试搜索按 fields 只返回指定字段"""
+        data = client.get("/users/search/张三?fields=id,email").json()["data"]
+        assert data["results"] == [{"id": 1, "email": "zhangsan@example.com"}]
+        assert "search_url" not in data
+        assert "search_url" in client.get("/users/search/张三").json()["data"]
+
+    def test_unknown_field(self):
+        """测试未知字段返回400"""
+        response = client.get("/users?fields=id,password")
+        assert response.status_code == 400
+        assert "password" in response.json()["message"]
+
+class TestBatchGet:
+    """按ID批量获取测试"""
+
+    def test_batch_get_keeps_order(self):
+        """测试按请求顺序返回、去重并报告不存在的ID"""
+        response = client.get("/users/batch?ids=3,1,99,3")
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert [u["id"] for u in data["users"]] == [3, 1]
+        assert data["users"][0] == client.get("/users/3").json()["data"]
+        assert data["missing_ids"] == [99]
+        assert (data["found_count"], data["missing_count"]) == (2, 1)
+
+    def test_batch_get_post(self):
+        """测试 POST 形式与 GET 结果一致"""
+        response = client.post("/users/batch-get", json={"ids": [2, 100, 1]})
+        assert response.status_code == 200
+        assert response.json()["data"] == client.get("/users/batch?ids=2,100,1").json()["data"]
+
+    def test_batch_get_invalid(self):
+        """测试空列表、非法ID与缺少参数"""
+        assert client.get("/users/batch?ids=").status_code == 400
+        assert client.get("/users/batch?ids=1,abc").status_code == 400
+        assert client.get("/users/batch?ids=1,-2").status_code == 400
+        assert client.get("/users/batch").status_code == 422
+        assert client.post("/users/batch-get", json={"ids": []}).status_code == 400
+
+class TestExport:
+    """导出测试"""
+    
+    def test_export_ndjson(self):
+        """测试 NDJSON 导出"""
+        response = client.get("/users/export?chunk_size=2")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        users = [json.loads(line) for line in response.text.splitlines()]
+        assert len(users) == client.get("/users").json()["data"]["total"]
+        assert [u["id"] for u in users] == sorted(u["id"] for u in users)
+
+    def test_export_csv(self):
+        """测试 CSV 导出"""
+        response = client.get("/users/export?format=csv")
+        assert response.status_code == 200
+        assert response.text.splitlines()[0] == "id,name,email,age"
+
+    def test_export_compressed(self):
+        """测试大列表与流式导出按 Accept-Encoding 压缩，小响应不压缩"""
+        user_service.bulk_create([{"name": f"压缩{i}", "email": f"gz{i}@example.com", "age": 30} for i in range(200)])
+        response = client.get("/users?limit=1000", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["etag"].startswith("W/")
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert len(response.json()["data"]["users"]) == 203
+        # 304 与压缩后的 200 返回同样的 ETag 和 Vary
+        not_modified = client.get("/users?limit=1000", headers={
+            "Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]
+        })
+        assert not_modified.status_code == 304
+        assert (not_modified.headers["etag"], not_modified.headers["vary"]) == (
+            response.headers["etag"], response.headers["vary"])
+
+        response = client.get("/users/export?chunk_size=50", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert len(response.text.splitlines()) == 203
+
+        assert "content-encoding" not in client.get("/health", headers={"Accept-Encoding": "gzip"}).headers
+
+    def test_export_invalid_format(self):
+        """测试不支持的导出格式"""
+        response = client.get("/users/export?format=xml")
+        assert response.status_code == 422
+
 class TestUserSearch:
     """用户搜索测试"""
     
     def test_search_users(self):
         """测试搜索用户"""
         # 搜索现有用户
-        response = client.get("/users/search/张")
+        response = client.get("/users/search/张三")
         assert response.status_code == 200
         data = response.json()
         assert data["success"] == True
@@ -213,6 +399,77 @@ class TestUserSearch:
         assert data["success"] == True
         assert data["data"]["count"] == 0
 
+class TestConditionalRequests:
+    """ETag / If-None-Match 测试"""
+
+    def test_users_not_modified(self, sample_user):
+        """测试列表未变化时返回304，修改后ETag改变"""
+        response = client.get("/users")
+        etag = response.headers["etag"]
+        assert etag.startswith('W/"') and response.headers["cache-control"] == "no-cache"
+
+        response = client.get("/users", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        assert response.headers["vary"] == "Accept-Encoding"
+        # 弱比较与多个候选值
+        assert client.get("/users", headers={"If-None-Match": f'"other", {etag[2:]}'}).status_code == 304
+        # 不同分页参数的 ETag 不同
+        assert client.get("/users?limit=1").headers["etag"] != etag
+
+        client.post("/users", json=sample_user)
+        response = client.get("/users", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    def test_user_etag_is_per_user(self):
+        """测试单个用户的ETag只随该用户的修改变化"""
+        etag1 = client.get("/users/1").headers["etag"]
+        etag2 = client.get("/users/2").headers["etag"]
+        assert etag1 != etag2
+
+        client.put("/users/2", json={"age": 31})
+        assert client.get("/users/1", headers={"If-None-Match": etag1}).status_code == 304
+        response = client.get("/users/2", headers={"If-None-Match": etag2})
+        assert response.status_code == 200
+        assert response.json()["data"]["age"] == 31
+
+        client.delete("/users/1")
+        assert client.get("/users/1", headers={"If-None-Match": etag1}).status_code == 404
+
+    def test_search_not_modified(self):
+        """测试搜索结果未变化时返回304"""
+        etag = client.get("/users/search/张三").headers["etag"]
+        assert client.get("/users/search/张三", headers={"If-None-Match": etag}).status_code == 304
+        # ETag 包含关键词和字段参数，不能用于其它搜索结果
+        assert client.get("/users/search/李四").headers["etag"] != etag
+        assert client.get("/users/search/张三?fields=id").headers["etag"] != etag
+        assert client.get("/users/search/李四", headers={"If-None-Match": etag}).status_code == 200
+        client.put("/users/1", json={"name": "张三丰"})
+        assert client.get("/users/search/张三", headers={"If-None-Match": etag}).status_code == 200
+
+class TestResponseCache:
+    """响应缓存测试"""
+
+    def test_cached_reads_stay_consistent(self, sample_user):
+        """测试重复读取命中缓存，修改后立即失效"""
+        from utils.cache import response_cache
+        for path in ("/users?limit=10", "/users/search/张三", "/users/age-range/20/30"):
+            first = client.get(path)
+            hits = response_cache.hits
+            second = client.get(path)
+            assert response_cache.hits == hits + 1
+            assert second.content == first.content
+            assert second.headers["content-type"] == "application/json"
+
+        client.post("/users", json=sample_user)
+        response = client.get("/users?limit=10")
+        assert response.json()["data"]["total"] == 4
+
+        stats = client.get("/stats").json()["data"]["response_cache"]
+        assert stats["hits"] >= 3 and stats["invalidations"] >= 1
+
 class TestAgeRange:
     """年龄范围查询测试"""
     
@@ -228,6 +485,43 @@ class TestAgeRange:
         assert data["data"]["age_range"]["min"] == 20
         assert data["data"]["age_range"]["max"] == 30
 
+    def test_count_users_by_age_range(self):
+        """测试按年龄范围统计用户数"""
+        response = client.get("/users/age-range/20/30/count")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["success"] == True
+        listed = client.get("/users/age-range/20/30").json()
+        assert data["data"]["count"] == listed["data"]["count"]
+
+        response = client.get("/users/age-range/30/20/count")
+        assert response.status_code == 400
+
+    def test_large_range_is_streamed(self, monkeypatch):
+        """测试匹配的用户较多时流式返回，响应结构与整体构造时相同"""
+        import app as app_module
+        monkeypatch.setattr(app_module, "AGE_RANGE_STREAM_MIN", 0)
+
+        def not_streamed(min_age, max_age):
+            raise AssertionError("应从迭代器流式返回")
+
+        # 不读缓存，也不整体构造用户列表
+        from utils.cache import response_cache
+        response_cache.clear()
+        expected = user_service.get_users_by_age_range(0, 150)
+        monkeypatch.setattr(user_service, "get_users_by_age_range", not_streamed)
+        response = client.get("/users/age-range/0/150")
+        assert response.status_code == 200
+        assert response.json() == {
+            "success": True,
+            "message": "获取年龄在0-150岁的用户成功",
+            "data": {"age_range": {"min": 0, "max": 150}, "users": expected, "count": len(expected)},
+            "error": None,
+        }
+
+        empty = client.get("/users/age-range/149/150").json()
+        assert empty["data"] == {"age_range": {"min": 149, "max": 150}, "users": [], "count": 0}
+
     def test_age_range_invalid(self):
         """测试无效年龄范围"""
         # 最小年龄大于最大年龄
@@ -279,6 +573,59 @@ class TestPerformance:
         assert process_time > 0
         assert process_time < 1.0  # 响应时间应该小于1秒
 
+    def test_function_timings_in_stats(self):
+        """测试端点耗时直方图出现在统计信息中"""
+        client.get("/users")
+        timings = client.get("/stats").json()["data"]["function_timings"]
+        assert timings["get_users"]["count"] >= 1
+        assert 0 < timings["get_users"]["p50_ms"] <= timings["get_users"]["max_ms"]
+
+    def test_route_stats(self):
+        """测试按路由模板统计"""
+        client.get("/users/1")
+        client.get("/users/999999")
+        routes = client.get("/stats/routes").json()["data"]["routes"]
+        route = next(r for r in routes if r["method"] == "GET" and r["route"] == "/users/{user_id}")
+        assert route["status"]["2xx"] >= 1
+        assert route["status"]["4xx"] >= 1
+        assert not any(r["route"] == "/users/1" for r in routes)
+
+    def test_prometheus_metrics(self):
+        """测试 Prometheus 指标端点"""
+        client.get("/users")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'http_requests_total{method="GET",route="/users",status="2xx"}' in response.text
+        assert f"app_users {len(DEFAULT_USERS)}" in response.text
+
+    def test_timer_sync_and_async(self):
+        """测试 timer 同时支持同步和异步函数"""
+        import asyncio
+        from utils.helpers import timer
+        from utils.metrics import function_timings
+
+        @timer
+        def timed_sync(x):
+            return x * 2
+
+        @timer
+        async def timed_async(x):
+            return x * 3
+
+        assert timed_sync(2) == 4
+        assert asyncio.run(timed_async(2)) == 6
+        assert function_timings.get("timed_sync").snapshot()["count"] == 1
+        assert function_timings.get("timed_async").snapshot()["count"] == 1
+
+    def test_json_backends_consistent(self):
+        """测试各JSON编码后端输出一致"""
+        from utils.responses import JSON_BACKENDS
+        payload = {"success": True, "data": {"users": [{"id": 1, "name": "张三", "age": None}]}}
+        for dumps in JSON_BACKENDS.values():
+            assert json.loads(dumps(payload)) == payload
+        assert client.get("/users/1").json()["data"]["id"] == 1
+
 if __name__ == "__main__":
     # 运行测试
     pytest.main([__file__, "-v"]) 
\ No newline at end of file
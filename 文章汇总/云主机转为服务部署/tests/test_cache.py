@@ -0,0 +1,58 @@
+import sys
+import os
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from utils.cache import ENTRY_OVERHEAD, ResponseCache
+
+class TestResponseCache:
+    """版本化响应缓存测试"""
+
+    def test_hit_and_miss(self):
+        """测试命中与未命中计数"""
+        cache = ResponseCache(1024 * 1024)
+        assert cache.get("a", "v1") is None
+        cache.put("a", "v1", b"body")
+        assert cache.get("a", "v1") == b"body"
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+        assert stats["bytes"] == 4 + ENTRY_OVERHEAD
+
+    def test_lru_eviction_by_bytes(self):
+        """测试按字节数淘汰最久未使用的条目"""
+        entry = 100
+        cache = ResponseCache(4 * (entry + ENTRY_OVERHEAD))
+        for key in "abcd":
+            cache.get(key, "v1")
+            cache.put(key, "v1", b"x" * entry)
+        cache.get("a", "v1")
+        cache.put("e", "v1", b"x" * entry)
+        assert cache.get("b", "v1") is None
+        assert cache.get("a", "v1") is not None
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] <= cache.max_bytes
+
+    def test_oversized_entry_not_cached(self):
+        """测试超过容量1/4的响应不缓存"""
+        cache = ResponseCache(4000)
+        cache.put("big", None, b"x" * 2000)
+        assert cache.stats()["entries"] == 0
+
+    def test_invalidated_by_version(self):
+        """测试数据版本变化后整体失效"""
+        cache = ResponseCache(1024 * 1024)
+        cache.get("a", "v1")
+        cache.put("a", "v1", b"old")
+        assert cache.get("a", "v2") is None
+        assert cache.stats()["invalidations"] == 1
+        # 按旧版本生成的结果在新版本生效后不再写入
+        cache.put("a", "v1", b"old")
+        assert cache.get("a", "v2") is None
+
+    def test_disabled(self):
+        """测试容量为0时关闭缓存"""
+        cache = ResponseCache(0)
+        cache.put("a", "v1", b"body")
+        assert cache.get("a", "v1") is None
+        assert not cache.stats()["enabled"]
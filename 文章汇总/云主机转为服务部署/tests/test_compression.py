@@ -0,0 +1,182 @@
+import pytest
+import sys
+import os
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+import gzip
+import threading
+import zlib
+
+from fastapi.testclient import TestClient
+
+from utils.compression import (
+    CompressionMiddleware, PrecompressedAsset, StreamEncoder, available_encodings, brotli,
+    negotiate_encoding, parse_accept_encoding, zstandard
+)
+
+BODY = ("{\"name\": \"张三\", \"email\": \"zhangsan@example.com\"}\n" * 200).encode("utf-8")
+
+def make_app(chunks, headers=None, status=200, media_type="application/json"):
+    """按 chunks 逐块发送响应体的最小 ASGI 应用"""
+
+    async def app(scope, receive, send):
+        raw = [(b"content-type", media_type.encode())]
+        raw += [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        if len(chunks) == 1:
+            raw.append((b"content-length", str(len(chunks[0])).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": raw})
+        for i, chunk in enumerate(chunks):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks) - 1})
+
+    return app
+
+def raw_get(app, encoding: str, **kwargs):
+    """发送请求并返回未解码的响应体"""
+    client = TestClient(CompressionMiddleware(app, **kwargs))
+    with client.stream("GET", "/", headers={"Accept-Encoding": encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+class TestNegotiation:
+    """Accept-Encoding 协商测试"""
+
+    def test_parse_q_values(self):
+        """测试解析 q 值"""
+        assert parse_accept_encoding("gzip;q=0.5, br, *;q=0") == {"gzip": 0.5, "br": 1.0, "*": 0.0}
+        assert parse_accept_encoding(None) == {}
+
+    def test_negotiate(self):
+        """测试按 q 值与服务端偏好选择编码"""
+        assert negotiate_encoding("gzip, deflate, br", ("br", "gzip")) == "br"
+        assert negotiate_encoding("gzip;q=1, br;q=0.5", ("br", "gzip")) == "gzip"
+        assert negotiate_encoding("br;q=0, *", ("br", "gzip")) == "gzip"
+        assert negotiate_encoding("identity", ("br", "gzip")) is None
+        assert negotiate_encoding(None, ("gzip",)) is None
+
+class TestPrecompressedAsset:
+    """预压缩静态内容测试"""
+
+    @pytest.fixture
+    def asset(self):
+        return PrecompressedAsset(("<p>你好</p>" * 200).encode("utf-8"), "text/html")
+
+    def test_variants(self, asset):
+        """测试按 Accept-Encoding 返回对应版本"""
+        identity = asset.response(None)
+        assert "content-encoding" not in identity.headers
+        compressed = asset.response("gzip")
+        assert compressed.headers["content-encoding"] == "gzip"
+        assert gzip.decompress(compressed.body) == identity.body
+        assert compressed.headers["etag"] != identity.headers["etag"]
+        assert compressed.headers["vary"] == "Accept-Encoding"
+
+    @pytest.mark.skipif(brotli is None, reason="未安装 brotli")
+    def test_brotli_preferred(self, asset):
+        """测试客户端同时接受时优先返回 br"""
+        response = asset.response("gzip, br")
+        assert response.headers["content-encoding"] == "br"
+        assert brotli.decompress(response.body) == asset.response(None).body
+
+    def test_not_modified(self, asset):
+        """测试 If-None-Match 命中返回304"""
+        etag = asset.response("gzip").headers["etag"]
+        response = asset.response("gzip", etag)
+        assert response.status_code == 304
+        assert response.body == b""
+
+    def test_incompressible_body_served_as_is(self):
+        """测试压缩后不变小的内容只保留原始版本"""
+        asset = PrecompressedAsset(b"x", "text/plain")
+        assert asset.encodings == ()
+        assert "content-encoding" not in asset.response("gzip, br").headers
+
+class TestStreamEncoder:
+    """增量压缩测试"""
+
+    @pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+    def test_each_chunk_is_decodable(self, encoding):
+        """测试每块输出都能立即解码出已输入的全部数据"""
+        if encoding == "br" and brotli is None or encoding == "zstd" and zstandard is None:
+            pytest.skip(f"未安装 {encoding} 依赖")
+        encoder = StreamEncoder(encoding)
+        if encoding == "gzip":
+            decoder = zlib.decompressobj(31)
+            decode = decoder.decompress
+        elif encoding == "br":
+            decode = brotli.Decompressor().process
+        else:
+            decode = zstandard.ZstdDecompressor().decompressobj().decompress
+        chunks = [BODY[i:i + 1000] for i in range(0, len(BODY), 1000)]
+        for chunk in chunks:
+            assert decode(encoder.compress(chunk)) == chunk
+        assert decode(encoder.compress(b"", final=True)) == b""
+
+class TestCompressionMiddleware:
+    """响应压缩中间件测试"""
+
+    def test_compresses_large_body(self):
+        """测试超过阈值的响应被压缩，Content-Length 为压缩后长度，强ETag变为弱ETag"""
+        app = make_app([BODY], headers={"ETag": '"abc"'})
+        response, raw = raw_get(app, "gzip")
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"] == 'W/"abc"'
+        assert int(response.headers["content-length"]) == len(raw) < len(BODY)
+        assert gzip.decompress(raw) == BODY
+
+    def test_small_body_not_compressed(self):
+        """测试小于阈值的响应原样返回"""
+        app = make_app([BODY[:500]])
+        response, raw = raw_get(app, "gzip")
+        assert "content-encoding" not in response.headers
+        assert raw == BODY[:500]
+
+    def test_passthrough(self):
+        """测试已编码、不可压缩类型、304 与客户端不接受压缩时透传"""
+        app = make_app([BODY], headers={"Content-Encoding": "br"})
+        assert raw_get(app, "gzip")[1] == BODY
+        app = make_app([BODY], media_type="image/png")
+        assert "content-encoding" not in raw_get(app, "gzip")[0].headers
+        app = make_app([b""], status=304)
+        assert "content-encoding" not in raw_get(app, "gzip")[0].headers
+        app = make_app([BODY])
+        assert raw_get(app, "identity")[1] == BODY
+        assert raw_get(app, "gzip", encodings=())[1] == BODY
+
+    def test_streaming_compressed_per_chunk(self):
+        """测试流式响应逐块压缩（不带 Content-Length），小块也压缩"""
+        chunks = [BODY[i:i + 300] for i in range(0, len(BODY), 300)]
+        app = make_app(chunks)
+        response, raw = raw_get(app, "gzip")
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert gzip.decompress(raw) == BODY
+
+    def test_large_chunks_compressed_in_thread(self, monkeypatch):
+        """测试大块数据在线程池中压缩"""
+        threads = []
+        original = StreamEncoder.compress
+
+        def record(self, data, final=False):
+            threads.append(threading.current_thread())
+            return original(self, data, final)
+
+        monkeypatch.setattr(StreamEncoder, "compress", record)
+        app = make_app([BODY])
+        raw_get(app, "gzip", thread_min_size=len(BODY) + 1)
+        raw_get(app, "gzip", thread_min_size=len(BODY))
+        assert threads[0] is not threads[1]
+
+    @pytest.mark.skipif(zstandard is None, reason="未安装 zstandard")
+    def test_zstd(self):
+        """测试 zstd 编码"""
+        app = make_app([BODY])
+        response, raw = raw_get(app, "zstd, gzip", encodings=("zstd", "gzip"))
+        assert response.headers["content-encoding"] == "zstd"
+        assert zstandard.ZstdDecompressor().decompressobj().decompress(raw) == BODY
+
+    def test_available_encodings(self):
+        """测试配置中未安装的编码被忽略"""
+        assert available_encodings("gzip, unknown") == ("gzip",)
+        assert available_encodings("") == ()
@@ -0,0 +1,334 @@
+import pytest
+import sys
+import os
+import asyncio
+import base64
+import json
+import random
+import sqlite3
+import subprocess
+import tempfile
+from urllib.parse import parse_qsl
+
+# 添加src目录到Python路径
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+sys.path.insert(0, SRC_DIR)
+
+# 使用临时数据文件，避免读到之前运行留下的用户
+_data_dir = tempfile.mkdtemp()
+os.environ.setdefault("USER_DATA_FILE", os.path.join(_data_dir, "users.json"))
+
+import handler
+from mangum import Mangum
+from utils import events
+from utils.events import EventNormalizer, normalize_event
+
+@pytest.fixture(autouse=True)
+def event_loop_for_mangum():
+    """Mangum 使用 asyncio.get_event_loop()，其它测试中的 asyncio.run 结束后需要重新设置事件循环"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield
+    asyncio.set_event_loop(None)
+    loop.close()
+
+class TestColdStart:
+    """冷启动相关行为测试"""
+
+    def test_import_is_lazy(self):
+        """测试导入 handler 时不加载 FastAPI 应用"""
+        code = "import sys, handler; print('fastapi' in sys.modules, handler._asgi_handler is None)"
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=SRC_DIR, capture_output=True, text=True, check=True
+        ).stdout
+        assert output.split() == ["False", "True"]
+
+    def test_handler_created_once(self):
+        """测试 Mangum 处理器每个容器只创建一次"""
+        assert handler.get_asgi_handler() is handler.get_asgi_handler()
+
+    def test_warmup_event(self):
+        """测试预热事件只完成初始化"""
+        assert handler.lambda_handler({"source": "serverless-plugin-warmup"}, None) == {"warmed": True}
+        assert handler._asgi_handler is not None
+
+class TestLambdaHandler:
+    """API Gateway 事件处理测试"""
+
+    def test_get_users(self):
+        """测试 GET 请求"""
+        response = handler.lambda_handler(handler.api_gateway_event("GET", "/users", query={"limit": "1"}), None)
+        assert response["statusCode"] == 200
+        assert len(json.loads(response["body"])["data"]["users"]) == 1
+
+    def test_create_user(self):
+        """测试带请求体的 POST 请求"""
+        body = json.dumps({"name": "冷启动", "email": "coldstart@example.com", "age": 30})
+        response = handler.serverless_handler(handler.api_gateway_event("POST", "/users", body), None)
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"])["data"]["email"] == "coldstart@example.com"
+
+    def test_sampled_logging(self, monkeypatch, capsys):
+        """测试默认不输出事件，调试模式下输出"""
+        event = handler.api_gateway_event("GET", "/health")
+        handler.serverless_handler(event, None)
+        assert "收到事件" not in capsys.readouterr().out
+        monkeypatch.setattr(handler, "HANDLER_DEBUG", True)
+        handler.serverless_handler(event, None)
+        assert "收到事件" in capsys.readouterr().out
+
+    def test_after_restore(self):
+        """测试快照恢复后重新生成存储 epoch"""
+        from app import user_service
+        epoch = user_service.storage.epoch
+        handler.after_restore()
+        assert user_service.storage.epoch != epoch
+        assert handler.lambda_handler(handler.api_gateway_event("GET", "/health"), None)["statusCode"] == 200
+
+def sqs_event(*bodies) -> dict:
+    """构造 SQS 批量事件（消息体为对象时序列化为JSON）"""
+    return {"Records": [
+        {"messageId": f"m{i}", "eventSource": "aws:sqs",
+         "body": body if isinstance(body, str) else json.dumps(body, ensure_ascii=False)}
+        for i, body in enumerate(bodies)
+    ]}
+
+class TestBatchHandler:
+    """队列批量事件处理测试"""
+
+    @pytest.fixture(autouse=True)
+    def reset_users(self):
+        """每个测试前恢复默认示例数据"""
+        from app import user_service
+        from services.storage import DEFAULT_USERS
+        user_service.users_db = [dict(user) for user in DEFAULT_USERS]
+        return user_service
+
+    MIXED = (
+        {"op": "create", "user": {"name": "赵六", "email": "zhaoliu@example.com", "age": 40}},
+        {"op": "create", "user": {"name": "无效", "email": "invalid", "age": 40}},
+        "not json",
+        {"op": "update", "id": 2, "user": {"age": 31}},
+        {"op": "update", "id": 99, "user": {"age": 31}},
+        {"op": "delete"},
+        {"op": "delete", "id": 3},
+    )
+
+    def test_partial_failures(self, reset_users):
+        """测试逐条返回结果；无法处理的消息默认不重新投递"""
+        response = handler.batch_handler(sqs_event(*self.MIXED), None)
+        assert response["batchItemFailures"] == []
+        results = response["results"]
+        assert [r["itemIdentifier"] for r in results] == [f"m{i}" for i in range(7)]
+        assert [r["success"] for r in results] == [True, False, False, True, False, False, True]
+        assert not any(r.get("retryable") for r in results)
+        assert results[0]["data"]["email"] == "zhaoliu@example.com"
+        assert results[1]["error"] == "邮箱格式不正确"
+        assert results[4]["error"] == "用户不存在"
+        assert results[5]["error"] == "delete 操作缺少 id"
+        assert reset_users.get_user_by_id(2)["age"] == 31
+        assert reset_users.get_user_by_id(3) is None
+
+    def test_retry_invalid(self, reset_users, monkeypatch):
+        """测试 BATCH_RETRY_INVALID 开启后无法处理的消息也重新投递（进入死信队列）"""
+        monkeypatch.setattr(handler, "BATCH_RETRY_INVALID", True)
+        response = handler.batch_handler(sqs_event(*self.MIXED), None)
+        assert response["batchItemFailures"] == [{"itemIdentifier": f"m{i}"} for i in (1, 2, 4, 5)]
+
+    @pytest.mark.parametrize("backend,retryable", [("memory", False), ("sqlite", True)])
+    def test_storage_error(self, reset_users, monkeypatch, tmp_path, backend, retryable):
+        """测试存储异常不影响其它消息；只有已完整回滚的（SQLite）才按可重试放入 batchItemFailures"""
+        if backend == "sqlite":
+            from services.storage import SQLiteUserStorage
+            monkeypatch.setattr(reset_users, "storage", SQLiteUserStorage(str(tmp_path / "users.db")))
+        storage = reset_users.storage
+        original = storage.insert
+
+        def flaky_insert(user):
+            if user["email"] == "locked@example.com":
+                raise sqlite3.OperationalError("database is locked")
+            return original(user)
+
+        monkeypatch.setattr(storage, "insert", flaky_insert)
+        response = handler.batch_handler(sqs_event(
+            {"op": "create", "user": {"name": "锁定", "email": "locked@example.com", "age": 40}},
+            {"op": "create", "user": {"name": "正常", "email": "ok@example.com", "age": 40}},
+        ), None)
+        assert response["batchItemFailures"] == ([{"itemIdentifier": "m0"}] if retryable else [])
+        assert response["results"][0]["retryable"] is retryable
+        assert reset_users.get_user_by_email("ok@example.com") is not None
+
+    def test_flush_failure_rolls_back_batch(self, reset_users, monkeypatch):
+        """测试整批持久化失败时撤销整批修改并抛出异常，由队列重新投递整批消息"""
+        storage = reset_users.storage
+        before = reset_users.get_all_users()
+
+        def failing_write(path, content):
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(storage, "_atomic_write", failing_write)
+        monkeypatch.setattr(storage, "_append_log", lambda records: failing_write(storage.log_file, ""))
+        with pytest.raises(OSError):
+            handler.batch_handler(sqs_event(
+                {"op": "create", "user": {"name": "赵六", "email": "zhaoliu@example.com", "age": 40}},
+                {"op": "update", "id": 1, "user": {"email": "new@example.com"}},
+                {"op": "delete", "id": 2},
+            ), None)
+        assert reset_users.get_all_users() == before
+        assert reset_users.get_user_by_email("zhangsan@example.com")["id"] == 1
+
+    def test_single_flush(self, reset_users, monkeypatch):
+        """测试整批只持久化一次"""
+        storage = reset_users.storage
+        writes = []
+
+        def counting(original):
+            def wrapper(*args, **kwargs):
+                writes.append(1)
+                return original(*args, **kwargs)
+            return wrapper
+
+        for method in ("_write_snapshot", "_append_log"):
+            monkeypatch.setattr(storage, method, counting(getattr(storage, method)))
+        response = handler.batch_handler(sqs_event(*(
+            {"op": "create", "user": {"name": f"队列{i}", "email": f"queue{i}@example.com", "age": 20}}
+            for i in range(50)
+        )), None)
+        assert response["batchItemFailures"] == []
+        assert len(writes) == 1
+        assert reset_users.count_users() == 53
+
+    def test_kafka_envelope(self, reset_users):
+        """测试 Kafka 批量事件（base64 编码的消息值），损坏的消息值只影响该条"""
+        value = base64.b64encode(json.dumps({"op": "delete", "id": 1}).encode()).decode()
+        event = {"eventSource": "aws:kafka", "records": {"users-0": [
+            {"partition": 0, "offset": 7, "value": value},
+            {"partition": 0, "offset": 8, "value": "not-base64!"},
+            {"partition": 0, "offset": 9, "value": base64.b64encode(b"\xff\xfe").decode()},
+            {"partition": 0, "offset": 10},
+            {"partition": 0, "offset": 11, "value": value},
+        ]}}
+        response = handler.batch_handler(event, None)
+        assert response["batchItemFailures"] == []
+        results = response["results"]
+        assert [r["itemIdentifier"] for r in results] == [f"users-0:{i}" for i in range(7, 12)]
+        assert [r["success"] for r in results] == [True, False, False, False, False]
+        assert results[4]["error"] == "用户不存在"
+        assert reset_users.get_user_by_id(1) is None
+
+    def test_unknown_envelope(self):
+        """测试不支持的事件格式"""
+        with pytest.raises(ValueError):
+            handler.batch_handler({"foo": []}, None)
+
+async def echo_app(scope, receive, send):
+    """回显请求的最小 ASGI 应用"""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    headers = dict((k.decode(), v.decode()) for k, v in scope["headers"])
+    payload = json.dumps({
+        "method": scope["method"],
+        "path": scope["path"],
+        "query": sorted(parse_qsl(scope["query_string"].decode(), keep_blank_values=True)),
+        "x-test": headers.get("x-test"),
+        "body": base64.b64encode(body).decode(),
+    }).encode()
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": payload})
+
+def random_request(rng: random.Random) -> dict:
+    """随机生成一个 HTTP 请求（请求体为 UTF-8 文本，含中文与转义字符）"""
+    alphabet = "abcxyz019-_ 张三é\"\\/{}:,\n"
+    text = lambda n: "".join(rng.choice(alphabet) for _ in range(n))
+    return {
+        "method": rng.choice(["GET", "POST", "PUT", "PATCH", "DELETE"]),
+        "path": "/" + "/".join(text(rng.randint(1, 6)).replace("/", "").replace(" ", "") or "x"
+                               for _ in range(rng.randint(1, 3))),
+        "query": {f"k{i}": text(rng.randint(0, 5)) for i in range(rng.randint(0, 3))},
+        "header": text(rng.randint(1, 8)).replace("\n", "").strip() or "h",
+        "body": rng.choice(["", text(rng.randint(1, 40)), json.dumps({"name": text(5), "age": rng.randint(1, 150)},
+                                                                     ensure_ascii=rng.random() < 0.5)]),
+    }
+
+def provider_events(request: dict) -> dict:
+    """同一请求在各云平台上的事件格式"""
+    body, headers = request["body"], {"X-Test": request["header"]}
+    encoded = base64.b64encode(body.encode()).decode()
+    query = request["query"] or None
+    return {
+        "aws": {
+            "resource": "/{proxy+}", "httpMethod": request["method"], "path": request["path"],
+            "headers": headers, "queryStringParameters": query, "body": body or None,
+            "isBase64Encoded": False, "requestContext": {"requestId": "r1", "identity": {"sourceIp": "1.2.3.4"}},
+        },
+        "tencent": {
+            "httpMethod": request["method"], "path": request["path"], "headers": headers,
+            "headerParameters": {}, "pathParameters": {}, "queryString": request["query"],
+            "queryStringParameters": {}, "stageVariables": {}, "body": body,
+            "requestContext": {"serviceId": "service-1", "path": request["path"], "httpMethod": request["method"],
+                               "requestId": "r1", "sourceIp": "1.2.3.4", "stage": "release"},
+        },
+        "huawei": {
+            "httpMethod": request["method"], "path": request["path"], "headers": headers,
+            "pathParameters": {}, "queryStringParameters": request["query"], "body": encoded,
+            "isBase64Encoded": True, "requestContext": {"apiId": "api-1", "requestId": "r1", "stage": "RELEASE"},
+        },
+        "direct": {
+            "method": request["method"], "path": request["path"], "headers": headers,
+            "queryStringParameters": query, "body": body,
+        },
+    }
+
+class TestEventNormalizer:
+    """各云平台事件规范化测试"""
+
+    def test_fuzz_equivalence(self):
+        """测试同一请求的各平台事件经规范化后得到完全相同的 ASGI 请求"""
+        asgi = Mangum(echo_app, lifespan="off")
+        rng = random.Random(2024)
+        for _ in range(200):
+            request = random_request(rng)
+            responses = {
+                name: json.loads(asgi(normalize_event(event, None), None)["body"])
+                for name, event in provider_events(request).items()
+            }
+            expected = {
+                "method": request["method"], "path": request["path"],
+                "query": [list(item) for item in sorted(request["query"].items())], "x-test": request["header"],
+                "body": base64.b64encode(request["body"].encode()).decode(),
+            }
+            for name, echoed in responses.items():
+                assert echoed == expected, (name, request)
+
+    def test_adapter_cached_per_shape(self, monkeypatch):
+        """测试每种事件结构只识别一次"""
+        normalizer = EventNormalizer()
+        calls = []
+        monkeypatch.setattr(events, "detect_adapter", lambda event: calls.append(1) or events.gateway_adapter)
+        request = random_request(random.Random(1))
+        for _ in range(3):
+            normalizer(provider_events(request)["huawei"])
+        assert len(calls) == 1
+
+    def test_body_passthrough(self):
+        """测试请求体不做解析和重新编码（字符串请求体不会被再次 JSON 编码）"""
+        body = '{"name": "张三", "age": 25}'
+        event = normalize_event({"body": body, "headers": {}}, None)
+        assert event["body"] == body.encode()
+        assert (event["httpMethod"], event["path"]) == ("POST", "/")
+        # 直接调用时传入的对象只序列化一次
+        assert json.loads(normalize_event({"body": {"age": 25}}, None)["body"]) == {"age": 25}
+        aws_event = provider_events(random_request(random.Random(2)))["aws"]
+        assert normalize_event(aws_event, None) is aws_event
+
+    def test_tencent_direct_invocation(self):
+        """测试腾讯云直接调用的事件创建用户"""
+        body = json.dumps({"name": "腾讯", "email": "tencent@example.com", "age": 30}, ensure_ascii=False)
+        response = handler.tencent_handler({"path": "/users", "headers": {"Content-Type": "application/json"},
+                                            "body": body}, None)
+        assert response["statusCode"] == 200
+        assert json.loads(response["body"])["data"]["name"] == "腾讯"
@@ -0,0 +1,169 @@
+import pytest
+import sys
+import os
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+import random
+import threading
+import time
+
+from utils.helpers import PerformanceMonitor
+from utils.metrics import (
+    HDR_BUCKET_COUNT, OVERFLOW_ROUTE, UNMATCHED_ROUTE, HistogramRegistry, RouteMetrics,
+    hdr_index, hdr_quantiles, hdr_upper
+)
+from utils.prometheus import render_metrics
+
+class TestHdrBuckets:
+    """HDR 分桶测试"""
+
+    def test_buckets_are_contiguous(self):
+        """测试桶上界严格递增，相邻桶之间没有空隙"""
+        uppers = [hdr_upper(i) for i in range(HDR_BUCKET_COUNT)]
+        assert uppers == sorted(set(uppers))
+        for value in [0, 1, 127, 128, 1000, 123_456, 10 ** 9]:
+            index = hdr_index(value)
+            lower = hdr_upper(index - 1) + 1 if index else 0
+            assert lower <= value <= hdr_upper(index)
+
+    def test_relative_error(self):
+        """测试桶宽相对误差不超过 1/64"""
+        rng = random.Random(1)
+        for _ in range(10000):
+            value = rng.randint(1, 10 ** 10)
+            assert (hdr_upper(hdr_index(value)) - value) / value <= 1 / 64
+
+    def test_quantiles(self):
+        """测试分位数"""
+        counts = [0] * HDR_BUCKET_COUNT
+        for value in range(1, 101):
+            counts[hdr_index(value)] += 1
+        assert hdr_quantiles(counts, 100, (0.5, 0.9, 1.0)) == [50, 90, 100]
+
+class TestPerformanceMonitor:
+    """性能监控测试"""
+
+    def test_percentiles(self):
+        """测试延迟分位数与最大值"""
+        monitor = PerformanceMonitor()
+        for ms in range(1, 1001):
+            monitor.record_request(ms / 1000, is_error=ms % 100 == 0)
+        stats = monitor.get_stats()
+        assert stats["total_requests"] == 1000
+        assert stats["total_errors"] == 10
+        assert stats["error_rate"] == 1.0
+        latency = stats["latency_ms"]
+        assert latency["p50"] == pytest.approx(500, rel=1 / 64)
+        assert latency["p99"] == pytest.approx(990, rel=1 / 64)
+        assert latency["p99.9"] <= latency["max"] == 1000
+
+    def test_throughput_windows(self):
+        """测试滑动窗口吞吐量只统计窗口内的请求"""
+        monitor = PerformanceMonitor()
+        monitor._started -= 1000
+        now = time.perf_counter()
+        for _ in range(120):
+            monitor.record_request(0.001, now=now - 200)
+        for _ in range(60):
+            monitor.record_request(0.001, now=now)
+        throughput = monitor.get_stats()["throughput_rps"]
+        assert throughput["1m"] == 1.0
+        assert throughput["5m"] == pytest.approx(180 / 300)
+        assert throughput["15m"] == pytest.approx(180 / 900)
+
+    def test_concurrent_recording(self):
+        """测试多线程并发记录不丢失计数"""
+        monitor = PerformanceMonitor()
+
+        def worker():
+            for _ in range(10000):
+                monitor.record_request(0.002)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert monitor.get_stats()["total_requests"] == 80000
+
+class TestRouteMetrics:
+    """按路由统计测试"""
+
+    def test_status_classes_and_error_rate(self):
+        """测试状态码类别与错误率"""
+        metrics = RouteMetrics()
+        for status in (200, 200, 404, 500):
+            metrics.record("GET", "/users/{user_id}", status, 0.01)
+        metrics.record("GET", None, 404, 0.001)
+        routes = {(r["method"], r["route"]): r for r in metrics.snapshot()}
+        route = routes[("GET", "/users/{user_id}")]
+        assert route["requests"] == 4
+        assert route["status"] == {"2xx": 2, "4xx": 1, "5xx": 1}
+        assert route["error_rate"] == 25.0
+        assert route["client_error_rate"] == 25.0
+        assert route["latency_ms"]["p50"] == pytest.approx(10, rel=1 / 64)
+        assert routes[("GET", UNMATCHED_ROUTE)]["requests"] == 1
+
+    def test_cardinality_is_bounded(self):
+        """测试序列数超过上限后归入溢出序列，未知方法归为 OTHER"""
+        metrics = RouteMetrics(max_series=3)
+        for i in range(10):
+            metrics.record("GET", f"/route{i}", 200, 0.001)
+        metrics.record("BREW", "/route0", 200, 0.001)
+        routes = {(r["method"], r["route"]): r["requests"] for r in metrics.snapshot()}
+        assert len(routes) == 4
+        assert routes[("*", OVERFLOW_ROUTE)] == 8
+
+    def test_merges_thread_shards(self):
+        """测试多线程记录后合并"""
+        metrics = RouteMetrics()
+
+        def worker():
+            for _ in range(1000):
+                metrics.record("POST", "/users", 200, 0.002)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert metrics.snapshot()[0]["requests"] == 4000
+
+class TestPrometheus:
+    """Prometheus 文本格式测试"""
+
+    def render(self):
+        routes = RouteMetrics()
+        routes.record("GET", "/users/{user_id}", 200, 0.003)
+        routes.record("GET", "/users/{user_id}", 404, 0.02)
+        flushes = HistogramRegistry()
+        flushes.get("snapshot").observe(0.004)
+        return render_metrics(routes, HistogramRegistry(), flushes, in_flight=2, user_count=42)
+
+    def test_samples(self):
+        """测试计数器、仪表盘与直方图样本"""
+        lines = self.render().splitlines()
+        assert 'http_requests_total{method="GET",route="/users/{user_id}",status="2xx"} 1' in lines
+        assert 'http_requests_total{method="GET",route="/users/{user_id}",status="4xx"} 1' in lines
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/users/{user_id}",le="0.005"} 1' in lines
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/users/{user_id}",le="+Inf"} 2' in lines
+        assert 'storage_flush_duration_seconds_count{operation="snapshot"} 1' in lines
+        assert "http_requests_in_flight 2" in lines
+        assert "app_users 42" in lines
+
+    def test_histogram_buckets_are_cumulative(self):
+        """测试直方图桶计数单调不减"""
+        values = [int(line.rsplit(" ", 1)[1]) for line in self.render().splitlines()
+                  if line.startswith("http_request_duration_seconds_bucket")]
+        assert values == sorted(values)
+
+    def test_every_family_has_type(self):
+        """测试每个样本都属于已声明类型的指标族"""
+        text = self.render()
+        families = {line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")}
+        for line in text.splitlines():
+            if not line.startswith("#"):
+                name = line.split("{")[0].split(" ")[0]
+                assert any(name == f or name.startswith(f + "_") for f in families), name
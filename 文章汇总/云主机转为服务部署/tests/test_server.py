@@ -0,0 +1,81 @@
+import pytest
+import sys
+import os
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+import signal
+import socket
+import subprocess
+import time
+import urllib.request
+
+from server import pick_implementations
+
+PROJECT_ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="多进程服务器需要 os.fork")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except OSError:
+        return 0
+
+@pytest.fixture
+def server(tmp_path):
+    """以 2 个 worker 启动多进程服务器"""
+    port = free_port()
+    env = dict(os.environ, USER_DB_PATH=str(tmp_path / "users.db"), USER_DATA_FILE=str(tmp_path / "users.json"))
+    process = subprocess.Popen(
+        [sys.executable, "run.py", "--serve", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "2", "--max-requests", "20", "--graceful-timeout", "5"],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while get(f"{url}/health") != 200:
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            pytest.fail(process.communicate()[0])
+        time.sleep(0.2)
+    yield process, url
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+class TestPreforkServer:
+    """多进程服务器测试"""
+
+    def test_implementations(self):
+        """测试事件循环与HTTP解析器的选择"""
+        loop, http = pick_implementations()
+        assert loop in ("uvloop", "asyncio")
+        assert http in ("httptools", "h11")
+
+    def test_reload_and_max_requests_without_downtime(self, server):
+        """测试 worker 达到请求上限与 SIGHUP 滚动重启期间服务不中断，SIGTERM 后正常退出"""
+        process, url = server
+        statuses = [get(f"{url}/health") for _ in range(60)]
+        # 等待达到上限的 worker 退出并被替换
+        time.sleep(1)
+        statuses += [get(f"{url}/health") for _ in range(20)]
+        process.send_signal(signal.SIGHUP)
+        # 滚动重启期间持续请求
+        deadline = time.time() + 3
+        while time.time() < deadline:
+            statuses.append(get(f"{url}/users"))
+        assert set(statuses) == {200}
+
+        process.send_signal(signal.SIGTERM)
+        output = process.communicate(timeout=30)[0]
+        assert process.returncode == 0
+        assert "已退出" in output
+        assert "滚动重启完成" in output
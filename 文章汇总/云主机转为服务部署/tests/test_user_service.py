@@ -0,0 +1,793 @@
+import pytest
+import sys
+import os
+import json
+
+# 添加src目录到Python路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+import random
+import threading
+
+from services.api_service import UserService
+from services.storage import MemoryUserStorage, SQLiteUserStorage
+from services.indexes import AgeIndex, NGramIndex
+from models.schemas import CreateUserRequest, UpdateUserRequest
+from utils.helpers import iter_csv, iter_ndjson, parse_fields
+from services.storage import USER_COLUMNS
+from services import storage as storage_module
+
+@pytest.fixture
+def data_file(tmp_path, monkeypatch):
+    """隔离的数据文件"""
+    path = tmp_path / "users.json"
+    monkeypatch.setenv("USER_DATA_FILE", str(path))
+    monkeypatch.setenv("USER_DB_PATH", str(tmp_path / "users.db"))
+    return path
+
+@pytest.fixture(params=["memory", "sqlite"])
+def service(request, data_file, monkeypatch):
+    """使用默认示例数据的服务实例（每种存储后端各跑一遍）"""
+    monkeypatch.setenv("USER_STORAGE_BACKEND", request.param)
+    service = UserService()
+    yield service
+    service.storage.close()
+
+class TestUserIndexes:
+    """ID / 邮箱索引测试"""
+
+    def test_default_users(self, service):
+        """测试默认示例数据"""
+        assert [u["id"] for u in service.get_all_users()] == [1, 2, 3]
+        assert service.count_users() == 3
+
+    def test_get_user_by_id(self, service):
+        """测试按ID查找"""
+        assert service.get_user_by_id(2)["name"] == "李四"
+        assert service.get_user_by_id(999) is None
+
+    def test_create_user_assigns_monotonic_ids(self, service):
+        """测试ID单调递增，删除后不复用"""
+        user = service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        assert user["id"] == 4
+        assert service.delete_user(4)
+        user = service.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        assert user["id"] == 5
+
+    def test_duplicate_email_ignores_case(self, service):
+        """测试邮箱唯一性（忽略大小写）"""
+        with pytest.raises(ValueError):
+            service.create_user(CreateUserRequest(name="重复", email="ZhangSan@Example.com", age=20))
+
+    def test_update_email_moves_index(self, service):
+        """测试更新邮箱后索引同步"""
+        service.update_user(1, UpdateUserRequest(email="new@example.com"))
+        assert service.get_user_by_email("NEW@example.com")["id"] == 1
+        assert service.get_user_by_email("zhangsan@example.com") is None
+        # 旧邮箱可以被其他用户使用
+        user = service.create_user(CreateUserRequest(name="新张三", email="zhangsan@example.com", age=20))
+        assert service.get_user_by_email("zhangsan@example.com")["id"] == user["id"]
+
+    def test_update_email_conflict(self, service):
+        """测试更新为他人邮箱"""
+        with pytest.raises(ValueError):
+            service.update_user(1, UpdateUserRequest(email="lisi@example.com"))
+        # 更新为自己的邮箱不算冲突
+        assert service.update_user(1, UpdateUserRequest(email="zhangsan@example.com"))["id"] == 1
+
+    def test_delete_user(self, service):
+        """测试删除用户"""
+        assert service.delete_user(1)
+        assert not service.delete_user(1)
+        assert service.get_user_by_id(1) is None
+        assert service.get_user_by_email("zhangsan@example.com") is None
+        assert service.count_users() == 2
+
+    def test_reload(self, service):
+        """测试持久化后重新加载"""
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        service.delete_user(4)
+        reloaded = UserService()
+        assert reloaded.get_all_users() == service.get_all_users()
+        reloaded.storage.close()
+
+    def test_snapshot_file(self, data_file):
+        """测试snapshot模式写出的JSON文件"""
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        snapshot = json.loads(data_file.read_text(encoding="utf-8"))
+        assert snapshot == {"next_id": 5, "users": service.get_all_users()}
+
+    def test_legacy_snapshot_file(self, data_file):
+        """测试加载旧版本的快照（只有用户列表）"""
+        data_file.write_text(json.dumps([{"id": 7, "name": "旧", "email": "old@example.com", "age": 30}]),
+                             encoding="utf-8")
+        service = UserService()
+        assert [u["id"] for u in service.get_all_users()] == [7]
+        assert service.create_user(CreateUserRequest(name="新", email="new@example.com", age=30))["id"] == 8
+
+    @pytest.mark.parametrize("mode", ["snapshot", "wal"])
+    def test_ids_not_reused_after_restart(self, data_file, monkeypatch, mode):
+        """测试删除最大ID后重启（含 WAL 压缩后），ID仍不会被复用"""
+        monkeypatch.setenv("USER_DATA_MODE", mode)
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        service.delete_user(4)
+        if mode == "wal":
+            service.storage.compact()
+        service.storage.close()
+
+        reloaded = UserService()
+        user = reloaded.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        assert user["id"] == 5
+        reloaded.storage.close()
+
+    def test_pagination(self, service):
+        """测试分页"""
+        assert [u["id"] for u in service.get_all_users(offset=1, limit=1)] == [2]
+        assert [u["id"] for u in service.get_all_users(offset=1)] == [2, 3]
+        assert service.get_all_users(offset=10, limit=5) == []
+
+    def test_cursor_pagination(self, service):
+        """测试游标分页，翻页期间删除用户不会错位"""
+        for i in range(5):
+            service.create_user(CreateUserRequest(name=f"用户{i}", email=f"page{i}@example.com", age=20))
+        first = service.get_users_after(0, 3)
+        assert [u["id"] for u in first] == [1, 2, 3]
+        service.delete_user(2)
+        service.delete_user(4)
+        assert [u["id"] for u in service.get_users_after(first[-1]["id"], 3)] == [5, 6, 7]
+        assert service.get_users_after(8, 3) == []
+
+    def test_update_ignores_null_fields(self, service):
+        """测试更新时 null 字段视为未提供"""
+        user = service.update_user(1, UpdateUserRequest(name="张三丰", email=None))
+        assert user == {"id": 1, "name": "张三丰", "email": "zhangsan@example.com", "age": 25}
+
+    def test_search_and_age_range(self, service):
+        """测试搜索与年龄范围结果不变"""
+        assert [u["id"] for u in service.search_users("LISI")] == [2]
+        assert [u["id"] for u in service.get_users_by_age_range(26, 30)] == [2, 3]
+
+class TestVersions:
+    """数据版本号测试"""
+
+    def test_versions_bumped_on_mutation(self, service):
+        """测试修改递增全局版本号，单个用户的版本号只随自身修改变化"""
+        tag, tag1, tag2 = service.version_tag(), service.user_version_tag(1), service.user_version_tag(2)
+        user = service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        assert service.version_tag() != tag
+        assert service.user_version_tag(user["id"]) is not None
+
+        tag = service.version_tag()
+        service.update_user(2, UpdateUserRequest(age=31))
+        assert service.version_tag() != tag
+        assert service.user_version_tag(2) != tag2
+        assert service.user_version_tag(1) == tag1
+
+        tag = service.version_tag()
+        service.delete_user(1)
+        assert service.version_tag() != tag
+        assert service.user_version_tag(1) is None
+
+    def test_failed_writes_keep_version(self, service):
+        """测试失败的写操作不改变版本号"""
+        tag = service.version_tag()
+        with pytest.raises(ValueError):
+            service.create_user(CreateUserRequest(name="重复", email="lisi@example.com", age=20))
+        assert service.update_user(999, UpdateUserRequest(age=20)) is None
+        assert not service.delete_user(999)
+        assert service.version_tag() == tag
+
+    def test_replace_all_never_reuses_tag(self, service):
+        """测试重建数据后版本标识不与之前重复"""
+        tag = service.version_tag()
+        service.users_db = [dict(u) for u in service.users_db]
+        assert service.version_tag() != tag
+
+class TestWalPersistence:
+    """追加写日志持久化测试"""
+
+    @pytest.fixture
+    def wal_env(self, data_file, monkeypatch):
+        monkeypatch.setenv("USER_DATA_MODE", "wal")
+        return data_file, data_file.with_name("users.json.log")
+
+    def test_mutations_append_log(self, wal_env):
+        """测试每次修改追加一行日志，不重写快照"""
+        data_file, log_file = wal_env
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        service.update_user(4, UpdateUserRequest(age=41))
+        service.delete_user(1)
+
+        assert not data_file.exists()
+        records = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+        assert [r["op"] for r in records] == ["create", "update", "delete"]
+
+    def test_replay_log(self, wal_env):
+        """测试重启后重放日志"""
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        service.update_user(2, UpdateUserRequest(email="lisi2@example.com"))
+        service.delete_user(4)
+
+        reloaded = UserService()
+        assert reloaded.get_all_users() == service.get_all_users()
+        assert reloaded.get_user_by_email("lisi2@example.com")["id"] == 2
+        # 删除的最大ID也不会被复用
+        user = reloaded.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        assert user["id"] == 5
+
+    def test_compaction(self, wal_env, monkeypatch):
+        """测试日志超过阈值后压缩为快照"""
+        data_file, log_file = wal_env
+        monkeypatch.setenv("USER_DATA_LOG_MAX_BYTES", "512")
+        service = UserService()
+        for i in range(20):
+            service.create_user(CreateUserRequest(name=f"用户{i}", email=f"u{i}@example.com", age=20))
+
+        assert data_file.exists()
+        assert log_file.stat().st_size < 512
+        assert UserService().get_all_users() == service.get_all_users()
+        assert not [p for p in data_file.parent.iterdir() if p.name.startswith(".tmp-")]
+
+    def test_failed_snapshot_keeps_log(self, wal_env, monkeypatch):
+        """测试压缩时快照写入失败不会清空日志，重启后仍能重放全部修改"""
+        data_file, log_file = wal_env
+        monkeypatch.setenv("USER_DATA_LOG_MAX_BYTES", "512")
+        service = UserService()
+
+        def failing_write(path, content):
+            if path == str(data_file):
+                raise OSError("No space left on device")
+            return original_write(path, content)
+
+        original_write = service.storage._atomic_write
+        monkeypatch.setattr(service.storage, "_atomic_write", failing_write)
+        for i in range(20):
+            service.create_user(CreateUserRequest(name=f"用户{i}", email=f"u{i}@example.com", age=20))
+        with pytest.raises(OSError):
+            service.storage.compact()
+
+        assert not data_file.exists()
+        assert log_file.stat().st_size >= 512
+        assert UserService().get_all_users() == service.get_all_users()
+        assert UserService().count_users() == 23
+
+    def test_torn_tail_is_ignored(self, wal_env):
+        """测试崩溃留下的半行记录被忽略"""
+        _, log_file = wal_env
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write('{"op":"create","user":{"id":5,')
+
+        reloaded = UserService()
+        assert reloaded.get_all_users() == service.get_all_users()
+        # 之后追加的记录不会和半行记录粘在一起
+        reloaded.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        assert UserService().get_all_users() == reloaded.get_all_users()
+
+    def test_failed_append_rolls_back(self, wal_env, monkeypatch):
+        """测试日志写入失败时撤销内存修改、截断半行，之后的写入和重放正常"""
+        _, log_file = wal_env
+        service = UserService()
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        before = service.get_all_users()
+        log_size = log_file.stat().st_size
+
+        storage = service.storage
+        original_open = storage._open_log
+
+        def failing_open():
+            handle = original_open()
+
+            def write(text):
+                # 只写出一半就失败（磁盘已满）
+                handle.buffer.write(text[:len(text) // 2].encode("utf-8"))
+                handle.buffer.flush()
+                raise OSError("No space left on device")
+            handle.write = write
+            return handle
+
+        storage.close()
+        monkeypatch.setattr(storage, "_open_log", failing_open)
+        with pytest.raises(OSError):
+            service.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        with pytest.raises(OSError):
+            service.update_user(1, UpdateUserRequest(email="new@example.com"))
+        with pytest.raises(OSError):
+            service.delete_user(2)
+
+        assert service.get_all_users() == before
+        assert service.get_user_by_email("zhangsan@example.com")["id"] == 1
+        assert service.get_user_by_email("new@example.com") is None
+        assert log_file.stat().st_size == log_size
+
+        monkeypatch.setattr(storage, "_open_log", original_open)
+        user = service.create_user(CreateUserRequest(name="钱七", email="qianqi@example.com", age=41))
+        assert user["id"] == 5
+        assert UserService().get_all_users() == service.get_all_users()
+
+    def test_invalid_records_are_skipped(self, wal_env):
+        """测试缺少字段的日志记录被跳过，不影响启动和其余记录"""
+        _, log_file = wal_env
+        log_file.write_text("\n".join([
+            '{"op":"create"}',
+            '{"op":"update","id":1}',
+            '{"op":"delete"}',
+            '["op","delete"]',
+            '{"op":"delete","id":2}',
+        ]) + "\n", encoding="utf-8")
+
+        assert [u["id"] for u in UserService().get_all_users()] == [1, 3]
+
+class TestBulkOperations:
+    """批量操作测试"""
+
+    def test_bulk_create_reports_per_item_errors(self, service):
+        """测试批量创建逐条报告错误"""
+        created, errors = service.bulk_create([
+            {"name": "赵六", "email": "zhaoliu@example.com", "age": 40},
+            {"name": "重复", "email": "LISI@example.com", "age": 20},
+            {"name": "批内重复", "email": "zhaoliu@example.com", "age": 21},
+            {"name": "钱七", "email": "qianqi@example.com", "age": 41},
+        ])
+        assert [u["id"] for u in created] == [4, 5]
+        assert [e["index"] for e in errors] == [1, 2]
+        assert service.count_users() == 5
+        reloaded = UserService()
+        assert reloaded.get_all_users() == service.get_all_users()
+        reloaded.storage.close()
+
+    def test_bulk_update_and_delete(self, service):
+        """测试批量更新与删除"""
+        updated, errors = service.bulk_update([
+            {"id": 1, "age": 50},
+            {"id": 2, "email": "zhangsan@example.com"},
+            {"id": 99, "age": 20},
+        ])
+        assert [u["id"] for u in updated] == [1]
+        assert [(e["index"], e["error"]) for e in errors] == [(1, "邮箱已存在"), (2, "用户不存在")]
+        assert service.get_user_by_id(2)["email"] == "lisi@example.com"
+
+        deleted, errors = service.bulk_delete([1, 3, 99])
+        assert deleted == [1, 3]
+        assert [e["id"] for e in errors] == [99]
+        assert [u["id"] for u in service.get_all_users()] == [2]
+
+    def test_apply_operations(self, service):
+        """测试按顺序执行混合操作并逐条返回结果"""
+        results = service.apply_operations([
+            {"op": "create", "user": {"name": "赵六", "email": "zhaoliu@example.com", "age": 28}},
+            {"op": "update", "id": 4, "user": {"age": 29}},
+            {"op": "create", "user": {"name": "重复", "email": "zhaoliu@example.com", "age": 30}},
+            {"op": "delete", "id": 99},
+            {"op": "delete", "id": 1},
+        ])
+        assert [r["success"] for r in results] == [True, True, False, False, True]
+        assert [r.get("error") for r in results[2:4]] == ["邮箱已存在", "用户不存在"]
+        assert service.get_user_by_id(4)["age"] == 29
+        assert service.get_user_by_id(1) is None
+
+    def test_get_users_by_ids(self, service):
+        """测试批量获取保持输入顺序并返回不存在的ID（超过单条语句占位符上限时分段查询）"""
+        users, missing = service.get_users_by_ids([3, 99, 1])
+        assert [u["id"] for u in users] == [3, 1]
+        assert missing == [99]
+
+        service.bulk_create([
+            {"name": f"用户{i}", "email": f"many{i}@example.com", "age": 20} for i in range(2000)
+        ])
+        ids = list(range(2100, 0, -1))
+        users, missing = service.get_users_by_ids(ids)
+        assert [u["id"] for u in users] == list(range(2003, 0, -1))
+        assert missing == list(range(2100, 2003, -1))
+
+    @pytest.mark.parametrize("mode", ["snapshot", "wal"])
+    def test_single_flush_per_batch(self, data_file, monkeypatch, mode):
+        """测试整批只持久化一次"""
+        monkeypatch.setenv("USER_DATA_MODE", mode)
+        storage = MemoryUserStorage()
+        writes = []
+        method = "_write_snapshot" if mode == "snapshot" else "_append_log"
+        original = getattr(storage, method)
+
+        def counting(*args, **kwargs):
+            writes.append(1)
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(storage, method, counting)
+
+        service = UserService(storage)
+        service.bulk_create([
+            {"name": f"用户{i}", "email": f"bulk{i}@example.com", "age": 20} for i in range(100)
+        ])
+        assert len(writes) == 1
+        assert UserService().count_users() == 103
+
+class TestProjection:
+    """字段投影测试"""
+
+    def test_parse_fields(self):
+        """测试解析字段参数：按固定顺序、总是包含ID、全部字段等同于不指定"""
+        assert parse_fields("name, age", USER_COLUMNS) == ("id", "name", "age")
+        assert parse_fields("email,id,email", USER_COLUMNS) == ("id", "email")
+        assert parse_fields("name,email,age", USER_COLUMNS) is None
+        assert parse_fields("", USER_COLUMNS) is None
+        with pytest.raises(ValueError):
+            parse_fields("id,password", USER_COLUMNS)
+
+    def test_projected_reads(self, service):
+        """测试列表、游标分页与搜索只返回指定字段"""
+        fields = ("id", "name")
+        assert service.get_all_users(limit=2, fields=fields) == [
+            {"id": 1, "name": "张三"}, {"id": 2, "name": "李四"}
+        ]
+        assert service.get_users_after(1, 1, ("id", "age")) == [{"id": 2, "age": 30}]
+        assert service.search_users("wangwu", fields) == [{"id": 3, "name": "王五"}]
+        # 投影不影响存储中的完整记录
+        assert service.get_user_by_id(1)["email"] == "zhangsan@example.com"
+
+class TestExport:
+    """流式导出测试"""
+
+    def test_chunks_cover_all_users(self, service):
+        """测试分块遍历覆盖全部用户且每块不超过 chunk_size"""
+        service.bulk_create([
+            {"name": f"用户{i}", "email": f"export{i}@example.com", "age": 20} for i in range(10)
+        ])
+        chunks = list(service.iter_user_chunks(chunk_size=4))
+        assert [len(c) for c in chunks] == [4, 4, 4, 1]
+        assert [u["id"] for c in chunks for u in c] == list(range(1, 14))
+
+    def test_concurrent_delete_does_not_skip(self, service):
+        """测试导出过程中删除已导出的用户不会导致后续用户被跳过"""
+        chunks = service.iter_user_chunks(chunk_size=1)
+        exported = [u["id"] for u in next(chunks)]
+        service.delete_user(1)
+        exported += [u["id"] for c in chunks for u in c]
+        assert exported == [1, 2, 3]
+
+    def test_encoders(self, service):
+        """测试 NDJSON / CSV 编码"""
+        chunks = list(service.iter_user_chunks(chunk_size=2))
+        lines = b"".join(iter_ndjson(chunks)).decode("utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == service.get_all_users()
+
+        rows = b"".join(iter_csv(chunks, ("id", "name", "email", "age"))).decode("utf-8").splitlines()
+        assert rows[0] == "id,name,email,age"
+        assert rows[1] == "1,张三,zhangsan@example.com,25"
+        assert len(rows) == 4
+
+class TestSearchIndex:
+    """n-gram 搜索索引测试"""
+
+    def test_candidates(self):
+        """测试倒排列表求交集"""
+        index = NGramIndex()
+        index.add(1, ("张三丰", "zsf@example.com"))
+        index.add(2, ("张三", "zhangsan@example.com"))
+        assert index.candidates("张三") == {1, 2}
+        assert index.candidates("张三丰") == {1}
+        assert index.candidates("example") == {1, 2}
+        assert index.candidates("不存在") == set()
+        assert index.candidates("张") is None
+
+        index.remove(1, ("张三丰", "zsf@example.com"))
+        assert index.candidates("张三") == {2}
+        assert index.candidates("张三丰") == set()
+
+    def test_matches_linear_scan(self):
+        """测试随机增删改后结果与全表扫描一致"""
+        rng = random.Random(7)
+        chars = "张李王三四五丰abc@."
+        storage = MemoryUserStorage(mode="none")
+
+        def random_text():
+            return "".join(rng.choice(chars) for _ in range(rng.randint(1, 8)))
+
+        for step in range(500):
+            ids = [u["id"] for u in storage.list_users()]
+            action = rng.random()
+            if action < 0.5 or not ids:
+                try:
+                    storage.insert({"name": random_text(), "email": random_text(), "age": 20})
+                except ValueError:
+                    pass
+            elif action < 0.8:
+                field = rng.choice(["name", "email"])
+                try:
+                    storage.update(rng.choice(ids), {field: random_text()})
+                except ValueError:
+                    pass
+            else:
+                storage.delete(rng.choice(ids))
+
+            keyword = random_text()[:rng.randint(1, 4)].lower()
+            expected = [
+                u for u in storage.list_users()
+                if keyword in u["name"].lower() or keyword in u["email"].lower()
+            ]
+            assert storage.search(keyword) == expected
+
+    def test_search_case_insensitive(self, service):
+        """测试搜索忽略大小写"""
+        service.create_user(CreateUserRequest(name="Alice", email="Alice@Example.com", age=30))
+        assert [u["name"] for u in service.search_users("ALI")] == ["Alice"]
+        assert [u["id"] for u in service.search_users("EXAMPLE.COM")] == [1, 2, 3, 4]
+
+class TestAgeIndex:
+    """年龄索引测试"""
+
+    def test_iter_range_in_id_order(self):
+        """测试范围查询按ID顺序输出"""
+        index = AgeIndex()
+        for doc_id, age in [(1, 30), (2, 20), (3, 30), (4, 25), (5, 151)]:
+            index.add(age, doc_id)
+        assert list(index.iter_range(20, 30)) == [1, 2, 3, 4]
+        assert list(index.iter_range(26, 29)) == []
+        assert index.count_range(20, 30) == 4
+        assert index.count_range(0, 1000) == 5
+
+        index.remove(30, 1)
+        index.remove(25, 4)
+        assert list(index.iter_range(20, 30)) == [2, 3]
+        assert index.count_range(25, 25) == 0
+
+    def test_range_after(self):
+        """测试按ID游标分块取范围内的ID"""
+        index = AgeIndex()
+        for doc_id, age in [(1, 30), (2, 20), (3, 30), (4, 25), (5, 151), (6, 20)]:
+            index.add(age, doc_id)
+        assert index.range_after(20, 30, 0, 2) == [1, 2]
+        assert index.range_after(20, 30, 2, 2) == [3, 4]
+        assert index.range_after(20, 30, 4, 2) == [6]
+        assert index.range_after(20, 30, 6, 2) == []
+
+    def test_matches_linear_scan(self, service, monkeypatch):
+        """测试随机增删改后结果（包括分块流式读取）与全表扫描一致"""
+        monkeypatch.setattr(storage_module, "RANGE_CHUNK_SIZE", 3)
+        rng = random.Random(11)
+        for i in range(200):
+            action = rng.random()
+            ids = [u["id"] for u in service.get_all_users()]
+            if action < 0.5 or not ids:
+                service.create_user(CreateUserRequest(name=f"用户{i}", email=f"age{i}@example.com",
+                                                      age=rng.randint(1, 150)))
+            elif action < 0.8:
+                service.update_user(rng.choice(ids), UpdateUserRequest(age=rng.randint(1, 150)))
+            else:
+                service.delete_user(rng.choice(ids))
+
+            low = rng.randint(1, 150)
+            high = rng.randint(low, 150)
+            expected = [u for u in service.get_all_users() if low <= u["age"] <= high]
+            assert service.get_users_by_age_range(low, high) == expected
+            assert list(service.iter_users_by_age_range(low, high)) == expected
+            assert service.count_users_by_age_range(low, high) == len(expected)
+
+class TestConcurrency:
+    """并发读写测试"""
+
+    @pytest.fixture(params=["memory", "sqlite"])
+    def service(self, request, data_file, monkeypatch):
+        monkeypatch.setenv("USER_STORAGE_BACKEND", request.param)
+        monkeypatch.setenv("USER_DATA_MODE", "wal")
+        service = UserService()
+        yield service
+        service.storage.close()
+
+    @staticmethod
+    def run_threads(writers, readers=()):
+        """运行写线程直到结束，读线程持续读取直到写线程全部结束；返回线程中的异常"""
+        errors = []
+        stop = threading.Event()
+
+        def guard(target, *args):
+            try:
+                target(*args)
+            except Exception as e:
+                errors.append(e)
+
+        writer_threads = [threading.Thread(target=guard, args=(w,)) for w in writers]
+        reader_threads = [threading.Thread(target=guard, args=(r, stop)) for r in readers]
+        for t in writer_threads + reader_threads:
+            t.start()
+        for t in writer_threads:
+            t.join()
+        stop.set()
+        for t in reader_threads:
+            t.join()
+        return errors
+
+    def test_unique_emails(self, service):
+        """测试多线程并发创建相同邮箱时每个邮箱只成功一次"""
+        emails = [f"user{i}@example.com" for i in range(50)]
+        created = []
+
+        def creator(seed):
+            rng = random.Random(seed)
+
+            def run():
+                for email in rng.sample(emails, len(emails)):
+                    email = email.upper() if rng.random() < 0.5 else email
+                    try:
+                        created.append(service.create_user(CreateUserRequest(name="并发", email=email, age=30)))
+                    except ValueError:
+                        pass
+            return run
+
+        assert self.run_threads([creator(seed) for seed in range(8)]) == []
+        assert sorted(u["email"].lower() for u in created) == sorted(emails)
+        assert len({u["id"] for u in created}) == len(emails)
+        users = service.get_all_users()
+        assert len({u["email"].lower() for u in users}) == len(users) == service.count_users() == 3 + len(emails)
+
+    def test_no_lost_updates(self, service):
+        """测试并发更新同一用户的不同字段互不覆盖，读者看不到不一致的记录"""
+        rounds = 200
+
+        def rename():
+            for n in range(rounds):
+                service.update_user(1, UpdateUserRequest(name=f"用户{n}", email=f"user{n}@example.com"))
+
+        def set_age():
+            for n in range(rounds):
+                service.update_user(1, UpdateUserRequest(age=n % 100 + 1))
+
+        def churn():
+            for n in range(rounds):
+                user = service.create_user(CreateUserRequest(name="临时", email=f"tmp{n}@example.com", age=50))
+                assert service.delete_user(user["id"])
+
+        def reader(stop):
+            while not stop.is_set():
+                users = service.get_all_users() + service.search_users("user") + service.get_users_by_age_range(1, 150)
+                for user in users:
+                    if user["name"].startswith("用户"):
+                        assert user["email"] == f"user{user['name'][2:]}@example.com"
+                assert 1 <= service.get_user_by_id(1)["age"] <= 100
+                assert service.count_users_by_age_range(1, 150) >= 3
+
+        assert self.run_threads([rename, set_age, churn], [reader] * 4) == []
+        user = service.get_user_by_id(1)
+        assert user == {"id": 1, "name": f"用户{rounds - 1}", "email": f"user{rounds - 1}@example.com",
+                        "age": (rounds - 1) % 100 + 1}
+        assert service.count_users() == service.count_users_by_age_range(1, 150) == 3
+        assert service.get_user_by_email(f"USER{rounds - 1}@example.com")["id"] == 1
+        assert [u["id"] for u in service.search_users(f"user{rounds - 1}@")] == [1]
+        assert [u["id"] for u in service.get_users_by_age_range(user["age"], user["age"])] == [1]
+
+    def test_returned_records_are_snapshots(self, service):
+        """测试更新不会改写之前读到的记录"""
+        before = service.get_user_by_id(1)
+        service.update_user(1, UpdateUserRequest(name="张三更新"))
+        assert before["name"] == "张三"
+        assert service.get_user_by_id(1)["name"] == "张三更新"
+
+class TestSQLiteStorage:
+    """SQLite存储后端测试"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        return str(tmp_path / "shared.db")
+
+    def test_wal_mode_and_indexes(self, db_path):
+        """测试WAL模式与索引"""
+        storage = SQLiteUserStorage(db_path)
+        conn = storage._conn()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(users)")}
+        assert {"idx_users_email", "idx_users_age"} <= indexes
+        plan = " ".join(row[3] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM users WHERE age BETWEEN 20 AND 30"))
+        assert "idx_users_age" in plan
+        storage.close()
+
+    def test_shared_between_instances(self, db_path):
+        """测试多个实例（模拟多个worker进程）共享数据"""
+        first = UserService(SQLiteUserStorage(db_path))
+        second = UserService(SQLiteUserStorage(db_path))
+        user = first.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        assert second.get_user_by_id(user["id"]) == user
+        with pytest.raises(ValueError):
+            second.create_user(CreateUserRequest(name="重复", email="ZHAOLIU@example.com", age=20))
+        # 不会重复写入示例数据
+        assert second.count_users() == 4
+
+    def test_versions_shared_and_migrated(self, db_path):
+        """测试版本号在实例间共享，旧版本数据库自动补上版本号列"""
+        import sqlite3
+        conn = sqlite3.connect(db_path)
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, email TEXT NOT NULL,
+                                age INTEGER NOT NULL, name_lower TEXT NOT NULL, email_lower TEXT NOT NULL);
+            INSERT INTO users VALUES (1, '张三', 'zhangsan@example.com', 25, '张三', 'zhangsan@example.com');
+            CREATE TABLE user_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            INSERT INTO user_meta VALUES ('seeded', 1);
+        """)
+        conn.close()
+
+        first = UserService(SQLiteUserStorage(db_path))
+        second = UserService(SQLiteUserStorage(db_path))
+        assert first.version_tag() == second.version_tag()
+        assert first.user_version_tag(1) is not None
+        first.update_user(1, UpdateUserRequest(age=26))
+        assert second.version_tag() == first.version_tag()
+        assert second.user_version_tag(1) == first.user_version_tag(1) == first.version_tag()
+
+    def test_count_maintained_by_triggers(self, db_path):
+        """测试用户数由触发器维护（包括批量中回滚的条目与旧版本数据库）"""
+        service = UserService(SQLiteUserStorage(db_path))
+        service.bulk_create([
+            {"name": "赵六", "email": "zhaoliu@example.com", "age": 40},
+            {"name": "重复", "email": "lisi@example.com", "age": 20},
+        ])
+        service.delete_user(1)
+        assert service.count_users() == 3
+        service.users_db = [{"id": 10, "name": "甲乙", "email": "jiayi@example.com", "age": 30}]
+        assert service.count_users() == 1
+
+        # 模拟旧版本创建的数据库：没有计数行时按实际行数初始化
+        service.storage._conn().execute("DELETE FROM user_meta WHERE key = 'user_count'")
+        service.storage.close()
+        assert SQLiteUserStorage(db_path).count() == 1
+
+    def test_age_counts_maintained_by_triggers(self, db_path):
+        """测试每个年龄的用户数由触发器维护，旧版本数据库按现有数据统计一次"""
+        service = UserService(SQLiteUserStorage(db_path))
+        service.create_user(CreateUserRequest(name="赵六", email="zhaoliu@example.com", age=40))
+        service.update_user(1, UpdateUserRequest(age=40))
+        service.update_user(2, UpdateUserRequest(name="李四四"))
+        service.delete_user(3)
+        assert service.count_users_by_age_range(40, 40) == 2
+        assert service.count_users_by_age_range(20, 30) == 1
+
+        # 模拟旧版本创建的数据库：没有年龄计数
+        conn = service.storage._conn()
+        conn.execute("DELETE FROM age_counts")
+        conn.execute("DELETE FROM user_meta WHERE key = 'age_counts'")
+        service.storage.close()
+        assert SQLiteUserStorage(db_path).count_age_range(0, 150) == 3
+
+    def test_connection_per_thread(self, db_path):
+        """测试每个线程使用独立连接"""
+        storage = SQLiteUserStorage(db_path)
+        connections = []
+
+        def worker():
+            connections.append(storage._conn())
+            storage.count()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len({id(c) for c in connections}) == 4
+        storage.close()
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="需要 os.fork")
+    def test_reconnect_after_fork(self, db_path):
+        """测试 fork 出的子进程不复用父进程的连接"""
+        storage = SQLiteUserStorage(db_path)
+        parent_conn = storage._conn()
+        count = storage.count()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            ok = storage._conn() is not parent_conn and storage.count() == count
+            storage.insert({"id": 100, "name": "子进程", "email": "child@example.com", "age": 30})
+            os.write(write_fd, b"1" if ok else b"0")
+            os._exit(0)
+        os.close(write_fd)
+        assert os.read(read_fd, 1) == b"1"
+        os.waitpid(pid, 0)
+        os.close(read_fd)
+        assert storage.count() == count + 1
+        storage.close()
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])